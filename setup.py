@@ -1,6 +1,17 @@
 #!/usr/bin/env python
 
-from setuptools import setup, find_packages
+import os
+
+from setuptools import setup, find_packages, Extension
+
+# Native progressive CPA (Progressive-C Accel). Optional: if it fails to build, the
+# pure Python algorithms still work.
+cpa_accel = Extension(
+    'chipwhisperer.analyzer.attacks.cpa_algorithms._cpa_accel',
+    sources=['software/chipwhisperer/analyzer/attacks/cpa_algorithms/c_accel/cpa_accel.c'],
+    extra_compile_args=[] if os.name == 'nt' else ['-O3'],
+    optional=True,
+)
 
 setup(
     name='chipwhisperer',
@@ -14,6 +25,7 @@ setup(
     url='https://www.chipwhisperer.com',
     packages=find_packages('software'),
     package_dir={'': 'software'},
+    ext_modules=[cpa_accel],
     install_requires=[
         'configobj',
         'pyserial',
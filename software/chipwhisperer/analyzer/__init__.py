@@ -1,5 +1,8 @@
-from chipwhisperer.analyzer.attacks.snr import calculate_snr
+from chipwhisperer.analyzer.attacks.snr import calculate_snr, SNR
+from chipwhisperer.analyzer.attacks.tvla import TTest
+from chipwhisperer.analyzer.attacks.poi import PointsOfInterest, load_pois
 from chipwhisperer.analyzer.attacks import cpa_algorithms
+from chipwhisperer.analyzer.attacks import key_enumeration
 from chipwhisperer.analyzer import preprocessing
 from chipwhisperer.common.utils.util import camel_case_deprecated
 from chipwhisperer.common.api.ProjectFormat import Project
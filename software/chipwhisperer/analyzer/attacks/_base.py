@@ -27,6 +27,7 @@ import logging
 from chipwhisperer.common.utils.tracesource import PassiveTraceObserver
 from chipwhisperer.common.utils.parameter import setupSetParam
 from chipwhisperer.common.utils.util import camel_case_deprecated
+from .algorithmsbase import point_set
 
 def enforceLimits(value, limits):
     if value < limits[0]:
@@ -50,6 +51,7 @@ class AttackBaseClass(PassiveTraceObserver):
         self._tracePerAttack = 1
         self._reportingInterval = 10
         self._pointRange = (0,0)
+        self._subkeyPoints = {}
         self._targetSubkeys = []
         self._project = None
         self.useAbs = True
@@ -156,8 +158,7 @@ class AttackBaseClass(PassiveTraceObserver):
             startingTrace = self.get_traces_per_attack() * itNum + self.get_trace_start()
             endingTrace = startingTrace + self.get_traces_per_attack() - 1
 
-            # TODO:support start/end point different per byte
-            self.attack.addTraces(self.getTraceSource(), (startingTrace, endingTrace), progressBar, pointRange=self.get_point_range(None))
+            self.attack.addTraces(self.getTraceSource(), (startingTrace, endingTrace), progressBar, pointRange=self.get_attack_points())
 
         return self.attack.get_statistics()
 
@@ -216,6 +217,13 @@ class AttackBaseClass(PassiveTraceObserver):
 
     setReportingInterval = camel_case_deprecated(set_reporting_interval)
     def get_point_range(self, bnum=None):
+        """Return the points attacked, for subkey bnum if given.
+
+        The points of a subkey are the ones set with set_subkey_points(), or
+        the Points Range if none were set for it.
+        """
+        if bnum is not None and bnum in self._subkeyPoints:
+            return self._subkeyPoints[bnum]
         return self._pointRange
 
     getPointRange = camel_case_deprecated(get_point_range)
@@ -229,6 +237,37 @@ class AttackBaseClass(PassiveTraceObserver):
         self._pointRange = rng
 
     setPointRange = camel_case_deprecated(set_point_range)
+    def get_subkey_points(self):
+        """Return the dictionary of points set per subkey with set_subkey_points()"""
+        return dict(self._subkeyPoints)
+
+    def set_subkey_points(self, points):
+        """Attack each subkey on its own points instead of the whole Points Range.
+
+        Args:
+            points: Dictionary of subkey: points, or a list with the points of
+                each subkey, the points being a [start, end] range (list, tuple
+                or range()) or a numpy array of point indices (e.g. POIs).
+                Subkeys not given use the Points Range. None clears the points
+                of all subkeys.
+
+        Raises:
+            ValueError: Invalid or ambiguous points, see point_set()
+        """
+        if points is None:
+            self._subkeyPoints = {}
+            return
+        if not isinstance(points, dict):
+            points = dict(enumerate(points))
+        self._subkeyPoints = dict((int(bnum), point_set(p)) for bnum, p in points.items())
+
+    def get_attack_points(self):
+        """pointRange passed to the attack algorithm: the Points Range, or the points of each target subkey"""
+        if len(self._subkeyPoints) == 0:
+            return self._pointRange
+        pointRange = tuple(self._pointRange)
+        return dict((bnum, self._subkeyPoints.get(bnum, pointRange)) for bnum in self.get_target_subkeys())
+
     def known_key(self):
         """Get the known key via attack"""
         key = self.process_known_key(self.getTraceSource().get_known_key(self.get_trace_start()))
@@ -30,16 +30,102 @@ from chipwhisperer.common.utils.util import camel_case_deprecated
 from collections import OrderedDict
 
 
+class ResultsHistory(object):
+    """Bounded history of the best guesses of each subkey as traces are added.
+
+    For every trace count recorded, keeps the PGE and the top_k guesses (with
+    their point and correlation) of a subkey in preallocated arrays. Once
+    length entries are stored, every other entry is dropped, so the history
+    always spans the whole attack with older entries more thinly spread.
+
+    Args:
+        numSubkeys (int): Number of subkeys.
+        numPerms (int): Number of guesses per subkey.
+        top_k (int): Number of best guesses kept per entry. None keeps all.
+        length (int): Maximum entries kept per subkey. None keeps all.
+    """
+
+    def __init__(self, numSubkeys=16, numPerms=256, top_k=None, length=512):
+        self.numPerms = numPerms
+        self.top_k = numPerms if top_k is None else min(top_k, numPerms)
+        self.length = length
+        size = length if length else 64
+        self._count = [0]*numSubkeys
+        self._trace = [np.zeros(size, dtype=np.int64) for i in range(numSubkeys)]
+        self._pge = [np.zeros(size, dtype=np.float64) for i in range(numSubkeys)]
+        self._maxes = [np.zeros((size, self.top_k), dtype=[('hyp', 'i2'), ('point', 'i4'), ('value', 'f8')]) for i in range(numSubkeys)]
+
+    def record(self, bnum, tnum, pge, maxes):
+        """Record the PGE and sorted maxes of a subkey after tnum traces.
+
+        Recording the same trace count again replaces the last entry. An unknown
+        trace count (None) is stored as -1.
+        """
+        n = self._count[bnum]
+        tnum = -1 if tnum is None else tnum
+        if n == 0 or self._trace[bnum][n - 1] != tnum:
+            if n == len(self._trace[bnum]):
+                if self.length:
+                    #Full, thin out the older entries
+                    keep = np.arange(0, n, 2)
+                    n = len(keep)
+                    self._trace[bnum][:n] = self._trace[bnum][keep]
+                    self._pge[bnum][:n] = self._pge[bnum][keep]
+                    self._maxes[bnum][:n] = self._maxes[bnum][keep]
+                else:
+                    self._trace[bnum] = np.concatenate([self._trace[bnum], np.zeros_like(self._trace[bnum])])
+                    self._pge[bnum] = np.concatenate([self._pge[bnum], np.zeros_like(self._pge[bnum])])
+                    self._maxes[bnum] = np.concatenate([self._maxes[bnum], np.zeros_like(self._maxes[bnum])])
+            n += 1
+            self._count[bnum] = n
+
+        self._trace[bnum][n - 1] = tnum
+        self._pge[bnum][n - 1] = pge
+        self._maxes[bnum][n - 1] = maxes[:self.top_k]
+
+    def traces(self, bnum):
+        """Trace counts of the entries of a subkey (-1 where unknown)"""
+        return self._trace[bnum][:self._count[bnum]]
+
+    def pge(self, bnum):
+        """PGE of a subkey at each entry"""
+        return self._pge[bnum][:self._count[bnum]]
+
+    def maxes(self, bnum):
+        """(entries, top_k) best guesses of a subkey at each entry, best first"""
+        return self._maxes[bnum][:self._count[bnum]]
+
+    def correlations(self, bnum):
+        """(guesses, entries) peak correlation of every guess at each entry.
+
+        Guesses outside the top_k of an entry are NaN.
+        """
+        maxes = self.maxes(bnum)
+        corr = np.full((self.numPerms, len(maxes)), np.nan)
+        cols = np.repeat(np.arange(len(maxes)), maxes.shape[1])
+        corr[maxes['hyp'].ravel(), cols] = maxes['value'].ravel()
+        return corr
+
+
 class Results(object):
     """
     Results type used for attacks generating peaks indicating the 'best' success. Examples include
     standard DPA & CPA attacks.
+
+    The best guesses of each subkey are recorded in history (a ResultsHistory) every time
+    find_maximums() is called with more traces. Its size defaults to history_length and
+    history_top_k, which can be changed on the class before an attack creates its results,
+    or with set_history_size().
     """
+    history_length = 512
+    history_top_k = None
 
     def __init__(self, numSubkeys=16, numPerms=256):
         self.numSubkeys = numSubkeys
         self.numPerms = numPerms
         self.known_key = None
+        self.history_length = Results.history_length
+        self.history_top_k = Results.history_top_k
         self.clear()
 
     def key_guess(self):
@@ -85,15 +171,49 @@ class Results(object):
         for i in range(0, self.numSubkeys):
             self.maxes[i] = np.zeros(self.numPerms, dtype=[('hyp', 'i2'), ('point', 'i4'), ('value', 'f8')])
 
+        #Per-guess peaks, for attacks that only report the maximums of their diffs
+        self.peaks = [None]*self.numSubkeys
+
+        #Subkeys the attack stopped updating early, and why
+        self.stopped = [None]*self.numSubkeys
+
         #If maximum diffs are valid & sorted correctly
         self.maxValid = [False]*self.numSubkeys
         self.pge = [255]*self.numSubkeys
         self.diffs_tnum = [None]*self.numSubkeys
-        self.pge_total = []
-        self.maxes_list = [list() for i in range(0, self.numSubkeys)]
+        self.history = ResultsHistory(self.numSubkeys, self.numPerms, self.history_top_k, self.history_length)
 
         #TODO: Ensure this gets called by attack algorithms when rerunning
 
+    def set_history_size(self, length=512, top_k=None):
+        """Set how much of the progress of the attack is kept in history.
+
+        Clears the current history.
+
+        Args:
+            length (int): Maximum number of trace counts kept per subkey.
+                Older entries are thinned out past this. None keeps all.
+            top_k (int): Number of best guesses kept per entry. None keeps all.
+        """
+        self.history_length = length
+        self.history_top_k = top_k
+        self.history = ResultsHistory(self.numSubkeys, self.numPerms, top_k, length)
+
+    @property
+    def pge_total(self):
+        """PGE history as a list of {'trace', 'subkey', 'pge'} dictionaries"""
+        ret = []
+        for bnum in range(self.numSubkeys):
+            for tnum, pge in zip(self.history.traces(bnum), self.history.pge(bnum)):
+                ret.append({'trace':int(tnum) if tnum >= 0 else None, 'subkey':bnum, 'pge':pge})
+        return ret
+
+    @property
+    def maxes_list(self):
+        """History of maxes, as a list per subkey of {'trace', 'maxes'} dictionaries"""
+        return [[{'trace':int(tnum) if tnum >= 0 else None, 'maxes':maxes} for tnum, maxes in zip(self.history.traces(bnum), self.history.maxes(bnum))]
+                for bnum in range(self.numSubkeys)]
+
     def simple_PGE(self, bnum):
         """Returns the partial guessing entropy of subkey."""
         if self.maxValid[bnum] == False:
@@ -114,21 +234,78 @@ class Results(object):
 
         Args:
             bnum (int): The index of the subkey.
-            data (int): The new subkey byte.
-            copy (int):
+            data (array): (guesses x points) diffs of the subkey.
+            copy (bool): Store a copy of data. Attacks passing newly created
+                arrays can pass False to avoid the copy.
         """
         if (id(data) != id(self.diffs[bnum])) or force_update:
             self.maxValid[bnum] = False
 
             if data is not None and copy:
-                self.diffs[bnum] = data[:]
-                self.diffs_tnum[bnum] = tnum
+                self.diffs[bnum] = np.array(data)
+            elif data is not None:
+                self.diffs[bnum] = np.asarray(data)
             else:
                 self.diffs[bnum] = data
-                self.diffs_tnum[bnum] = tnum
+            self.diffs_tnum[bnum] = tnum
+            self.peaks[bnum] = None
 
     updateSubkey = camel_case_deprecated(update_subkey)
 
+    def update_subkey_peaks(self, bnum, data, offset=0, tnum=None, merge=False):
+        """Update the specific subkey with the peaks of diffs over a range of points.
+
+        Only the largest absolute and largest signed value of each guess (and
+        where they are) are kept, not the diffs themselves. Attacks that walk the
+        points in tiles call this once per tile with merge=True, so the result
+        covers all points without ever holding the full diffs.
+
+        Args:
+            bnum (int): The index of the subkey.
+            data (array): (guesses x points) diffs for points offset, offset+1, ...
+            offset (int): Index of the first point in data.
+            tnum (int): Number of traces the diffs were calculated from.
+            merge (bool): Merge with the peaks already stored for this subkey
+                instead of replacing them.
+        """
+        data = np.asarray(data, dtype=np.float64)
+        rows = np.arange(data.shape[0])
+        peaks = np.zeros(data.shape[0], dtype=[('abs', 'f8'), ('abspoint', 'i4'), ('max', 'f8'), ('maxpoint', 'i4')])
+
+        #Rows of NaN give a NaN peak, as np.nanmax does
+        for name, values in (('abs', np.fabs(data)), ('max', data)):
+            idx = np.argmax(np.where(np.isnan(values), -np.inf, values), axis=1)
+            peaks[name] = values[rows, idx]
+            peaks[name + 'point'] = idx + offset
+
+        old = self.peaks[bnum]
+        if merge and old is not None:
+            for name in ('abs', 'max'):
+                keep = (old[name] >= peaks[name]) | np.isnan(peaks[name])
+                peaks[name][keep] = old[name][keep]
+                peaks[name + 'point'][keep] = old[name + 'point'][keep]
+
+        self.peaks[bnum] = peaks
+        self.diffs[bnum] = None
+        self.diffs_tnum[bnum] = tnum
+        self.maxValid[bnum] = False
+
+    def set_subkey_stopped(self, bnum, tnum, reason):
+        """Record that the attack stopped updating a subkey.
+
+        Stored in stopped[bnum] as a dictionary with the number of traces
+        the subkey was attacked with ('trace'), why it was stopped ('reason',
+        such as 'pge' or 'stable') and the best guess at that point ('guess').
+
+        Args:
+            bnum (int): The index of the subkey.
+            tnum (int): Number of traces used before stopping.
+            reason (str): Why the subkey was stopped.
+        """
+        if not self.maxValid[bnum]:
+            self.find_maximums([bnum])
+        self.stopped[bnum] = {'trace':tnum, 'reason':reason, 'guess':self.maxes[bnum][0]['hyp']}
+
     def find_key(self, use_absolute=True):
         """ Find the best guess for the key from the attack.
 
@@ -173,8 +350,8 @@ class Results(object):
 
             print(attack_results.find_maximums()[4][0][2])
 
-        Note the "point location of the max" is normally not calculated/tracked,
-        and thus returns as a 0.
+        use_single is not available for subkeys updated with
+        update_subkey_peaks().
         """
         if bytelist is None:
             bytelist = list(range(0, self.numSubkeys))
@@ -182,39 +359,34 @@ class Results(object):
         # print useAbsolute
 
         for i in bytelist:
-            if self.diffs[i] is None:
+            if self.diffs[i] is None and self.peaks[i] is None:
                 self.maxValid[i] = False
                 continue
 
             if self.maxValid[i] == False:
-                for hyp in range(0, self.numPerms):
+                if self.diffs[i] is None:
+                    name = 'abs' if use_absolute else 'max'
+                    self.maxes[i]['hyp'] = np.arange(self.numPerms)
+                    self.maxes[i]['point'] = self.peaks[i][name + 'point']
+                    self.maxes[i]['value'] = self.peaks[i][name]
+                else:
+                    #All guesses in one pass over the (guesses x points) diffs
+                    data = np.reshape(self.diffs[i], (self.numPerms, -1))
                     if use_absolute:
-                        v = np.nanmax(np.fabs(self.diffs[i][hyp]))
-                    else:
-                        v = np.nanmax(self.diffs[i][hyp])
+                        data = np.fabs(data)
+                    point = np.argmax(np.where(np.isnan(data), -np.inf, data), axis=1)
+                    self.maxes[i]['hyp'] = np.arange(self.numPerms)
+                    self.maxes[i]['point'] = point
+                    self.maxes[i]['value'] = data[np.arange(self.numPerms), point]
 
-                    mvalue = v
-
-                    #Get maximum value for this hypothesis
-                    try:
-                        mindex = np.amin(np.where(v == mvalue))
-                    except ValueError:
-                        mindex = self.numPerms-1
-                    self.maxes[i][hyp]['hyp'] = hyp
-                    self.maxes[i][hyp]['point'] = mindex
-                    self.maxes[i][hyp]['value'] = mvalue
-
-                #TODO: why does this fail?
-                #self.maxes[i][np.isnan(self.maxes[i]['value'])]['value'] = 0
                 #TODO: workaround for PGE, as NaN's get ranked first
                 numnans = np.isnan(self.maxes[i]['value']).sum()
 
-                if use_single:
+                if use_single and self.diffs[i] is not None:
                     #All table values are taken from same point MAX is taken from
-                    where = self.maxes[i][0]['point']
-                    for j in range(0, self.numPerms):
-                        self.maxes[i][j]['point'] = where
-                        self.maxes[i][j]['value'] = self.diffs[i][self.maxes[i][j]['hyp']][where]
+                    where = self.maxes[i]['point'][np.nanargmax(self.maxes[i]['value'])] if numnans < self.numPerms else 0
+                    self.maxes[i]['point'] = where
+                    self.maxes[i]['value'] = np.reshape(self.diffs[i], (self.numPerms, -1))[:, where]
 
                 self.maxes[i][::-1].sort(order='value') # sorts nunpy array in place and in reverse order
                 self.maxValid[i] = True
@@ -227,11 +399,7 @@ class Results(object):
                     except IndexError:
                         self.pge[i] = self.numPerms-1
 
-            tnum = self.diffs_tnum[i]
-            self.pge_total.append({'trace':tnum, 'subkey':i, 'pge':self.pge[i]})
-
-            if len(self.maxes_list[i]) == 0 or self.maxes_list[i][-1]['trace'] != tnum:
-                self.maxes_list[i].append({'trace':tnum, 'maxes':np.array(self.maxes[i])})
+            self.history.record(i, self.diffs_tnum[i], self.pge[i], self.maxes[i])
 
         return self.maxes
 
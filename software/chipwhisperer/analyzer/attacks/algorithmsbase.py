@@ -25,10 +25,91 @@
 #    along with chipwhisperer.  If not, see <http://www.gnu.org/licenses/>.
 #=================================================
 
+import numpy as np
+
 from ._stats import Results
 from chipwhisperer.common.utils.parameter import Parameterized
 
 
+def point_set(points):
+    """Normalize the points attacked for one subkey.
+
+    As everywhere else, a list or tuple of two ints is a [start, end) range of
+    points, and so is a range(). Lists of point indices have to be given as a
+    numpy array (e.g. np.array(pois)), other lists and tuples are rejected as
+    ambiguous. Ranges are returned as (start, end) tuples, index lists as int
+    arrays (or as a range if the points are consecutive). None (all points)
+    is returned as is.
+
+    Raises:
+        ValueError: Invalid or ambiguous points
+    """
+    if points is None:
+        return None
+    if isinstance(points, range):
+        if points.step != 1:
+            points = np.asarray(points)
+        else:
+            points = (points.start, points.stop)
+    if isinstance(points, (list, tuple)):
+        if len(points) != 2 or not all(np.isscalar(p) for p in points):
+            raise ValueError("Points must be a [start, end] range or a numpy array of point indices, got %s" % (points,))
+        start, end = int(points[0]), int(points[1])
+        if not 0 <= start < end:
+            raise ValueError("Invalid point range [%d, %d)" % (start, end))
+        return (start, end)
+    points = np.asarray(points, dtype=int).ravel()
+    if len(points) == 0:
+        raise ValueError("No points given")
+    if np.any(points < 0):
+        raise ValueError("Point indices can't be negative")
+    if len(points) > 1 and np.all(np.diff(points) == 1):
+        return (int(points[0]), int(points[-1]) + 1)
+    return points
+
+
+def point_count(points, numpoints):
+    """Number of points in a set from point_set(), in traces of numpoints points"""
+    if points is None:
+        return numpoints
+    if isinstance(points, tuple):
+        return points[1] - points[0]
+    return len(points)
+
+
+def subkey_traces(traces, points):
+    """Return the traces and pointRange to pass to oneSubkey() for a set of points from point_set()
+
+    Ranges are passed on as the pointRange, index lists are gathered into a new array.
+    """
+    if points is None or isinstance(points, tuple):
+        return traces, points
+    return np.ascontiguousarray(np.asarray(traces)[:, points]), None
+
+
+def shift_block(data, offset=None):
+    """Shift a block of samples by the offset of the running sums it is added to.
+
+    The streaming statistics (SNR, LRA, second order CPA, templates) keep sums
+    of samples and of their squares or products over all blocks. Variances and
+    covariances are worked out as differences of these sums, which loses
+    precision to cancellation when the samples are far from zero. Taking every
+    sum around one fixed offset close to the mean, the mean of the first block,
+    keeps them small.
+
+    Args:
+        data: (traces x points) block of samples
+        offset: Offset of the sums, or None for the first block
+
+    Returns:
+        (shifted float64 block, offset)
+    """
+    data = np.asarray(data, dtype=np.float64)
+    if offset is None:
+        offset = np.mean(data, axis=0)
+    return data - offset, offset
+
+
 class AlgorithmsBase(Parameterized):
 
     def __init__(self):
@@ -75,3 +156,9 @@ class AlgorithmsBase(Parameterized):
 
     def addTraces(self, traceSource, tracerange, progressBar=None, pointRange=None):
         pass
+
+    def _check_single_range(self, pointRange):
+        """Raise for per-subkey points (a dict pointRange), for algorithms attacking all subkeys on one range"""
+        if isinstance(pointRange, dict):
+            raise ValueError("%s only supports one point range for all subkeys, clear the per-subkey points "
+                             "(set_subkey_points(None)) to use it" % self.__class__.__name__)
@@ -2,10 +2,18 @@
 
 Algorithms:
 * Progressive - Online calculation allowing feedback during attack. You probably want this.
+* ProgressiveVectorized - Same as Progressive, but evaluates all key guesses at once with matrix operations.
 * SimpleLoop - Simple attack loop. No feedback before end of attack
-* ProgressiveCAccel - Progressive with ctypes to increase speed. Experimental/untested.
+* SecondOrder - Progressive CPA on centered products of two windows of points, for masked implementations.
+* ProgressiveCAccel - Same as Progressive, with the running sums updated by a C extension built by setup.py.
+* DPA - Progressive difference of means on one bit of the leakage model.
+* LRA - Progressive linear regression of the leakage model on the points, solved for all guesses at once.
 """
 
 from .progressive import CPAProgressive as Progressive
+from .progressive_vectorized import CPAProgressive_Vectorized as ProgressiveVectorized
 from .simpleloop import CPASimpleLoop as SimpleLoop
+from .second_order import CPASecondOrder as SecondOrder
 from .progressive_caccel import CPAProgressive_CAccel as ProgressiveCAccel
+from .dpa import DPA
+from .lra import LRA
@@ -0,0 +1,235 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2020, NewAE Technology Inc
+# All rights reserved.
+#
+# Find this and more at newae.com - this file is part of the chipwhisperer
+# project, http://www.github.com/newaetech/chipwhisperer
+#
+#    This file is part of chipwhisperer.
+#
+#    chipwhisperer is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    chipwhisperer is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with chipwhisperer.  If not, see <http://www.gnu.org/licenses/>.
+#=================================================
+import multiprocessing
+import os
+import shutil
+import tempfile
+import traceback
+
+import numpy as np
+
+from ..algorithmsbase import point_count, subkey_traces
+
+
+def _open_buffer(desc, mode, cache):
+    """Open (or reuse) the memmap described by desc = (filename, shape, dtype)"""
+    if cache.get(mode) is None or cache[mode][0] != desc:
+        cache[mode] = (desc, np.memmap(desc[0], dtype=desc[2], mode=mode, shape=desc[1]))
+    return cache[mode][1]
+
+
+def _subkey_worker(conn, subkeyFactory, model, bnums, tileHypotheses):
+    """Worker process: owns the accumulators of the subkeys in bnums, until they are moved to another worker"""
+    cpa = {}
+    for bnum in bnums:
+        cpa[bnum] = subkeyFactory(model)
+        if tileHypotheses is not None:
+            cpa[bnum].tile_hyps = tileHypotheses()
+    buffers = {}
+
+    while True:
+        msg = conn.recv()
+        if msg is None:
+            break
+
+        try:
+            if msg[0] == 'give':
+                #Hand the state of an accumulator over, the model is reattached by the new owner
+                acc = cpa.pop(msg[1])
+                conn.send(('state', dict((k, v) for k, v in vars(acc).items() if k != 'model')))
+                continue
+            if msg[0] == 'reset':
+                #New tile: fresh accumulators, keeping the hypotheses of the trace blocks
+                for bnum in cpa:
+                    tile_hyps = getattr(cpa[bnum], 'tile_hyps', None)
+                    cpa[bnum] = subkeyFactory(model)
+                    if tile_hyps is not None:
+                        tile_hyps.rewind()
+                        cpa[bnum].tile_hyps = tile_hyps
+                conn.send(None)
+                continue
+            if msg[0] == 'take':
+                acc = subkeyFactory(model)
+                acc.__dict__.update(msg[2])
+                cpa[msg[1]] = acc
+                conn.send(None)
+                continue
+
+            tracedesc, diffdesc, slots, numtraces, textins, textouts, knownkeys, active, points = msg[1:]
+            traces = _open_buffer(tracedesc, 'r', buffers)[:numtraces]
+            diffs = _open_buffer(diffdesc, 'r+', buffers)
+            for bnum in sorted(cpa):
+                if bnum not in active:
+                    continue
+                (subtraces, pointRange) = subkey_traces(traces, points.get(bnum))
+                (data, _) = cpa[bnum].oneSubkey(bnum, pointRange, subtraces, numtraces, textins, textouts, knownkeys, None, cpa[bnum].modelstate, 0)
+                diffs[slots[bnum], :, :point_count(points.get(bnum), traces.shape[1])] = data
+            diffs.flush()
+            conn.send(None)
+        except Exception:
+            conn.send(traceback.format_exc())
+
+    conn.close()
+
+
+class SubkeyWorkerPool(object):
+    """Runs the per-subkey CPA accumulators of an attack in worker processes.
+
+    Each worker owns a share of the subkeys, so the running sums stay in the worker. Every trace
+    block is written once to a memmapped file which all workers map read-only, and each worker
+    writes its correlation results into a second shared memmap, so the only data sent through
+    the pipes are the (small) text/key arrays.
+
+    When subkeys stop (e.g. once their guess is stable), the subkeys still being attacked are
+    rebalanced before the next block: accumulators are moved from the busiest workers to the
+    idle ones, so the CPU time freed by stopped subkeys goes to the unresolved ones.
+
+    For tiled attacks, tileHypotheses (TileHypotheses) gives each accumulator a store for the
+    hypotheses of the trace blocks, which reset() keeps for the next tile.
+    """
+
+    def __init__(self, subkeyFactory, model, brange, processes, tileHypotheses=None):
+        if 'fork' in multiprocessing.get_all_start_methods():
+            # Models hold unpicklable parameter objects, so avoid spawn where we can
+            ctx = multiprocessing.get_context('fork')
+        else:
+            ctx = multiprocessing.get_context()
+
+        self.brange = list(brange)
+        self.nguess = model.getPermPerSubkey()
+        self.slots = dict((bnum, i) for i, bnum in enumerate(self.brange))
+        self._tmpdir = tempfile.mkdtemp(prefix='cwcpa')
+        self._traces = None
+        self._tracedesc = None
+        self._diffs = None
+        self._diffdesc = None
+        self._workers = []
+
+        processes = min(processes, len(self.brange))
+        #Worker owning the accumulator of each subkey
+        self.owner = {}
+        for i in range(processes):
+            parent_conn, child_conn = ctx.Pipe()
+            p = ctx.Process(target=_subkey_worker, args=(child_conn, subkeyFactory, model, self.brange[i::processes], tileHypotheses))
+            p.daemon = True
+            p.start()
+            child_conn.close()
+            self._workers.append((p, parent_conn))
+            for bnum in self.brange[i::processes]:
+                self.owner[bnum] = i
+
+    def _reply(self, conn):
+        reply = conn.recv()
+        if isinstance(reply, str):
+            raise RuntimeError("CPA worker process failed:\n" + reply)
+        return reply
+
+    def _move(self, bnum, worker):
+        """Move the accumulator of a subkey to another worker"""
+        self._workers[self.owner[bnum]][1].send(('give', bnum))
+        state = self._reply(self._workers[self.owner[bnum]][1])[1]
+        self._workers[worker][1].send(('take', bnum, state))
+        self._reply(self._workers[worker][1])
+        self.owner[bnum] = worker
+
+    def rebalance(self, active):
+        """Spread the active subkeys evenly over the workers, moving as few accumulators as possible"""
+        load = [[] for w in self._workers]
+        for bnum in active:
+            load[self.owner[bnum]].append(bnum)
+        while True:
+            busiest = max(range(len(load)), key=lambda w: len(load[w]))
+            idlest = min(range(len(load)), key=lambda w: len(load[w]))
+            if len(load[busiest]) - len(load[idlest]) <= 1:
+                break
+            bnum = load[busiest].pop()
+            self._move(bnum, idlest)
+            load[idlest].append(bnum)
+
+    def _buffer(self, name, shape, dtype):
+        fname = os.path.join(self._tmpdir, '%s_%d.dat' % (name, len(os.listdir(self._tmpdir))))
+        buf = np.memmap(fname, dtype=dtype, mode='w+', shape=shape)
+        return buf, (fname, shape, np.dtype(dtype).str)
+
+    def add_traces(self, traces, numtraces, plaintexts, ciphertexts, knownkeys, pointRange=None, active=None, points=None):
+        """Add a block of traces to all (or only the active) subkeys.
+
+        points is an optional dictionary with the points of each subkey in
+        traces (see point_set()), all points are used for subkeys not in it.
+
+        Returns:
+            Dictionary of bnum: diffs, diffs being a (guesses x points) array owned by the caller
+        """
+        if pointRange is not None:
+            traces = traces[:, pointRange[0]:pointRange[1]]
+        if active is None:
+            active = self.brange
+        if points is None:
+            points = {}
+        npoints = dict((bnum, point_count(points.get(bnum), traces.shape[1])) for bnum in self.brange)
+        maxpoints = max(npoints.values())
+
+        if self._traces is None or self._traces.shape[0] < numtraces or self._traces.shape[1:] != traces.shape[1:] \
+                or self._traces.dtype != traces.dtype:
+            self._traces, self._tracedesc = self._buffer('traces', (numtraces,) + traces.shape[1:], traces.dtype)
+        if self._diffs is None or self._diffs.shape[2] != maxpoints:
+            self._diffs, self._diffdesc = self._buffer('diffs', (len(self.brange), self.nguess, maxpoints), np.float64)
+
+        self._traces[:numtraces] = traces[:numtraces]
+        self._traces.flush()
+
+        self.rebalance(active)
+        msg = ('block', self._tracedesc, self._diffdesc, self.slots, numtraces, plaintexts, ciphertexts, knownkeys, list(active), points)
+        for p, conn in self._workers:
+            conn.send(msg)
+
+        errors = [conn.recv() for p, conn in self._workers]
+        for err in errors:
+            if err is not None:
+                raise RuntimeError("CPA worker process failed:\n" + err)
+
+        return dict((bnum, np.array(self._diffs[self.slots[bnum], :, :npoints[bnum]])) for bnum in active)
+
+    def reset(self):
+        """Start over with fresh accumulators for all subkeys (e.g. for the next tile of points)"""
+        for p, conn in self._workers:
+            conn.send(('reset',))
+        for p, conn in self._workers:
+            self._reply(conn)
+
+    def close(self):
+        """Stop the workers and remove the shared buffers"""
+        for p, conn in self._workers:
+            try:
+                conn.send(None)
+                conn.close()
+            except (OSError, IOError):
+                pass
+        for p, conn in self._workers:
+            p.join()
+        self._workers = []
+        self._traces = None
+        self._diffs = None
+        shutil.rmtree(self._tmpdir, ignore_errors=True)
@@ -41,6 +41,7 @@ class AttackCPA_Bayesian(AlgorithmsBase):
         self.updateScript()
 
     def addTraces(self, traceSource, tracerange, progressBar=None, pointRange=None, algo="log", tracesLoop=None):
+        self._check_single_range(pointRange)
         keyround=self.keyround
         modeltype=self.modeltype
         brange=self.brange
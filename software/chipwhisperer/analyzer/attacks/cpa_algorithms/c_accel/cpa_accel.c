@@ -0,0 +1,212 @@
+/*
+ Copyright (c) 2020, NewAE Technology Inc
+ All rights reserved.
+
+ Find this and more at newae.com - this file is part of the chipwhisperer
+ project, http://www.github.com/newaetech/chipwhisperer
+
+    This file is part of chipwhisperer.
+
+    chipwhisperer is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    chipwhisperer is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU Lesser General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with chipwhisperer.  If not, see <http://www.gnu.org/licenses/>.
+*/
+
+/* Progressive CPA update, built by setup.py as the _cpa_accel extension module.
+ *
+ * The leakage model is not evaluated here: the caller passes the (traces x guesses)
+ * hypothesis matrix from the Python model, so any model works. All arrays are
+ * C-contiguous float64 buffers (numpy arrays), no numpy headers are needed.
+ */
+
+#define PY_SSIZE_T_CLEAN
+#include <Python.h>
+#include <math.h>
+
+/* Points handled at a time, keeps the guesses x points block of sumht in cache */
+#define POINT_BLOCK 256
+
+static int get_buffer(PyObject *obj, Py_buffer *view, Py_ssize_t size, int writable, const char *name)
+{
+    if (PyObject_GetBuffer(obj, view, PyBUF_C_CONTIGUOUS | PyBUF_FORMAT | (writable ? PyBUF_WRITABLE : 0)) < 0)
+        return -1;
+
+    if (view->itemsize != sizeof(double) || (view->format && strcmp(view->format, "d") != 0)) {
+        PyErr_Format(PyExc_TypeError, "%s must be a contiguous float64 array", name);
+        PyBuffer_Release(view);
+        return -1;
+    }
+
+    if (view->len < size * (Py_ssize_t)sizeof(double)) {
+        PyErr_Format(PyExc_ValueError, "%s is too small: need %zd values, got %zd", name, size, view->len / (Py_ssize_t)sizeof(double));
+        PyBuffer_Release(view);
+        return -1;
+    }
+    return 0;
+}
+
+static void cpa_update(const double *traces, Py_ssize_t tracestride, Py_ssize_t pointoffset,
+                       Py_ssize_t ntraces, Py_ssize_t npoints,
+                       const double *hyp, Py_ssize_t nguess, double totaltraces,
+                       double *sumt, double *sumtq, double *sumh, double *sumhq, double *sumht,
+                       double *diffs)
+{
+    Py_ssize_t t, g, p, p0, p1;
+
+    for (t = 0; t < ntraces; t++) {
+        const double *trace = traces + t * tracestride + pointoffset;
+        for (p = 0; p < npoints; p++) {
+            sumt[p] += trace[p];
+            sumtq[p] += trace[p] * trace[p];
+        }
+        for (g = 0; g < nguess; g++) {
+            double h = hyp[t * nguess + g];
+            sumh[g] += h;
+            sumhq[g] += h * h;
+        }
+    }
+
+    for (p0 = 0; p0 < npoints; p0 = p1) {
+        p1 = p0 + POINT_BLOCK < npoints ? p0 + POINT_BLOCK : npoints;
+
+        for (t = 0; t < ntraces; t++) {
+            const double *trace = traces + t * tracestride + pointoffset;
+            const double *h = hyp + t * nguess;
+            for (g = 0; g < nguess; g++) {
+                double *row = sumht + g * npoints;
+                double hg = h[g];
+                for (p = p0; p < p1; p++)
+                    row[p] += hg * trace[p];
+            }
+        }
+
+        /* Same formula as CPAProgressiveOneSubkey */
+        for (g = 0; g < nguess; g++) {
+            double sumden1 = sumh[g] * sumh[g] - totaltraces * sumhq[g];
+            for (p = p0; p < p1; p++) {
+                double sumden2 = sumt[p] * sumt[p] - totaltraces * sumtq[p];
+                double sumnum = totaltraces * sumht[g * npoints + p] - sumh[g] * sumt[p];
+                diffs[g * npoints + p] = sumnum / sqrt(sumden1 * sumden2);
+            }
+        }
+    }
+}
+
+PyDoc_STRVAR(update_doc,
+"update(traces, pointoffset, npoints, hyp, totaltraces, sumt, sumtq, sumh, sumhq, sumht, diffs)\n\n"
+"Add a block of traces to the running sums of one subkey and write its correlations.\n\n"
+"traces is a (ntraces x tracepoints) array, of which points pointoffset to\n"
+"pointoffset+npoints are used. hyp is the (ntraces x nguess) hypothesis matrix.\n"
+"totaltraces is the number of traces including this block. The sums and\n"
+"diffs (nguess x npoints) are updated in place.");
+
+static PyObject *update(PyObject *self, PyObject *args)
+{
+    PyObject *otraces, *ohyp, *osumt, *osumtq, *osumh, *osumhq, *osumht, *odiffs;
+    Py_ssize_t pointoffset, npoints, ntraces, tracestride, nguess;
+    double totaltraces;
+    Py_buffer traces, hyp, sumt, sumtq, sumh, sumhq, sumht, diffs;
+
+    if (!PyArg_ParseTuple(args, "OnnOdOOOOOO", &otraces, &pointoffset, &npoints, &ohyp, &totaltraces,
+                          &osumt, &osumtq, &osumh, &osumhq, &osumht, &odiffs))
+        return NULL;
+
+    if (PyObject_GetBuffer(otraces, &traces, PyBUF_C_CONTIGUOUS | PyBUF_FORMAT | PyBUF_ND) < 0)
+        return NULL;
+    if (traces.ndim != 2 || traces.itemsize != sizeof(double) || (traces.format && strcmp(traces.format, "d") != 0)) {
+        PyErr_SetString(PyExc_TypeError, "traces must be a 2D contiguous float64 array");
+        PyBuffer_Release(&traces);
+        return NULL;
+    }
+    ntraces = traces.shape[0];
+    tracestride = traces.shape[1];
+    if (pointoffset < 0 || npoints < 0 || pointoffset + npoints > tracestride) {
+        PyErr_Format(PyExc_ValueError, "Point range %zd-%zd outside of traces with %zd points", pointoffset, pointoffset + npoints, tracestride);
+        PyBuffer_Release(&traces);
+        return NULL;
+    }
+
+    if (PyObject_GetBuffer(ohyp, &hyp, PyBUF_C_CONTIGUOUS | PyBUF_FORMAT | PyBUF_ND) < 0) {
+        PyBuffer_Release(&traces);
+        return NULL;
+    }
+    if (hyp.ndim != 2 || hyp.shape[0] < ntraces || hyp.itemsize != sizeof(double) || (hyp.format && strcmp(hyp.format, "d") != 0)) {
+        PyErr_SetString(PyExc_TypeError, "hyp must be a (traces x guesses) contiguous float64 array");
+        PyBuffer_Release(&hyp);
+        PyBuffer_Release(&traces);
+        return NULL;
+    }
+    nguess = hyp.shape[1];
+
+    if (get_buffer(osumt, &sumt, npoints, 1, "sumt") < 0)
+        goto fail_sumt;
+    if (get_buffer(osumtq, &sumtq, npoints, 1, "sumtq") < 0)
+        goto fail_sumtq;
+    if (get_buffer(osumh, &sumh, nguess, 1, "sumh") < 0)
+        goto fail_sumh;
+    if (get_buffer(osumhq, &sumhq, nguess, 1, "sumhq") < 0)
+        goto fail_sumhq;
+    if (get_buffer(osumht, &sumht, nguess * npoints, 1, "sumht") < 0)
+        goto fail_sumht;
+    if (get_buffer(odiffs, &diffs, nguess * npoints, 1, "diffs") < 0)
+        goto fail_diffs;
+
+    Py_BEGIN_ALLOW_THREADS
+    cpa_update((const double *)traces.buf, tracestride, pointoffset, ntraces, npoints,
+               (const double *)hyp.buf, nguess, totaltraces,
+               (double *)sumt.buf, (double *)sumtq.buf, (double *)sumh.buf, (double *)sumhq.buf,
+               (double *)sumht.buf, (double *)diffs.buf);
+    Py_END_ALLOW_THREADS
+
+    PyBuffer_Release(&diffs);
+    PyBuffer_Release(&sumht);
+    PyBuffer_Release(&sumhq);
+    PyBuffer_Release(&sumh);
+    PyBuffer_Release(&sumtq);
+    PyBuffer_Release(&sumt);
+    PyBuffer_Release(&hyp);
+    PyBuffer_Release(&traces);
+    Py_RETURN_NONE;
+
+fail_diffs:
+    PyBuffer_Release(&sumht);
+fail_sumht:
+    PyBuffer_Release(&sumhq);
+fail_sumhq:
+    PyBuffer_Release(&sumh);
+fail_sumh:
+    PyBuffer_Release(&sumtq);
+fail_sumtq:
+    PyBuffer_Release(&sumt);
+fail_sumt:
+    PyBuffer_Release(&hyp);
+    PyBuffer_Release(&traces);
+    return NULL;
+}
+
+static PyMethodDef cpa_accel_methods[] = {
+    {"update", update, METH_VARARGS, update_doc},
+    {NULL, NULL, 0, NULL}
+};
+
+static struct PyModuleDef cpa_accel_module = {
+    PyModuleDef_HEAD_INIT,
+    "_cpa_accel",
+    "Native progressive CPA update",
+    -1,
+    cpa_accel_methods
+};
+
+PyMODINIT_FUNC PyInit__cpa_accel(void)
+{
+    return PyModule_Create(&cpa_accel_module);
+}
@@ -1,2 +0,0 @@
-REM This is for using Visual Studio compiler
-cl /LD CPAProgressive.cpp AESModels.cpp /link/out:libcpa.dll
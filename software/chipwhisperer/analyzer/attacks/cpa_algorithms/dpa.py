@@ -0,0 +1,133 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2020, NewAE Technology Inc
+# All rights reserved.
+#
+# Find this and more at newae.com - this file is part of the chipwhisperer
+# project, http://www.github.com/newaetech/chipwhisperer
+#
+#    This file is part of chipwhisperer.
+#
+#    chipwhisperer is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    chipwhisperer is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with chipwhisperer.  If not, see <http://www.gnu.org/licenses/>.
+#=================================================
+import functools
+
+import numpy as np
+
+from .progressive import CPAProgressive, block_hypotheses
+from chipwhisperer.common.utils.parameter import setupSetParam
+
+
+class DPAOneSubkey(object):
+    """Progressive difference of means (DPA) for one subkey, evaluating all key guesses at once.
+
+    For each guess the traces are split on one bit of the hypothetical intermediate value.
+    The hypotheses of a block of traces form a (traces x guesses) 0/1 matrix B, so the sums of
+    the traces in the '1' set of every guess are a single product B.T * traces. Only these sums,
+    the set sizes, and the sum of all traces are kept, which is cheaper than CPA as no squared
+    sums or normalization are needed.
+
+    Args:
+        model: Leakage model. If it has intermediate_matrix() (the AES models) the bit is taken
+            from the intermediate value, otherwise from the value of leakage_matrix().
+        bit (int): Bit of the hypothesis to split the traces on.
+    """
+    def __init__(self, model, bit=0):
+        self.model = model
+        self.bit = bit
+        nguess = self.model.getPermPerSubkey()
+        self.count1 = np.zeros(nguess, dtype=np.float64)
+        self.sum1 = 0
+        self.sumt = 0
+        self.totalTraces = 0
+        self.modelstate = {'knownkey':None}
+
+    def selection(self, bnum, numtraces, plaintexts, ciphertexts, knownkeys):
+        """Return the (numtraces, guesses) 0/1 selection matrix as float64"""
+        if hasattr(self.model, 'intermediate_matrix'):
+            hyp = self.model.intermediate_matrix(plaintexts, ciphertexts, bnum, knownkeys)
+        else:
+            hyp = self.model.leakage_matrix(plaintexts, ciphertexts, bnum, knownkeys)
+        hyp = np.asarray(hyp)[:numtraces].astype(np.int64)
+        return ((hyp >> self.bit) & 1).astype(np.float64)
+
+    def oneSubkey(self, bnum, pointRange, traces_all, numtraces, plaintexts, ciphertexts, knownkeys, progressBar, state, pbcnt):
+        self.totalTraces += numtraces
+
+        if pointRange == None:
+            traces = traces_all
+        else:
+            traces = traces_all[:, pointRange[0] : pointRange[1]]
+        traces = traces[:numtraces]
+
+        sel = block_hypotheses(self, self.selection, bnum, numtraces, plaintexts, ciphertexts, knownkeys)
+
+        self.count1 += np.sum(sel, axis=0)
+        self.sum1 = self.sum1 + np.dot(sel.T, traces)
+        self.sumt = self.sumt + np.sum(traces, axis=0, dtype=np.float64)
+
+        #mean(set 1) - mean(set 0), guesses with an empty set give nan
+        count0 = self.totalTraces - self.count1
+        with np.errstate(divide='ignore', invalid='ignore'):
+            diffs = self.sum1 / self.count1[:, None] - (self.sumt - self.sum1) / count0[:, None]
+
+        if progressBar:
+            progressBar.updateStatus(pbcnt, (self.totalTraces-numtraces, self.totalTraces-1, bnum))
+        pbcnt = pbcnt + self.model.getPermPerSubkey()
+
+        return (diffs, pbcnt)
+
+
+class DPA(CPAProgressive):
+    """
+    Progressive difference of means attack (classic DPA), on one bit of the leakage model.
+
+    Runs with the same options (processes, tiles, early stopping) as CPAProgressive, reporting
+    the difference of means in place of the correlation. Use a model with the intermediate value
+    you want, for example cwa.leakage_models.sbox_output with Bit set to 0..7.
+    """
+    _name = "DPA"
+
+    def __init__(self):
+        self._bit = 0
+        CPAProgressive.__init__(self)
+        self.getParams().addChildren([
+            {'name':'Bit', 'key':'bit', 'type':'int', 'limits':(0, 7), 'get':self.get_bit, 'set':self.set_bit, 'action':self.updateScript},
+        ])
+
+    def get_bit(self):
+        return self._bit
+
+    @setupSetParam("Bit")
+    def set_bit(self, bit):
+        """Set the bit of the hypothetical intermediate value the traces are split on"""
+        if bit < 0:
+            raise ValueError("Bit must be >= 0, got %d" % bit)
+        self._check_bit_width(bit)
+        self._bit = int(bit)
+
+    def _check_bit_width(self, bit):
+        """Raise if bit is past the intermediate values of the model (if set), which would select no traces"""
+        model = getattr(self, 'model', None)
+        if model is None:
+            return
+        nbits = max(int(model.getPermPerSubkey() - 1).bit_length(), 1)
+        if bit >= nbits:
+            raise ValueError("Bit must be below %d for the %d-bit intermediate values of the model, got %d" % (nbits, nbits, bit))
+
+    def _subkey_factory(self):
+        #The model may have been changed since the bit was set
+        self._check_bit_width(self._bit)
+        return functools.partial(DPAOneSubkey, bit=self._bit)
@@ -0,0 +1,224 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2020, NewAE Technology Inc
+# All rights reserved.
+#
+# Find this and more at newae.com - this file is part of the chipwhisperer
+# project, http://www.github.com/newaetech/chipwhisperer
+#
+#    This file is part of chipwhisperer.
+#
+#    chipwhisperer is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    chipwhisperer is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with chipwhisperer.  If not, see <http://www.gnu.org/licenses/>.
+#=================================================
+import functools
+from collections import OrderedDict
+
+import numpy as np
+import scipy.linalg
+
+from ..algorithmsbase import shift_block
+from .progressive import CPAProgressive, block_hypotheses
+from chipwhisperer.common.utils.parameter import setupSetParam
+
+
+class LRATraceGram(object):
+    """Centered Gram matrix of the traces added so far, with its Cholesky factor.
+
+    The Gram matrix only depends on the traces, so it is shared by all subkeys attacked on
+    the same points. When it is singular (e.g. fewer traces than points, or constant points),
+    a small ridge term is added to its diagonal before factoring.
+    """
+    def __init__(self, offset, totalTraces, sumt, sumtt):
+        self.offset = offset
+        self.totalTraces = totalTraces
+        self.sumt = sumt
+        n = float(totalTraces)
+        gram = sumtt - np.outer(sumt, sumt) / n
+        self.sumtt = sumtt
+        self.ridge = 0.0
+        try:
+            self.factor = scipy.linalg.cho_factor(gram, check_finite=False)
+        except np.linalg.LinAlgError:
+            scale = max(np.trace(gram) / len(gram), np.finfo(np.float64).tiny)
+            self.ridge = scale * 1e-10
+            while True:
+                try:
+                    self.factor = scipy.linalg.cho_factor(gram + self.ridge * np.eye(len(gram)), check_finite=False)
+                    break
+                except np.linalg.LinAlgError:
+                    self.ridge *= 10
+
+    @classmethod
+    def add(cls, gram, traces):
+        """Return the Gram matrix of the traces of gram (None for no traces) plus traces"""
+        (traces, offset) = shift_block(traces, None if gram is None else gram.offset)
+        if gram is None:
+            return cls(offset, len(traces), np.sum(traces, axis=0), np.dot(traces.T, traces))
+        return cls(offset, gram.totalTraces + len(traces), gram.sumt + np.sum(traces, axis=0),
+                   gram.sumtt + np.dot(traces.T, traces))
+
+    def solve(self, cross):
+        """Solve gram * beta = cross"""
+        return scipy.linalg.cho_solve(self.factor, cross, check_finite=False)
+
+
+class LRAGramCache(object):
+    """Hands out the Gram matrix after each trace block, accumulated and factored once for all
+    subkeys adding the same block on the same points."""
+    size = 16
+
+    def __init__(self):
+        self._entries = OrderedDict()
+
+    def add(self, gram, traces):
+        key = (id(gram), traces.shape, traces[0].tobytes(), traces[-1].tobytes())
+        entry = self._entries.get(key)
+        if entry is None or entry[0] is not gram:
+            entry = (gram, LRATraceGram.add(gram, traces))
+            self._entries[key] = entry
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+        else:
+            self._entries.move_to_end(key)
+        return entry[1]
+
+
+class LRAOneSubkey(object):
+    """Progressive linear regression (channel estimation) attack on one subkey.
+
+    The hypotheses of each guess are fitted as a linear function of the trace points, and the
+    guess is scored by the fraction of their variance explained by the fit (R^2). All guesses
+    share the same design matrix (the traces), so the least-squares problems of all 256 guesses
+    are solved together: only the products of the traces with every hypothesis column are kept
+    per subkey, while the centered Gram matrix of the traces and its Cholesky factor come from
+    the gram cache, which the LRA attack shares between all subkeys.
+
+    With basis 'hw' each guess has one hypothesis column (the leakage model). With basis 'bits'
+    each bit of the intermediate value is a column, and the score is the variance explained
+    over all bits.
+
+    Memory is O(points^2 + guesses x columns x points), so keep the point range narrow.
+
+    Args:
+        model: Leakage model.
+        basis (str): 'hw' or 'bits'.
+        grams (LRAGramCache, optional): Cache shared with the other subkeys.
+    """
+    def __init__(self, model, basis='hw', grams=None):
+        self.model = model
+        self.basis = basis
+        self.grams = LRAGramCache() if grams is None else grams
+        self.gram = None
+        self.totalTraces = 0
+        self.modelstate = {'knownkey':None}
+
+    def hypotheses(self, bnum, numtraces, plaintexts, ciphertexts, knownkeys):
+        """Return the (numtraces, guesses, columns) hypothesis array as float64"""
+        if self.basis == 'bits':
+            if hasattr(self.model, 'intermediate_matrix'):
+                hyp = self.model.intermediate_matrix(plaintexts, ciphertexts, bnum, knownkeys)
+            else:
+                hyp = self.model.leakage_matrix(plaintexts, ciphertexts, bnum, knownkeys)
+            hyp = np.asarray(hyp)[:numtraces].astype(np.int64)
+            nbits = max(int(self.model.getPermPerSubkey() - 1).bit_length(), 1)
+            return ((hyp[:, :, None] >> np.arange(nbits)) & 1).astype(np.float64)
+        hyp = self.model.leakage_matrix(plaintexts, ciphertexts, bnum, knownkeys)
+        return np.asarray(hyp, dtype=np.float64)[:numtraces, :, None]
+
+    def oneSubkey(self, bnum, pointRange, traces_all, numtraces, plaintexts, ciphertexts, knownkeys, progressBar, state, pbcnt):
+        if pointRange == None:
+            traces = traces_all
+        else:
+            traces = traces_all[:, pointRange[0] : pointRange[1]]
+        traces = np.asarray(traces[:numtraces], dtype=np.float64)
+
+        hyp = block_hypotheses(self, self.hypotheses, bnum, numtraces, plaintexts, ciphertexts, knownkeys)
+        nguess, ncols = hyp.shape[1:]
+        hyp = hyp.reshape(numtraces, nguess * ncols)
+
+        self.gram = self.grams.add(self.gram, traces)
+        if self.totalTraces == 0:
+            self.sumh = np.zeros(nguess * ncols)
+            self.sumhq = np.zeros(nguess * ncols)
+            self.sumth = np.zeros((traces.shape[1], nguess * ncols))
+
+        (traces, _) = shift_block(traces, self.gram.offset)
+        self.totalTraces += numtraces
+        self.sumh += np.sum(hyp, axis=0)
+        self.sumhq += np.sum(np.square(hyp), axis=0)
+        self.sumth += np.dot(traces.T, hyp)
+
+        #Centered normal equations: gram * beta = cross, one column of cross per hypothesis column
+        n = float(self.totalTraces)
+        cross = self.sumth - np.outer(self.gram.sumt, self.sumh) / n
+        beta = self.gram.solve(cross)
+
+        #Explained and total sums of squares, summed over the columns of each guess
+        explained = np.sum(beta * cross, axis=0).reshape(nguess, ncols).sum(axis=1)
+        total = (self.sumhq - np.square(self.sumh) / n).reshape(nguess, ncols).sum(axis=1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            diffs = (explained / total)[:, None]
+
+        if progressBar:
+            progressBar.updateStatus(pbcnt, (self.totalTraces-numtraces, self.totalTraces-1, bnum))
+        pbcnt = pbcnt + self.model.getPermPerSubkey()
+
+        return (diffs, pbcnt)
+
+
+class LRA(CPAProgressive):
+    """
+    Progressive linear regression analysis (channel estimation) attack.
+
+    For each guess, fits the hypotheses as a linear combination of all points in the point range
+    and reports the fraction of their variance explained (R^2) as a single 'point'. Unlike CPA,
+    this combines leakage spread over several points, but the fit is over all points at once, so
+    use a narrow point range around the leakage. See LRAOneSubkey.
+    """
+    _name = "LRA"
+
+    def __init__(self):
+        self._basis = 'hw'
+        CPAProgressive.__init__(self)
+        self.getParams().addChildren([
+            {'name':'Basis', 'key':'basis', 'type':'list', 'values':{'Leakage Model':'hw', 'Bits':'bits'}, 'get':self.get_basis, 'set':self.set_basis, 'action':self.updateScript},
+        ])
+
+    def get_basis(self):
+        return self._basis
+
+    @setupSetParam("Basis")
+    def set_basis(self, basis):
+        """Set the hypothesis columns fitted for each guess.
+
+        Args:
+            basis (str): 'hw' (the default) fits the value of the leakage
+                model. 'bits' fits each bit of the intermediate value.
+
+        Raises:
+            ValueError: Unknown basis
+        """
+        if basis not in ('hw', 'bits'):
+            raise ValueError("Basis must be 'hw' or 'bits', got %s" % basis)
+        self._basis = basis
+
+    def _subkey_factory(self):
+        #One Gram matrix (and factorization) per trace block for all subkeys
+        return functools.partial(LRAOneSubkey, basis=self._basis, grams=LRAGramCache())
+
+    def addTraces(self, traceSource, tracerange, progressBar=None, pointRange=None):
+        if self._tilePoints:
+            raise ValueError("Tile Points can't be used with LRA, the fit is over all points at once")
+        return CPAProgressive.addTraces(self, traceSource, tracerange, progressBar, pointRange)
@@ -28,7 +28,59 @@
 import numpy as np
 import math
 
-from ..algorithmsbase import AlgorithmsBase
+from ..algorithmsbase import AlgorithmsBase, point_set, subkey_traces
+from ._parallel import SubkeyWorkerPool
+from chipwhisperer.common.utils.parameter import setupSetParam
+
+
+class TileHypotheses(object):
+    """Hypotheses of the trace blocks of one subkey, kept between the tiles of a tiled attack.
+
+    Every tile runs the same trace blocks in the same order, so the hypotheses of each block
+    are built in the first tile and reused in the others, blocks being identified by their
+    position in the tile. Hypotheses that are small integers (e.g. hamming weights) are kept
+    as uint8. Once max_bytes are kept, the hypotheses of further blocks are built again for
+    every tile.
+    """
+    max_bytes = 2**26
+
+    def __init__(self):
+        self._hyps = []
+        self._bytes = 0
+        self._next = 0
+
+    def rewind(self):
+        """Start the next tile from the first block"""
+        self._next = 0
+
+    def get(self, build, *args):
+        """Hypotheses of the next block, from build(*args) unless they were kept"""
+        n = self._next
+        self._next += 1
+        if n < len(self._hyps) and self._hyps[n] is not None:
+            (hyp, dtype) = self._hyps[n]
+            return hyp.astype(dtype, copy=False)
+
+        hyp = build(*args)
+        if n == len(self._hyps):
+            kept = hyp.astype(np.uint8)
+            if not np.array_equal(kept, hyp):
+                kept = hyp
+            if self._bytes + kept.nbytes > self.max_bytes:
+                self._hyps.append(None)
+            else:
+                self._hyps.append((kept, hyp.dtype))
+                self._bytes += kept.nbytes
+        return hyp
+
+
+def block_hypotheses(acc, build, *args):
+    """Hypotheses of a trace block for the accumulator acc: build(*args), or the ones kept
+    in its tile_hyps (a TileHypotheses) during a tiled attack"""
+    store = getattr(acc, 'tile_hyps', None)
+    if store is None:
+        return build(*args)
+    return store.get(build, *args)
 
 
 class CPAProgressiveOneSubkey(object):
@@ -152,17 +204,206 @@ class CPAProgressive(AlgorithmsBase):
     CPA Attack done as a loop, but using an algorithm which can progressively add traces & give output stats
     """
     _name = "Progressive"
+    _subkeyClass = CPAProgressiveOneSubkey
 
     def __init__(self):
         AlgorithmsBase.__init__(self)
+        self._processes = 1
+        self._tilePoints = 0
+        self._itmode = 'bf'
+        self._skipPGE = False
+        self._stopIntervals = 0
+        self._stopMargin = 0.05
 
         self.getParams().addChildren([
-            {'name':'Iteration Mode', 'key':'itmode', 'type':'list', 'values':{'Depth-First':'df', 'Breadth-First':'bf'}, 'value':'bf', 'action':self.updateScript},
-            {'name':'Skip when PGE=0', 'key':'checkpge', 'type':'bool', 'value':False, 'action':self.updateScript},
+            {'name':'Iteration Mode', 'key':'itmode', 'type':'list', 'values':{'Depth-First':'df', 'Breadth-First':'bf'}, 'get':self.get_iteration_mode, 'set':self.set_iteration_mode, 'action':self.updateScript},
+            {'name':'Skip when PGE=0', 'key':'checkpge', 'type':'bool', 'get':self.get_skip_pge, 'set':self.set_skip_pge, 'action':self.updateScript},
+            {'name':'Stop when Stable', 'key':'stopintervals', 'type':'int', 'limits':(0, 1000000), 'get':self.get_stop_intervals, 'set':self.set_stop_intervals, 'action':self.updateScript},
+            {'name':'Stable Margin', 'key':'stopmargin', 'type':'float', 'limits':(0, 2), 'step':0.01, 'get':self.get_stop_margin, 'set':self.set_stop_margin, 'action':self.updateScript},
+            {'name':'Processes', 'key':'processes', 'type':'int', 'limits':(1, 1024), 'get':self.get_processes, 'set':self.set_processes, 'action':self.updateScript},
+            {'name':'Tile Points', 'key':'tilepoints', 'type':'int', 'limits':(0, 1000000000), 'get':self.get_tile_points, 'set':self.set_tile_points, 'action':self.updateScript},
         ])
         self.updateScript()
 
+    def get_iteration_mode(self):
+        return self._itmode
+
+    @setupSetParam("Iteration Mode")
+    def set_iteration_mode(self, mode):
+        """Set the order subkeys and traces are attacked in.
+
+        Args:
+            mode (str): 'bf' (Breadth-First, the default) adds each block of
+                traces to every subkey before moving to the next block. 'df'
+                (Depth-First) adds all traces to one subkey before moving to
+                the next subkey.
+
+        Raises:
+            ValueError: Unknown mode
+        """
+        if mode not in ('bf', 'df'):
+            raise ValueError("Iteration mode must be 'bf' or 'df', got %s" % mode)
+        self._itmode = mode
+
+    def get_skip_pge(self):
+        return self._skipPGE
+
+    @setupSetParam("Skip when PGE=0")
+    def set_skip_pge(self, skip):
+        """Stop attacking a subkey once the known key is its best guess.
+
+        The known key is taken from the first traces attacked if it hasn't
+        been set on the results. Not available with Tile Points.
+        """
+        self._skipPGE = skip
+
+    def get_stop_intervals(self):
+        return self._stopIntervals
+
+    @setupSetParam("Stop when Stable")
+    def set_stop_intervals(self, intervals):
+        """Stop attacking a subkey once its best guess is stable.
+
+        A subkey is stable when its best guess has stayed the same, leading
+        the second best guess by at least the stable margin, for this many
+        reporting intervals in a row. Stopped subkeys are no longer updated,
+        leaving the time (and worker processes) to the others. Stops are
+        recorded in Results.stopped. Not available with Tile Points.
+
+        Args:
+            intervals (int): Number of reporting intervals. 0 (the default)
+                never stops.
+        """
+        if intervals < 0:
+            raise ValueError("Number of intervals can't be negative, got %d" % intervals)
+        self._stopIntervals = intervals
+
+    def get_stop_margin(self):
+        return self._stopMargin
+
+    @setupSetParam("Stable Margin")
+    def set_stop_margin(self, margin):
+        """Set the correlation the best guess must lead the second by to be stable"""
+        self._stopMargin = margin
+
+    def _check_stop(self, bnum, tnum):
+        """Check if the attack on a subkey can stop, recording the stop in the results"""
+        if not self._skipPGE and not self._stopIntervals:
+            return False
+
+        maxes = self.stats.find_maximums([bnum])[bnum]
+        if self._skipPGE and self.stats.known_key is not None and self.stats.simple_PGE(bnum) == 0:
+            self.stats.set_subkey_stopped(bnum, tnum, 'pge')
+            return True
+
+        if self._stopIntervals:
+            margin = maxes[0]['value'] - maxes[1]['value']
+            if not margin >= self._stopMargin:
+                self._stable[bnum] = 0
+            elif self._stable[bnum] and maxes[0]['hyp'] == self._lastGuess[bnum]:
+                self._stable[bnum] += 1
+            else:
+                self._stable[bnum] = 1
+            self._lastGuess[bnum] = maxes[0]['hyp']
+
+            if self._stable[bnum] >= self._stopIntervals:
+                self.stats.set_subkey_stopped(bnum, tnum, 'stable')
+                return True
+        return False
+
+    def get_processes(self):
+        return self._processes
+
+    @setupSetParam("Processes")
+    def set_processes(self, processes):
+        """Set the number of processes used to attack the subkeys.
+
+        With more than one process, the subkeys are shared out between worker
+        processes, each keeping the running sums of its own subkeys. Every
+        block of traces is shared with the workers through a memory mapped
+        file. Results and callbacks are the same as with a single process.
+
+        Args:
+            processes (int): Number of worker processes. 1 (the default)
+                attacks all subkeys in the current process.
+        """
+        self._processes = processes
+
+    def get_tile_points(self):
+        return self._tilePoints
+
+    @setupSetParam("Tile Points")
+    def set_tile_points(self, points):
+        """Set the number of points attacked at a time.
+
+        With tiles, the point range is attacked one tile of points at a time:
+        all traces are run through the running sums of a tile, the peaks of
+        the correlations are merged into the results, and the sums are thrown
+        away before starting the next tile. Memory use then depends on the
+        tile size instead of the trace length, so very long traces can be
+        attacked. The hypotheses of each trace block are built in the first
+        tile and kept for the others (see TileHypotheses).
+
+        The results only hold the peak correlation of each guess (see
+        Results.update_subkey_peaks()), and are only updated (and the
+        callback called) at the end of each tile. Tiles attack all subkeys
+        breadth-first over every trace, so they can't be combined with
+        per-subkey points, stopping subkeys (Stop when Stable, Skip when
+        PGE=0) or Depth-First mode: the attack raises a ValueError.
+
+        Args:
+            points (int): Number of points in each tile. 0 (the default)
+                attacks all points at once.
+        """
+        if points < 0:
+            raise ValueError("Tile size can't be negative, got %d" % points)
+        self._tilePoints = points
+
+    def _subkey_factory(self):
+        """Return the callable creating the per-subkey accumulator from the model"""
+        return self._subkeyClass
+
+    def _block_points(self, pointRange):
+        """Split pointRange into the range read from each trace block and the points of each subkey in it.
+
+        pointRange is a (start, end) range of points for all subkeys, or a
+        dictionary with the points (a (start, end) range or an index list, see
+        point_set()) of each subkey.
+        """
+        if not isinstance(pointRange, dict):
+            return pointRange, dict((bnum, None) for bnum in self.brange)
+
+        points = {}
+        for bnum in self.brange:
+            if bnum not in pointRange:
+                raise ValueError("No points given for subkey %d" % bnum)
+            points[bnum] = point_set(pointRange[bnum])
+        if any(p is None for p in points.values()):
+            return None, points
+
+        #Only read the points used by at least one subkey
+        start = min(p[0] if isinstance(p, tuple) else p.min() for p in points.values())
+        end = max(p[1] if isinstance(p, tuple) else p.max() + 1 for p in points.values())
+        for bnum, p in points.items():
+            points[bnum] = (p[0] - start, p[1] - start) if isinstance(p, tuple) else p - start
+        return (int(start), int(end)), points
+
     def addTraces(self, traceSource, tracerange, progressBar=None, pointRange=None):
+        """Attack the traces in tracerange.
+
+        pointRange is a (start, end) range of points, or a dictionary with the
+        points of each subkey (a (start, end) range or a list of point indices).
+        With per-subkey points, each subkey only accumulates its own points, and
+        the locations in its results are indices into its points.
+        """
+        if self._tilePoints:
+            if isinstance(pointRange, dict):
+                raise ValueError("Tile Points can't be used with per-subkey points")
+            if self._skipPGE or self._stopIntervals or self._itmode == 'df':
+                raise ValueError("Tile Points can't be used with Stop when Stable, Skip when PGE=0 or Depth-First mode")
+            return self._addTracesTiled(traceSource, tracerange, progressBar, pointRange)
+        pointRange, subkeyPoints = self._block_points(pointRange)
+
         numtraces = tracerange[1] - tracerange[0] + 1
         if progressBar:
             progressBar.setText("Attacking traces subset: from %d to %d (total = %d)" % (tracerange[0], tracerange[1], numtraces))
@@ -170,9 +411,10 @@ class CPAProgressive(AlgorithmsBase):
             progressBar.setMaximum(len(self.brange) * self.model.getPermPerSubkey() * math.ceil(float(numtraces) / self._reportingInterval) - 1)
 
         pbcnt = 0
+        subkeyFactory = self._subkey_factory()
         cpa = [None]*(max(self.brange)+1)
         for bnum in self.brange:
-            cpa[bnum] = CPAProgressiveOneSubkey(self.model)
+            cpa[bnum] = subkeyFactory(self.model)
 
         brangeMap = [None]*(max(self.brange)+1)
         i = 1
@@ -180,78 +422,158 @@ class CPAProgressive(AlgorithmsBase):
             brangeMap[bnum] = i
             i += 1
 
-        skipPGE = False  # self.findParam('checkpge').getValue()
-        bf = True  # self.findParam('itmode').getValue() == 'bf'
+        bf = self._itmode == 'bf'
+        self._stable = dict((bnum, 0) for bnum in self.brange)
+        self._lastGuess = {}
 
         #bf specifies a 'breadth-first' search. bf means we search across each
         #subkey by only the amount of traces specified. Depth-First means we
         #search each subkey completely, then move onto the next.
         if bf:
             brange_df = [0]
-            brange_bf = self.brange
         else:
-            brange_bf = [0]
             brange_df = self.brange
 
-        for bnum_df in brange_df:
-            tstart = 0
-            tend = self._reportingInterval
+        pool = None
+        if self._processes > 1 and len(self.brange) > 1:
+            pool = SubkeyWorkerPool(subkeyFactory, self.model, self.brange, self._processes)
 
-            while tstart < numtraces:
-                if tend > numtraces:
-                    tend = numtraces
+        try:
+            for bnum_df in brange_df:
+                tstart = 0
+                tend = self._reportingInterval
 
-                if tstart > numtraces:
-                    tstart = numtraces
+                while tstart < numtraces:
+                    if tend > numtraces:
+                        tend = numtraces
 
-                data = []
-                textins = []
-                textouts = []
-                knownkeys = []
-                for i in range(tstart, tend):
-                    # Handle Offset
-                    tnum = i + tracerange[0]
+                    if tstart > numtraces:
+                        tstart = numtraces
+
+                    #Stopped subkeys don't take any more time
+                    if bf:
+                        active = [bnum for bnum in self.brange if self.stats.stopped[bnum] is None]
+                    else:
+                        active = [bnum_df]
+                    if len(active) == 0:
+                        break
 
+                    # Fetch the whole block (only the points being attacked) in one go
                     try:
-                        data.append(traceSource.get_trace(tnum))
-                        textins.append(traceSource.get_textin(tnum))
-                        textouts.append(traceSource.get_textout(tnum))
-                        knownkeys.append(traceSource.get_known_key(tnum))
+                        block = traceSource.get_traces(tstart + tracerange[0], tend + tracerange[0], pointRange)
                     except Exception as e:
                         if progressBar:
-                            progressBar.abort(e.message)
+                            progressBar.abort(str(e))
                         return
 
-                traces = np.array(data)
-                textins = np.array(textins)
-                textouts = np.array(textouts)
-                # knownkeys = np.array(knownkeys)
+                    traces = np.asarray(block.wave)
+                    textins = np.array(block.textin)
+                    textouts = np.array(block.textout)
+                    knownkeys = list(block.key)
+
+                    if self._skipPGE and self.stats.known_key is None and len(knownkeys) > 0 and knownkeys[0] is not None:
+                        self.stats.set_known_key(self.process_known_key(knownkeys[0]))
+
+                    if pool is not None:
+                        pooldiffs = pool.add_traces(traces, tend - tstart, textins, textouts, knownkeys, active=active, points=subkeyPoints)
+
+                    for bnum in active:
+                        if pool is not None:
+                            data = pooldiffs[bnum]
+                            if progressBar:
+                                progressBar.updateStatus(pbcnt, (tstart, tend - 1, bnum))
+                            pbcnt = pbcnt + self.model.getPermPerSubkey()
+                        else:
+                            (subtraces, bptrange) = subkey_traces(traces, subkeyPoints[bnum])
+                            (data, pbcnt) = cpa[bnum].oneSubkey(bnum, bptrange, subtraces, tend - tstart, textins, textouts, knownkeys, progressBar, cpa[bnum].modelstate, pbcnt)
+                        self.stats.update_subkey(bnum, data, copy=False, tnum=tend)
+
+                        if self._check_stop(bnum, tend):
+                            #Skip the progress of the traces this subkey won't use
+                            pbcnt = brangeMap[bnum] * self.model.getPermPerSubkey() * (numtraces / self._reportingInterval + 1)
+
+                        if progressBar and progressBar.wasAborted():
+                            return
+
+                    tend += self._reportingInterval
+                    tstart += self._reportingInterval
+
+                    if self.sr:
+                        self.sr()
+
+                    if not bf and self.stats.stopped[bnum_df] is not None:
+                        break
+        finally:
+            if pool is not None:
+                pool.close()
+
+    def _addTracesTiled(self, traceSource, tracerange, progressBar=None, pointRange=None):
+        """addTraces() walking the point range one tile at a time"""
+        if pointRange is None:
+            pointRange = [0, traceSource.num_points()]
+        numtraces = min(tracerange[1] - tracerange[0] + 1, traceSource.num_traces() - tracerange[0])
+        tiles = [(p, min(p + self._tilePoints, pointRange[1])) for p in range(pointRange[0], pointRange[1], self._tilePoints)]
+        if numtraces <= 0:
+            return
+        nblocks = int(math.ceil(float(numtraces) / self._reportingInterval))
 
-                for bnum_bf in brange_bf:
-                    if bf:
-                        bnum = bnum_bf
-                    else:
-                        bnum = bnum_df
+        if progressBar:
+            progressBar.setText("Attacking traces subset: from %d to %d (total = %d) in %d tiles" % (tracerange[0], tracerange[1], numtraces, len(tiles)))
+            progressBar.setStatusMask("Tile: %d. Trace Interval: %d-%d. Current Subkey: %d")
+            progressBar.setMaximum(len(tiles) * nblocks * len(self.brange) - 1)
 
-                    skip = False
-                    if (self.stats.simple_PGE(bnum) != 0) or (skipPGE == False):
-                        bptrange = pointRange
-                        (data, pbcnt) = cpa[bnum].oneSubkey(bnum, bptrange, traces, tend - tstart, textins, textouts, knownkeys, progressBar, cpa[bnum].modelstate, pbcnt)
-                        self.stats.update_subkey(bnum, data, tnum=tend)
-                    else:
-                        skip = True
+        pbcnt = 0
+        subkeyFactory = self._subkey_factory()
+        pool = None
+        if self._processes > 1 and len(self.brange) > 1:
+            pool = SubkeyWorkerPool(subkeyFactory, self.model, self.brange, self._processes, TileHypotheses)
+        #The hypotheses of each trace block are only built once, in the first tile
+        tileHyps = dict((bnum, TileHypotheses()) for bnum in self.brange)
+
+        try:
+            for tilenum, tile in enumerate(tiles):
+                #Fresh running sums for each tile, only (guesses x tile) in size
+                cpa = {}
+                if pool is not None:
+                    pool.reset()
+                else:
+                    for bnum in self.brange:
+                        cpa[bnum] = subkeyFactory(self.model)
+                        tileHyps[bnum].rewind()
+                        cpa[bnum].tile_hyps = tileHyps[bnum]
+
+                diffs = {}
+                for tstart in range(0, numtraces, self._reportingInterval):
+                    tend = min(tstart + self._reportingInterval, numtraces)
+                    try:
+                        block = traceSource.get_traces(tstart + tracerange[0], tend + tracerange[0], tile)
+                    except Exception as e:
+                        if progressBar:
+                            progressBar.abort(str(e))
+                        return
 
-                    if skip:
-                        pbcnt = brangeMap[bnum] * self.model.getPermPerSubkey() * (numtraces / self._reportingInterval + 1)
+                    traces = np.asarray(block.wave)
+                    textins = np.array(block.textin)
+                    textouts = np.array(block.textout)
+                    knownkeys = list(block.key)
 
-                        if bf is False:
-                            tstart = numtraces
+                    if pool is not None:
+                        diffs = pool.add_traces(traces, tend - tstart, textins, textouts, knownkeys)
+                    for bnum in self.brange:
+                        if pool is None:
+                            (diffs[bnum], _) = cpa[bnum].oneSubkey(bnum, None, traces, tend - tstart, textins, textouts, knownkeys, None, cpa[bnum].modelstate, 0)
+                        if progressBar:
+                            progressBar.updateStatus(pbcnt, (tilenum, tstart, tend - 1, bnum))
+                        pbcnt += 1
 
                     if progressBar and progressBar.wasAborted():
                         return
 
-                tend += self._reportingInterval
-                tstart += self._reportingInterval
+                for bnum in self.brange:
+                    self.stats.update_subkey_peaks(bnum, diffs[bnum], offset=tile[0] - pointRange[0], tnum=numtraces, merge=(tilenum > 0))
 
                 if self.sr:
                     self.sr()
+        finally:
+            if pool is not None:
+                pool.close()
@@ -0,0 +1,198 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2020, NewAE Technology Inc
+# All rights reserved.
+#
+# Find this and more at newae.com - this file is part of the chipwhisperer
+# project, http://www.github.com/newaetech/chipwhisperer
+#
+#    This file is part of chipwhisperer.
+#
+#    chipwhisperer is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    chipwhisperer is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with chipwhisperer.  If not, see <http://www.gnu.org/licenses/>.
+#=================================================
+import functools
+
+import numpy as np
+
+from .progressive import CPAProgressive, block_hypotheses
+from chipwhisperer.common.utils.parameter import setupSetParam
+
+
+class CPAProgressiveOneSubkeyVectorized(object):
+    """Progressive CPA for one subkey, evaluating all key guesses at once.
+
+    Keeps the same running sums as CPAProgressiveOneSubkey, but stored as
+    arrays over the key guesses. The hypotheses for a block of traces are
+    fetched from the model as one (traces x guesses) matrix, so sumht for every
+    guess comes from a single matrix multiply against the trace block.
+    """
+    def __init__(self, model):
+        self.model = model
+        nguess = self.model.getPermPerSubkey()
+        self.sumhq = np.zeros(nguess, dtype=np.float64)
+        self.sumh = np.zeros(nguess, dtype=np.float64)
+        self.sumtq = 0
+        self.sumt = 0
+        self.sumht = 0
+        self.totalTraces = 0
+        self.modelstate = {'knownkey':None}
+
+    def hypotheses(self, bnum, numtraces, plaintexts, ciphertexts, knownkeys):
+        """Return the (numtraces, guesses) hypothesis matrix as float64"""
+        hyp = self.model.leakage_matrix(plaintexts, ciphertexts, bnum, knownkeys)
+        return np.asarray(hyp, dtype=np.float64)[:numtraces]
+
+    def oneSubkey(self, bnum, pointRange, traces_all, numtraces, plaintexts, ciphertexts, knownkeys, progressBar, state, pbcnt):
+        self.totalTraces += numtraces
+
+        if pointRange == None:
+            traces = traces_all
+        else:
+            traces = traces_all[:, pointRange[0] : pointRange[1]]
+
+        self.sumtq = self.sumtq + np.sum(np.square(traces), axis=0, dtype=np.float64)
+        self.sumt = self.sumt + np.sum(traces, axis=0, dtype=np.float64)
+        sumden2 = (np.square(self.sumt) - self.totalTraces * self.sumtq)
+
+        hyp = block_hypotheses(self, self.hypotheses, bnum, numtraces, plaintexts, ciphertexts, knownkeys)
+
+        #Same formula as CPAProgressiveOneSubkey, with the loop over guesses
+        #replaced by operations on the (guesses x points) arrays
+        self.sumh += np.sum(hyp, axis=0)
+        self.sumhq += np.sum(np.square(hyp), axis=0)
+        self.sumht = self.sumht + np.dot(hyp.T, traces)
+
+        sumnum = self.totalTraces * self.sumht - np.outer(self.sumh, self.sumt)
+        sumden1 = (np.square(self.sumh) - self.totalTraces * self.sumhq)
+        sumden = np.outer(sumden1, sumden2)
+
+        diffs = sumnum / np.sqrt(sumden)
+
+        if progressBar:
+            progressBar.updateStatus(pbcnt, (self.totalTraces-numtraces, self.totalTraces-1, bnum))
+        pbcnt = pbcnt + self.model.getPermPerSubkey()
+
+        return (diffs, pbcnt)
+
+
+class CPAProgressiveOneSubkeyCentered(CPAProgressiveOneSubkeyVectorized):
+    """Progressive CPA for one subkey using centered (Welford-style) running statistics.
+
+    Instead of raw sums, keeps the running means of the traces and hypotheses, their sums
+    of squared deviations, and the co-moment C = sum((h - mean_h)(t - mean_t)). Each
+    block is centered on its own means and merged in with the pairwise update of Chan et
+    al., so the values accumulated stay small and well conditioned. That allows the
+    (guesses x points) co-moment, by far the largest array, and the block products to be
+    kept in float32, halving their memory use and bandwidth. The per-point trace
+    statistics, which are 1/guesses of that size, stay in float64.
+
+    Correlations are within 1e-4 (absolute) of the float64 sums for typical power
+    traces and leakage models.
+    """
+    def __init__(self, model, dtype=np.float32):
+        CPAProgressiveOneSubkeyVectorized.__init__(self, model)
+        self.dtype = np.dtype(dtype)
+        nguess = self.model.getPermPerSubkey()
+        self.meanh = np.zeros(nguess, dtype=np.float64)
+        self.m2h = np.zeros(nguess, dtype=np.float64)
+        self.meant = 0
+        self.m2t = 0
+        self.comoment = 0
+
+    def oneSubkey(self, bnum, pointRange, traces_all, numtraces, plaintexts, ciphertexts, knownkeys, progressBar, state, pbcnt):
+        if pointRange == None:
+            traces = traces_all
+        else:
+            traces = traces_all[:, pointRange[0] : pointRange[1]]
+        traces = np.asarray(traces[:numtraces])
+
+        hyp = block_hypotheses(self, self.hypotheses, bnum, numtraces, plaintexts, ciphertexts, knownkeys)
+
+        #Statistics of this block, centered on its own means
+        bmeant = np.mean(traces, axis=0, dtype=np.float64)
+        bmeanh = np.mean(hyp, axis=0)
+        ctraces = (traces - bmeant).astype(self.dtype, copy=False)
+        chyp = (hyp - bmeanh).astype(self.dtype)
+        bm2t = np.sum(np.square(ctraces, dtype=np.float64), axis=0)
+        bm2h = np.sum(np.square(chyp, dtype=np.float64), axis=0)
+        bcomoment = np.dot(chyp.T, ctraces)
+
+        #Merge with the running statistics
+        total = self.totalTraces + numtraces
+        weight = float(self.totalTraces) * numtraces / total
+        deltat = bmeant - self.meant
+        deltah = bmeanh - self.meanh
+        self.meant = self.meant + deltat * (float(numtraces) / total)
+        self.meanh += deltah * (float(numtraces) / total)
+        self.m2t = self.m2t + bm2t + np.square(deltat) * weight
+        self.m2h += bm2h + np.square(deltah) * weight
+        if self.totalTraces == 0:
+            self.comoment = bcomoment
+        else:
+            self.comoment += bcomoment
+            self.comoment += np.outer((deltah * weight).astype(self.dtype), deltat.astype(self.dtype))
+        self.totalTraces = total
+
+        diffs = self.comoment / np.sqrt(np.outer(self.m2h, self.m2t)).astype(self.dtype)
+
+        if progressBar:
+            progressBar.updateStatus(pbcnt, (self.totalTraces-numtraces, self.totalTraces-1, bnum))
+        pbcnt = pbcnt + self.model.getPermPerSubkey()
+
+        return (diffs, pbcnt)
+
+
+class CPAProgressive_Vectorized(CPAProgressive):
+    """
+    Progressive CPA attack where each subkey is updated with matrix operations over all key guesses
+    instead of a Python loop. Gives the same statistics as CPAProgressive.
+
+    With precision set to 'float32', the statistics are accumulated with centered updates in
+    single precision (see CPAProgressiveOneSubkeyCentered), which halves the memory used per subkey.
+    """
+    _name = "Progressive-Vectorized"
+    _subkeyClass = CPAProgressiveOneSubkeyVectorized
+
+    def __init__(self):
+        self._precision = 'float64'
+        CPAProgressive.__init__(self)
+        self.getParams().addChildren([
+            {'name':'Precision', 'key':'precision', 'type':'list', 'values':{'float64':'float64', 'float32 (centered)':'float32'}, 'get':self.get_precision, 'set':self.set_precision, 'action':self.updateScript},
+        ])
+
+    def get_precision(self):
+        return self._precision
+
+    @setupSetParam("Precision")
+    def set_precision(self, precision):
+        """Set the precision of the running statistics.
+
+        Args:
+            precision (str): 'float64' (default) accumulates raw sums in double precision, giving
+                the same results as Progressive. 'float32' accumulates centered statistics, with the
+                (guesses x points) arrays in single precision. Correlations then differ by less
+                than about 1e-4.
+
+        Raises:
+            ValueError: Unknown precision
+        """
+        if precision not in ('float64', 'float32'):
+            raise ValueError("Precision must be 'float64' or 'float32', got %s" % precision)
+        self._precision = precision
+
+    def _subkey_factory(self):
+        if self._precision == 'float32':
+            return functools.partial(CPAProgressiveOneSubkeyCentered, dtype=np.float32)
+        return self._subkeyClass
@@ -0,0 +1,189 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2020, NewAE Technology Inc
+# All rights reserved.
+#
+# Find this and more at newae.com - this file is part of the chipwhisperer
+# project, http://www.github.com/newaetech/chipwhisperer
+#
+#    This file is part of chipwhisperer.
+#
+#    chipwhisperer is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    chipwhisperer is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with chipwhisperer.  If not, see <http://www.gnu.org/licenses/>.
+#=================================================
+import functools
+
+import numpy as np
+
+from ..algorithmsbase import shift_block
+from .progressive import CPAProgressive, block_hypotheses
+from .progressive_vectorized import CPAProgressiveOneSubkeyVectorized
+from chipwhisperer.common.utils.parameter import setupSetParam
+
+
+class CPASecondOrderOneSubkey(CPAProgressiveOneSubkeyVectorized):
+    """Progressive second-order CPA for one subkey.
+
+    Correlates the hypotheses with the centered product (x - mean(x))(y - mean(y)) of every
+    pair of points x in window1 and y in window2, where the means are over all traces added so
+    far. The products are never stored: each block only adds to raw sums of x, y, their products
+    up to x^2*y^2, and their products with the hypotheses. The centered sums are expanded from
+    these whenever the correlation is computed, so the result is exactly that of centering with
+    the current means, with memory of O(guesses x window1 x window2).
+
+    Points in the results are the pairs (i, j) flattened to i*len(window2) + j.
+
+    Args:
+        model: Leakage model.
+        window1 (tuple): (start, end) of the first window, in points of the traces passed.
+        window2 (tuple): (start, end) of the second window, in points of the traces passed.
+    """
+    def __init__(self, model, window1, window2):
+        CPAProgressiveOneSubkeyVectorized.__init__(self, model)
+        self.window1 = window1
+        self.window2 = window2
+        self.offset = (None, None)
+
+    def oneSubkey(self, bnum, pointRange, traces_all, numtraces, plaintexts, ciphertexts, knownkeys, progressBar, state, pbcnt):
+        traces = np.asarray(traces_all[:numtraces], dtype=np.float64)
+        x = traces[:, self.window1[0]:self.window1[1]]
+        y = traces[:, self.window2[0]:self.window2[1]]
+        w1 = x.shape[1]
+        w2 = y.shape[1]
+
+        if self.totalTraces == 0:
+            self.sx = np.zeros(w1)
+            self.sx2 = np.zeros(w1)
+            self.sy = np.zeros(w2)
+            self.sy2 = np.zeros(w2)
+            self.sxy = np.zeros((w1, w2))
+            self.sx2y = np.zeros((w1, w2))
+            self.sxy2 = np.zeros((w1, w2))
+            self.sx2y2 = np.zeros((w1, w2))
+            nguess = self.model.getPermPerSubkey()
+            self.shx = np.zeros((nguess, w1))
+            self.shy = np.zeros((nguess, w2))
+            self.shxy = np.zeros((nguess, w1 * w2))
+
+        #The products go up to fourth order in the samples, so they need the shift the most
+        (x, xoffset) = shift_block(x, self.offset[0])
+        (y, yoffset) = shift_block(y, self.offset[1])
+        self.offset = (xoffset, yoffset)
+        x2 = np.square(x)
+        y2 = np.square(y)
+        hyp = block_hypotheses(self, self.hypotheses, bnum, numtraces, plaintexts, ciphertexts, knownkeys)
+
+        self.totalTraces += numtraces
+        self.sx += np.sum(x, axis=0)
+        self.sx2 += np.sum(x2, axis=0)
+        self.sy += np.sum(y, axis=0)
+        self.sy2 += np.sum(y2, axis=0)
+        self.sxy += np.dot(x.T, y)
+        self.sx2y += np.dot(x2.T, y)
+        self.sxy2 += np.dot(x.T, y2)
+        self.sx2y2 += np.dot(x2.T, y2)
+        self.sumh += np.sum(hyp, axis=0)
+        self.sumhq += np.sum(np.square(hyp), axis=0)
+        self.shx += np.dot(hyp.T, x)
+        self.shy += np.dot(hyp.T, y)
+        #Products of this block only, (traces x w1*w2)
+        prod = (x[:, :, None] * y[:, None, :]).reshape(numtraces, w1 * w2)
+        self.shxy += np.dot(hyp.T, prod)
+
+        #Expand the sums of c = (x - a)(y - b) with a, b the current means
+        n = float(self.totalTraces)
+        a = (self.sx / n)[:, None]
+        b = (self.sy / n)[None, :]
+        sx = self.sx[:, None]
+        sy = self.sy[None, :]
+        sumc = self.sxy - a * sy - b * sx + n * a * b
+        sumc2 = (self.sx2y2 - 2 * b * self.sx2y + np.square(b) * self.sx2[:, None] - 2 * a * self.sxy2
+                 + 4 * a * b * self.sxy - 2 * a * np.square(b) * sx + np.square(a) * self.sy2[None, :]
+                 - 2 * np.square(a) * b * sy + n * np.square(a * b))
+        sumhc = (self.shxy - (self.shy[:, None, :] * a[None]).reshape(-1, w1 * w2)
+                 - (self.shx[:, :, None] * b[None]).reshape(-1, w1 * w2) + np.outer(self.sumh, (a * b).ravel()))
+
+        sumnum = n * sumhc - np.outer(self.sumh, sumc.ravel())
+        sumden1 = np.square(self.sumh) - n * self.sumhq
+        sumden2 = np.square(sumc.ravel()) - n * sumc2.ravel()
+        diffs = sumnum / np.sqrt(np.outer(sumden1, sumden2))
+
+        if progressBar:
+            progressBar.updateStatus(pbcnt, (self.totalTraces-numtraces, self.totalTraces-1, bnum))
+        pbcnt = pbcnt + self.model.getPermPerSubkey()
+
+        return (diffs, pbcnt)
+
+
+class CPASecondOrder(CPAProgressive):
+    """
+    Progressive second-order CPA, for attacking implementations protected by first-order masking.
+
+    Each trace is combined on the fly into the centered products of every pair of points from two
+    windows (for example where the mask and the masked value leak), and these are correlated with
+    the leakage model. Only the two windows are read from the traces and no combined traces are
+    stored, see CPASecondOrderOneSubkey.
+
+    Point p of the results is the pair of points returned by point_pair(p).
+    """
+    _name = "Second Order"
+
+    def __init__(self):
+        self._window1 = (0, 0)
+        self._window2 = (0, 0)
+        CPAProgressive.__init__(self)
+        self.getParams().addChildren([
+            {'name':'Window 1', 'key':'window1', 'type':'range', 'get':self.get_window1, 'set':self.set_window1, 'action':self.updateScript},
+            {'name':'Window 2', 'key':'window2', 'type':'range', 'get':self.get_window2, 'set':self.set_window2, 'action':self.updateScript},
+        ])
+
+    def get_window1(self):
+        return self._window1
+
+    @setupSetParam("Window 1")
+    def set_window1(self, rng):
+        """Set the (start, end) points of the first window"""
+        self._window1 = tuple(rng)
+
+    def get_window2(self):
+        return self._window2
+
+    @setupSetParam("Window 2")
+    def set_window2(self, rng):
+        """Set the (start, end) points of the second window"""
+        self._window2 = tuple(rng)
+
+    def point_pair(self, point):
+        """Return the (window 1, window 2) points combined into a point of the results"""
+        w2 = self._window2[1] - self._window2[0]
+        return (self._window1[0] + point // w2, self._window2[0] + point % w2)
+
+    def _subkey_factory(self):
+        start = min(self._window1[0], self._window2[0])
+        return functools.partial(CPASecondOrderOneSubkey,
+                                 window1=(self._window1[0] - start, self._window1[1] - start),
+                                 window2=(self._window2[0] - start, self._window2[1] - start))
+
+    def addTraces(self, traceSource, tracerange, progressBar=None, pointRange=None):
+        """Attack with the points combined from the two windows. pointRange is not used."""
+        self._check_single_range(pointRange)
+        if self._window1[1] <= self._window1[0] or self._window2[1] <= self._window2[0]:
+            raise ValueError("Set both windows before running a second order attack")
+        if self._tilePoints:
+            raise ValueError("Tile Points can't be used with a second order attack")
+
+        #Only read the points covering both windows
+        start = min(self._window1[0], self._window2[0])
+        end = max(self._window1[1], self._window2[1])
+        return CPAProgressive.addTraces(self, traceSource, tracerange, progressBar, [start, end])
@@ -27,7 +27,7 @@
 
 import numpy as np
 
-from ..algorithmsbase import AlgorithmsBase
+from ..algorithmsbase import AlgorithmsBase, point_set, subkey_traces
 
 
 class CPASimpleLoop(AlgorithmsBase):
@@ -158,7 +158,11 @@ class CPASimpleLoop(AlgorithmsBase):
         for bnum in brange:
             if progressBar:
                 progressBar.setStatusMask("Current Subkey: %d", bnum)
-            (data, pbcnt) = self.oneSubkey(bnum, pointRange, traces, numtraces, textins, textouts, knownkeys, progressBar, self.model, self.modelstate, pbcnt)
+            if isinstance(pointRange, dict):
+                (subtraces, bptrange) = subkey_traces(traces, point_set(pointRange[bnum]))
+            else:
+                (subtraces, bptrange) = (traces, pointRange)
+            (data, pbcnt) = self.oneSubkey(bnum, bptrange, subtraces, numtraces, textins, textouts, knownkeys, progressBar, self.model, self.modelstate, pbcnt)
             self.stats.updateSubkey(bnum, data, tnum=tracerange[1])
             if self.sr:
                 self.sr()
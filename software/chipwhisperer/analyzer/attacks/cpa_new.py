@@ -1,3 +1,4 @@
+import numpy as np
 from .cpa import CPA as CPA_Old
 from chipwhisperer.common.api.ProjectFormat import Project
 from collections import OrderedDict
@@ -38,7 +39,11 @@ class CPA(CPA_Old):
         trace_range: Start and end trace number. Should be a list of length 2
             (i.e. [start_num, end_num]).
         point_range: Range of points to use from waves in project. Should be
-            a list of length 2 ([start_point, end_point]).
+            a list of length 2 ([start_point, end_point]). Can also be a
+            dictionary (or a list with an entry per subkey) with the points
+            of each subkey, as a [start_point, end_point] range or a numpy
+            array of point indices, so that each subkey is only attacked on
+            its own points (see set_subkey_points()).
         subkey_list: List of subkeys to attack (subkey_list = [0, 1, 3] will
             attack subkeys 0, 1, and 3).
 
@@ -107,11 +112,17 @@ class CPA(CPA_Old):
 
     @property
     def point_range(self):
+        if self.get_subkey_points():
+            return self.get_subkey_points()
         return self.get_point_range()
 
     @point_range.setter
     def point_range(self, rng):
-        self.set_point_range(rng)
+        if isinstance(rng, dict) or not np.isscalar(rng[0]):
+            self.set_subkey_points(rng)
+        else:
+            self.set_point_range(rng)
+            self.set_subkey_points(None)
 
     @property
     def subkey_list(self):
@@ -163,6 +174,6 @@ class CPA(CPA_Old):
         self.algorithm.set_target_subkeys(self.get_target_subkeys())
         self.algorithm.setStatsReadyCallback(callback)
         self.algorithm.addTraces(self.get_trace_source(), self.trace_range,
-                                 None, pointRange=self.point_range)
+                                 None, pointRange=self.get_attack_points())
         return self.results
 
@@ -0,0 +1,320 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2020, NewAE Technology Inc
+# All rights reserved.
+#
+# Find this and more at newae.com - this file is part of the chipwhisperer
+# project, http://www.github.com/newaetech/chipwhisperer
+#
+#    This file is part of chipwhisperer.
+#
+#    chipwhisperer is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    chipwhisperer is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with chipwhisperer.  If not, see <http://www.gnu.org/licenses/>.
+#=================================================
+"""Full key rank estimation and key enumeration from per-subkey attack results.
+
+Example::
+
+    results = attack.run()
+    scores = subkey_scores(results)
+    low, rank, high = key_rank(scores, project.keys[0])
+    key, tried = search_key(scores, project.textins[0], project.textouts[0])
+"""
+import heapq
+
+import numpy as np
+
+from .models.aes.funcs import _sbox, _rcon, _gal2
+
+_SBOX = np.array(_sbox, dtype=np.uint8)
+_GAL2 = np.array(_gal2, dtype=np.uint8)
+_RCON = np.array(_rcon, dtype=np.uint8)
+
+#State bytes are stored column by column, byte r of column c at r + 4*c
+_SHIFTROWS = np.array([r + 4 * ((c + r) % 4) for c in range(4) for r in range(4)])
+
+
+def _expand_words(keys):
+    """AES-128 key schedule of (N, 16) keys, as (N, 44, 4) words"""
+    w = np.zeros((len(keys), 44, 4), dtype=np.uint8)
+    w[:, :4] = keys.reshape(-1, 4, 4)
+    for i in range(4, 44):
+        temp = w[:, i - 1]
+        if i % 4 == 0:
+            temp = _SBOX[np.roll(temp, -1, axis=1)]
+            temp[:, 0] ^= _RCON[i // 4]
+        w[:, i] = w[:, i - 4] ^ temp
+    return w
+
+
+def round_key_to_key(round_keys, key_round):
+    """Run the AES-128 key schedule backwards from a round key to the cipher key.
+
+    Args:
+        round_keys (array): (N, 16) round keys.
+        key_round (int): Round of round_keys, 0 (the cipher key) to 10.
+
+    Returns:
+        (N, 16) uint8 array of cipher keys.
+    """
+    round_keys = np.atleast_2d(np.asarray(round_keys, dtype=np.uint8))
+    w = np.zeros((len(round_keys), 44, 4), dtype=np.uint8)
+    w[:, 4 * key_round:4 * key_round + 4] = round_keys.reshape(-1, 4, 4)
+    for i in range(4 * key_round - 1, -1, -1):
+        temp = w[:, i + 3]
+        if i % 4 == 0:
+            temp = _SBOX[np.roll(temp, -1, axis=1)]
+            temp[:, 0] ^= _RCON[i // 4 + 1]
+        w[:, i] = w[:, i + 4] ^ temp
+    return w[:, :4].reshape(-1, 16)
+
+
+def encrypt_aes128(keys, plaintext):
+    """Encrypt one plaintext under many AES-128 keys at once.
+
+    Args:
+        keys (array): (N, 16) keys.
+        plaintext (iterable): 16 byte plaintext.
+
+    Returns:
+        (N, 16) uint8 array of ciphertexts.
+    """
+    keys = np.atleast_2d(np.asarray(keys, dtype=np.uint8))
+    roundkeys = _expand_words(keys).reshape(-1, 11, 16)
+    state = np.asarray(plaintext, dtype=np.uint8)[None, :] ^ roundkeys[:, 0]
+    for rnd in range(1, 11):
+        state = _SBOX[state][:, _SHIFTROWS]
+        if rnd != 10:
+            #MixColumns, byte r of a column is 2*a[r] ^ 3*a[r+1] ^ a[r+2] ^ a[r+3]
+            a = state.reshape(-1, 4, 4)
+            b = _GAL2[a]
+            state = (b ^ np.roll(b, -1, axis=2) ^ np.roll(a, -1, axis=2) ^ np.roll(a, -2, axis=2) ^ np.roll(a, -3, axis=2)).reshape(-1, 16)
+        state = state ^ roundkeys[:, rnd]
+    return state
+
+
+def subkey_scores(results, use_absolute=True):
+    """Turn the peak correlations of an attack into per-subkey log probabilities.
+
+    The peak correlation r of each guess is Fisher transformed, z = atanh(r),
+    which for n traces is close to normal with variance 1/(n-3). The score of a
+    guess is then the log likelihood (n-3)*z^2/2, normalised over the guesses
+    so that the scores of a subkey are log probabilities. Scores of different
+    subkeys can be added to score a full key.
+
+    Args:
+        results (Results): Results of a CPA attack.
+        use_absolute (bool): Use the absolute value of the correlations.
+
+    Returns:
+        (subkeys, guesses) array of log probabilities. Subkeys that were not
+        attacked have every guess equally likely.
+    """
+    results.find_maximums(use_absolute=use_absolute)
+    scores = np.zeros((results.numSubkeys, results.numPerms))
+    for bnum in range(results.numSubkeys):
+        if not results.maxValid[bnum]:
+            continue
+        maxes = results.maxes[bnum]
+        corr = np.zeros(results.numPerms)
+        corr[maxes['hyp']] = np.nan_to_num(maxes['value'])
+        ntraces = results.diffs_tnum[bnum] or 4
+        z = np.arctanh(np.clip(corr, -1 + 1E-12, 1 - 1E-12))
+        scores[bnum] = max(ntraces - 3, 1) * np.square(z) / 2
+
+    top = np.max(scores, axis=1, keepdims=True)
+    return scores - top - np.log(np.sum(np.exp(scores - top), axis=1, keepdims=True))
+
+
+def key_rank(scores, key, bins=2048):
+    """Estimate the rank of the full key by histogram convolution.
+
+    The scores of each subkey are put in a histogram with a common bin width.
+    Convolving the histograms gives the histogram of the scores of all full keys,
+    and the rank is the number of keys in bins above the one holding the
+    correct key. Each subkey adds up to one bin of rounding, so the rank is also
+    bounded by counting from that many bins either side of it.
+
+    Args:
+        scores (array): (subkeys, guesses) scores, higher meaning more likely
+            (see subkey_scores()).
+        key (iterable): Correct value of each subkey.
+        bins (int): Histogram bins per subkey.
+
+    Returns:
+        (low, rank, high): Lower bound, estimate and upper bound of the rank of
+        the key, 1 meaning it is the most likely key. Returned as floats as
+        they can go up to 2^128.
+    """
+    scores = np.asarray(scores, dtype=np.float64)
+    nsub = scores.shape[0]
+    lowest = np.min(scores, axis=1)
+    width = np.max(np.max(scores, axis=1) - lowest) / (bins - 1)
+    if width == 0:
+        width = 1.0
+
+    hist = np.ones(1)
+    keybin = 0
+    for bnum in range(nsub):
+        idx = np.floor((scores[bnum] - lowest[bnum]) / width).astype(np.int64)
+        hist = np.convolve(hist, np.bincount(idx, minlength=bins).astype(np.float64))
+        keybin += idx[key[bnum]]
+
+    def above(b):
+        return np.sum(hist[max(b, 0):])
+
+    low = max(above(keybin + nsub + 1) + 1, 1.0)
+    rank = above(keybin + 1) + (hist[keybin] + 1) / 2
+    high = min(above(keybin - nsub) + 1, float(scores.shape[1]) ** nsub)
+    return low, rank, high
+
+
+class _Leaf(object):
+    """Guesses of a few subkeys, all combinations sorted best first"""
+    def __init__(self, scores, bnums):
+        combined = np.zeros(1)
+        for bnum in bnums:
+            combined = np.add.outer(combined, scores[bnum]).ravel()
+        order = np.argsort(-combined, kind='stable')
+        self.scores = combined[order]
+        self.size = len(order)
+        #Guess of each subkey, for each combination in sorted order
+        self.guesses = np.array(np.unravel_index(order, [scores.shape[1]] * len(bnums))).T
+
+    def score(self, k):
+        if k < self.size:
+            return self.scores[k]
+        return None
+
+    def decode(self, ks):
+        return self.guesses[ks]
+
+
+class _Merge(object):
+    """Combinations of the outputs of two nodes, produced best first on demand"""
+    def __init__(self, left, right):
+        self.left = left
+        self.right = right
+        self.size = left.size * right.size
+        self.scores = np.zeros(1024)
+        self._li = np.zeros(1024, dtype=np.int64)
+        self._ri = np.zeros(1024, dtype=np.int64)
+        self._count = 0
+        self._heap = [(-(left.score(0) + right.score(0)), 0, 0)]
+        self._seen = set([(0, 0)])
+
+    def _push(self, i, j):
+        if (i, j) in self._seen:
+            return
+        ls = self.left.score(i)
+        if ls is None:
+            return
+        rs = self.right.score(j)
+        if rs is None:
+            return
+        self._seen.add((i, j))
+        heapq.heappush(self._heap, (-(ls + rs), i, j))
+
+    def score(self, k):
+        while self._count <= k:
+            if not self._heap:
+                return None
+            s, i, j = heapq.heappop(self._heap)
+            if self._count == len(self.scores):
+                self.scores = np.concatenate([self.scores, np.zeros(self._count)])
+                self._li = np.concatenate([self._li, np.zeros(self._count, dtype=np.int64)])
+                self._ri = np.concatenate([self._ri, np.zeros(self._count, dtype=np.int64)])
+            self.scores[self._count] = -s
+            self._li[self._count] = i
+            self._ri[self._count] = j
+            self._count += 1
+            self._seen.discard((i, j))
+            self._push(i + 1, j)
+            self._push(i, j + 1)
+        return self.scores[k]
+
+    def decode(self, ks):
+        return np.hstack([self.left.decode(self._li[ks]), self.right.decode(self._ri[ks])])
+
+
+class KeyEnumerator(object):
+    """Enumerates full keys in order of decreasing score.
+
+    The order is exact: the sum of the subkey scores never increases from one
+    key to the next. Subkeys are paired up into sorted tables of all their
+    combinations, which are then merged pairwise, each merge producing its
+    combinations best first only as far as needed.
+
+    Args:
+        scores (array): (subkeys, guesses) scores, higher meaning more likely
+            (see subkey_scores()).
+    """
+    def __init__(self, scores):
+        scores = np.asarray(scores, dtype=np.float64)
+        nodes = [_Leaf(scores, list(range(b, min(b + 2, scores.shape[0])))) for b in range(0, scores.shape[0], 2)]
+        while len(nodes) > 1:
+            nodes = [_Merge(nodes[i], nodes[i + 1]) if i + 1 < len(nodes) else nodes[i] for i in range(0, len(nodes), 2)]
+        self._root = nodes[0]
+        self._next = 0
+
+    def next_keys(self, num):
+        """Return the next num keys (fewer once all keys are used).
+
+        Returns:
+            (keys, scores): (n, subkeys) uint8 array of keys, and their scores.
+        """
+        end = self._next
+        while end < self._next + num and self._root.score(end) is not None:
+            end += 1
+        ks = np.arange(self._next, end)
+        self._next = end
+        return self._root.decode(ks).astype(np.uint8), self._root.scores[ks]
+
+
+def search_key(scores, plaintext, ciphertext, max_keys=2**24, batch=65536, key_round=0):
+    """Search for the AES-128 key, trying full keys in order of decreasing score.
+
+    Keys are tried a batch at a time, encrypting the plaintext under the whole
+    batch at once.
+
+    Args:
+        scores (array): (16, 256) scores of the guesses of each byte of the
+            round key (see subkey_scores()).
+        plaintext (iterable): Known 16 byte plaintext.
+        ciphertext (iterable): Ciphertext of plaintext under the key.
+        max_keys (int): Give up after this many keys.
+        batch (int): Number of keys encrypted at a time.
+        key_round (int): Round of the key attacked, for example 10 for an
+            attack on the last round key.
+
+    Returns:
+        (key, tried): The cipher key as a list (None if not found), and the
+        number of keys tried.
+    """
+    ciphertext = np.asarray(ciphertext, dtype=np.uint8)
+    enumerator = KeyEnumerator(scores)
+    tried = 0
+    while tried < max_keys:
+        candidates, _ = enumerator.next_keys(min(batch, max_keys - tried))
+        if len(candidates) == 0:
+            break
+        if key_round:
+            keys = round_key_to_key(candidates, key_round)
+        else:
+            keys = candidates
+        match = np.nonzero(np.all(encrypt_aes128(keys, plaintext) == ciphertext, axis=1))[0]
+        if len(match):
+            return [int(b) for b in keys[match[0]]], tried + int(match[0]) + 1
+        tried += len(candidates)
+    return None, tried
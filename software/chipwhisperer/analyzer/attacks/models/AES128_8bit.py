@@ -26,13 +26,41 @@
 
 from collections import OrderedDict
 import inspect
+import numpy as np
 
 from chipwhisperer.analyzer.attacks.models.aes.funcs import sbox, inv_sbox, subbytes, inv_subbytes, mixcolumns, inv_mixcolumns, shiftrows, inv_shiftrows
+from chipwhisperer.analyzer.attacks.models.aes.funcs import _sbox, _i_sbox
 
 from .base import ModelsBase
 from chipwhisperer.analyzer.attacks.models.aes.key_schedule import key_schedule_rounds
 from chipwhisperer.common.utils.util import camel_case_deprecated
 
+
+_guess_tables = {}
+
+def guess_table(name, func):
+    """Get the 256x256 lookup table func(x ^ guess), indexed by [x, guess].
+
+    Tables are built the first time they are requested and cached by name, so
+    every model sharing a table (e.g. all the SBox models) only builds it once.
+
+    Args:
+        name (str): Name the table is cached under
+        func (list): 256-entry lookup table applied after the key addition
+
+    Returns:
+        (256, 256) uint8 array
+    """
+    if name not in _guess_tables:
+        xk = np.bitwise_xor.outer(np.arange(256), np.arange(256))
+        _guess_tables[name] = np.asarray(func, dtype=np.uint8)[xk]
+    return _guess_tables[name]
+
+
+_identity = np.arange(256)
+_sbox_inout = np.arange(256) ^ np.array(_sbox)
+
+
 class AESLeakageHelper(object):
 
     #Name of AES Model
@@ -106,11 +134,53 @@ class AESLeakageHelper(object):
         """
         raise NotImplementedError("ASKLeakageHelper does not implement leakage")
 
+    def leakage_matrix(self, pt, ct, key, bnum):
+        """
+        Vectorized leakage() for every guess of byte 'bnum' over a block of traces.
+
+        This generic version calls leakage() for each trace and guess. Override it with
+        table lookups (see guess_table()) to speed up attacks using the model. AES128_8bit uses this generic
+        version for subclasses that override leakage() but not leakage_matrix().
+
+        Args:
+            pt: (N, 16) uint8 array of plain-text inputs, or None if not available.
+            ct: (N, 16) uint8 array of cipher-text outputs, or None if not available.
+            key: (N, 16) uint8 array of known keys, or None if not available.
+            bnum: Byte number we are trying to attack.
+
+        Returns:
+            (N, 256) uint8 array of the values presented on the 8-bit bus for each trace and guess.
+        """
+        ntraces = len(pt) if pt is not None else len(ct)
+        ivs = np.zeros((ntraces, 256), dtype=np.uint8)
+        for tnum in range(ntraces):
+            if key is not None:
+                k = list(key[tnum])
+            else:
+                k = [None]*16
+            p = pt[tnum] if pt is not None else None
+            c = ct[tnum] if ct is not None else None
+            for guess in range(0, 256):
+                k[bnum] = guess
+                ivs[tnum, guess] = self.leakage(p, c, k, bnum)
+        return ivs
+
+    def _previous_byte(self, pt, key, bnum, func):
+        """Helper for successive models: func of the known byte before bnum (0 for bnum=0)"""
+        if bnum == 0:
+            return np.zeros((len(pt), 1), dtype=np.uint8)
+        if key is None:
+            raise ValueError("Successive requires known key")
+        return np.asarray(func, dtype=np.uint8)[pt[:, bnum-1] ^ key[:, bnum-1]][:, None]
+
 class PtKey_XOR(AESLeakageHelper):
     name = 'HW: AddRoundKey Output, First Round (Enc)'
     def leakage(self, pt, ct, key, bnum):
         return pt[bnum] ^ key[bnum]
 
+    def leakage_matrix(self, pt, ct, key, bnum):
+        return guess_table('xor', _identity)[pt[:, bnum]]
+
 class SBox_output(AESLeakageHelper):
     name = 'HW: AES SBox Output, First Round (Enc)'
     c_model_enum_value = 1
@@ -118,6 +188,9 @@ class SBox_output(AESLeakageHelper):
     def leakage(self, pt, ct, key, bnum):
         return self.sbox(pt[bnum] ^ key[bnum])
 
+    def leakage_matrix(self, pt, ct, key, bnum):
+        return guess_table('sbox', _sbox)[pt[:, bnum]]
+
 class InvSBox_output(AESLeakageHelper):
     name = 'HW: AES Inv SBox Output, First Round (Dec)'
     c_model_enum_value = 6
@@ -125,6 +198,9 @@ class InvSBox_output(AESLeakageHelper):
     def leakage(self, pt, ct, key, bnum):
         return self.inv_sbox(pt[bnum] ^ key[bnum])
 
+    def leakage_matrix(self, pt, ct, key, bnum):
+        return guess_table('inv_sbox', _i_sbox)[pt[:, bnum]]
+
 class LastroundHW(AESLeakageHelper):
     name = 'HW: AES Last-Round State'
     def leakage(self, pt, ct, key, bnum):
@@ -137,6 +213,9 @@ class LastroundHW(AESLeakageHelper):
     def process_known_key(self, inpkey):
         return key_schedule_rounds(inpkey, 0, 10)
 
+    def leakage_matrix(self, pt, ct, key, bnum):
+        return guess_table('inv_sbox', _i_sbox)[ct[:, bnum]]
+
 
 class LastroundStateDiff(AESLeakageHelper):
     name = 'HD: AES Last-Round State'
@@ -152,6 +231,10 @@ class LastroundStateDiff(AESLeakageHelper):
     def process_known_key(self, inpkey):
         return key_schedule_rounds(inpkey, 0, 10)
 
+    def leakage_matrix(self, pt, ct, key, bnum):
+        st9 = guess_table('inv_sbox', _i_sbox)[ct[:, bnum]]
+        return st9 ^ ct[:, self.INVSHIFT_undo[bnum], None]
+
 class LastroundStateDiffAlternate(AESLeakageHelper):
     name = 'HD: AES Last-Round State Alternate'
     def leakage(self, pt, ct, key, bnum):
@@ -160,6 +243,10 @@ class LastroundStateDiffAlternate(AESLeakageHelper):
         st9 = inv_sbox(ct[bnum] ^ key[bnum])
         return (st9 ^ st10)
 
+    def leakage_matrix(self, pt, ct, key, bnum):
+        st9 = guess_table('inv_sbox', _i_sbox)[ct[:, bnum]]
+        return st9 ^ ct[:, bnum, None]
+
     def process_known_key(self, inpkey):
         k = key_schedule_rounds(inpkey, 0, 10)
         k = self.shiftrows(k)
@@ -174,6 +261,9 @@ class SBoxInOutDiff(AESLeakageHelper):
         st2 = self.sbox(st1)
         return st1 ^ st2
 
+    def leakage_matrix(self, pt, ct, key, bnum):
+        return guess_table('sbox_inout', _sbox_inout)[pt[:, bnum]]
+
 class SBoxInputSuccessive(AESLeakageHelper):
     name = 'HD: AES SBox Input i to i+1'
     c_model_enum_name = 4
@@ -189,6 +279,10 @@ class SBoxInputSuccessive(AESLeakageHelper):
             st2 = 0
         return st1 ^ st2
 
+    def leakage_matrix(self, pt, ct, key, bnum):
+        st1 = guess_table('xor', _identity)[pt[:, bnum]]
+        return st1 ^ self._previous_byte(pt, key, bnum, _identity)
+
 class SBoxOutputSuccessive(AESLeakageHelper):
     name = 'HD: AES SBox Output i to i+1'
     c_model_enum_value = 5
@@ -204,11 +298,18 @@ class SBoxOutputSuccessive(AESLeakageHelper):
             st2 = 0
         return st1 ^ st2
 
+    def leakage_matrix(self, pt, ct, key, bnum):
+        st1 = guess_table('sbox', _sbox)[pt[:, bnum]]
+        return st1 ^ self._previous_byte(pt, key, bnum, _sbox)
+
 class AfterKeyMixin(AESLeakageHelper):
     name = 'HW: AES After Key/PT Addition'
     def leakage(self, pt, ct, key, bnum):
         return pt[bnum] ^ key[bnum]
 
+    def leakage_matrix(self, pt, ct, key, bnum):
+        return guess_table('xor', _identity)[pt[:, bnum]]
+
 class Mixcolumns_output(AESLeakageHelper):
     name = 'HW: AES Mixcolumns Output'
     #This is mostly a nonsense leakage model for now, but added for completeness
@@ -265,6 +366,28 @@ class Round1Round2StateDiff_SBox(AESLeakageHelper):
         state = subbytes(state)
         return state[bnum] ^ state1[bnum]
 
+def _matrix_matches_leakage(modelobj):
+    """Whether the leakage_matrix() of a model was written for its leakage().
+
+    A subclass of a built-in model that only overrides leakage() would otherwise
+    inherit the table lookup of the built-in one.
+    """
+    mro = type(modelobj).__mro__
+    matrix_cls = next(cls for cls in mro if 'leakage_matrix' in vars(cls))
+    leakage_cls = next(cls for cls in mro if 'leakage' in vars(cls))
+    return mro.index(matrix_cls) <= mro.index(leakage_cls)
+
+def _byte_array(data):
+    """Convert a block of texts/keys to an (N, 16) uint8 array, or None if empty"""
+    if data is None or len(data) == 0:
+        return None
+    arr = np.asarray(data)
+    if arr.ndim != 2 or arr.dtype.kind not in 'iub':
+        arr = np.array([np.frombuffer(bytes(bytearray(d)), dtype=np.uint8) for d in data])
+    if arr.ndim != 2:
+        raise ValueError("Texts are not all the same length")
+    return arr.astype(np.uint8, copy=False)
+
 #List of all classes you can use
 enc_list = [SBox_output, PtKey_XOR, SBoxInputSuccessive, SBoxInOutDiff, LastroundStateDiff, LastroundStateDiffAlternate, SBoxOutputSuccessive, ShiftColumns_output, Mixcolumns_output, Round1Round2StateDiff_Text, Round1Round2StateDiff_KeyMix, Round1Round2StateDiff_SBox]
 dec_list = [InvSBox_output]
@@ -285,6 +408,9 @@ class AES128_8bit(ModelsBase):
         self.numRoundKeys = 10
         self._mask = bitmask
 
+        #HW of each masked 8-bit value, used by leakage_matrix()
+        self._hw_table = np.array(self.HW, dtype=np.uint8)[np.arange(256) & bitmask]
+
     def _updateHwModel(self):
         """" Re-implement this to update leakage model """
         self.modelobj = None
@@ -347,6 +473,75 @@ class AES128_8bit(ModelsBase):
         #Return HW of guess
         return self.HW[intermediate_value]
 
+    def leakage_matrix(self, pt, ct, bnum, knownkeys=None):
+        """ Leakage of all 256 guesses of a subkey for a block of traces
+
+        Uses the vectorized leakage_matrix() of the model, which for the built-in
+        models is a lookup into a cached 256x256 table instead of 256 calls to
+        leakage() per trace.
+
+        Args:
+            pt (list): Plaintexts/textins of the block, one per trace
+            ct (list): Ciphertexts/textouts of the block, one per trace
+            bnum (int): Subkey Byte Number
+            knownkeys (list, optional): Known keys of the block, one per trace
+
+        Returns:
+            (N, 256) uint8 array of hamming weights
+        """
+        return self._hw_table[self.intermediate_matrix(pt, ct, bnum, knownkeys)]
+
+    def intermediate_matrix(self, pt, ct, bnum, knownkeys=None):
+        """ Intermediate values of all 256 guesses of a subkey for a block of traces
+
+        Same as leakage_matrix(), but returns the masked values on the 8-bit bus
+        instead of their hamming weights, for attacks on single bits (DPA).
+
+        Args:
+            pt (list): Plaintexts/textins of the block, one per trace
+            ct (list): Ciphertexts/textouts of the block, one per trace
+            bnum (int): Subkey Byte Number
+            knownkeys (list, optional): Known keys of the block, one per trace
+
+        Returns:
+            (N, 256) uint8 array of intermediate values
+        """
+        try:
+            pt_arr = _byte_array(pt)
+            ct_arr = _byte_array(ct)
+        except (TypeError, ValueError):
+            #Text isn't fixed-width bytes, so fall back to calling the model per trace
+            return self._intermediate_loop(pt, ct, bnum, knownkeys)
+
+        try:
+            key = _byte_array(knownkeys)
+            if key is not None and key.shape[1] != 16:
+                key = None
+        except (TypeError, ValueError):
+            key = None
+
+        if _matrix_matches_leakage(self.modelobj):
+            intermediate_values = self.modelobj.leakage_matrix(pt_arr, ct_arr, key, bnum)
+        else:
+            intermediate_values = AESLeakageHelper.leakage_matrix(self.modelobj, pt_arr, ct_arr, key, bnum)
+        return np.asarray(intermediate_values, dtype=np.uint8) & self._mask
+
+    def _intermediate_loop(self, pt, ct, bnum, knownkeys):
+        """Per-trace version of intermediate_matrix(), for texts that aren't fixed-width bytes"""
+        ntraces = len(pt) if pt is not None and len(pt) > 0 else len(ct)
+        ivs = np.zeros((ntraces, 256), dtype=np.uint8)
+        for tnum in range(ntraces):
+            p = pt[tnum] if pt is not None and len(pt) > 0 else None
+            c = ct[tnum] if ct is not None and len(ct) > 0 else None
+            if knownkeys is not None and len(knownkeys) > 0 and knownkeys[tnum] is not None:
+                key = list(knownkeys[tnum])
+            else:
+                key = [None]*16
+            for guess in range(0, 256):
+                key[bnum] = guess
+                ivs[tnum, guess] = self._mask & self.modelobj.leakage(p, c, key, bnum)
+        return ivs
+
     def key_schedule_rounds(self, inputkey, inputround, desiredround):
         """Changes the round of inputkey from inputround to desiredround
 
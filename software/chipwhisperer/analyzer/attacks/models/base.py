@@ -95,6 +95,36 @@ class ModelsBase(Parameterized):
     def leakage(self, pt, ct, guess, bnum, state):
         pass
 
+    def leakage_matrix(self, pt, ct, bnum, knownkeys=None):
+        """Leakage of every key guess for a block of traces.
+
+        Generic version which calls leakage() once per trace and guess.
+        Models should override this with a vectorized version where possible.
+
+        Args:
+            pt (list): Plaintexts/textins of the block, one per trace
+            ct (list): Ciphertexts/textouts of the block, one per trace
+            bnum (int): Subkey Byte Number
+            knownkeys (list, optional): Known keys of the block, one per trace
+
+        Returns:
+            Array of shape (number of traces, permPerSubkey) where entry [t, g]
+            is the hypothetical leakage of trace t for key guess g
+        """
+        numtraces = max(len(pt), len(ct))
+        state = {'knownkey':None}
+        hyp = np.zeros((numtraces, self.getPermPerSubkey()))
+        for tnum in range(numtraces):
+            p = pt[tnum] if len(pt) > 0 else None
+            c = ct[tnum] if len(ct) > 0 else None
+            if knownkeys is not None and len(knownkeys) > 0:
+                state['knownkey'] = knownkeys[tnum]
+            else:
+                state['knownkey'] = None
+            for guess in range(self.getPermPerSubkey()):
+                hyp[tnum, guess] = self.leakage(p, c, guess, bnum, state)
+        return hyp
+
     def getNumSubKeys(self):
         return self.numSubKeys
 
@@ -0,0 +1,200 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2020, NewAE Technology Inc
+# All rights reserved.
+#
+# Find this and more at newae.com - this file is part of the chipwhisperer
+# project, http://www.github.com/newaetech/chipwhisperer
+#
+#    This file is part of chipwhisperer.
+#
+#    chipwhisperer is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    chipwhisperer is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with chipwhisperer.  If not, see <http://www.gnu.org/licenses/>.
+#=================================================
+import numpy as np
+from chipwhisperer.common.utils import util
+from chipwhisperer.analyzer.attacks.snr import SNR
+
+
+class PointsOfInterest(SNR):
+    """Streaming point of interest (POI) selection for every subkey.
+
+    Keeps the same per-class statistics as :class:`SNR` (traces are read in
+    blocks, in one pass for all subkeys, and can be added with update()) and
+    ranks the points of each subkey by one of these metrics:
+
+     * 'snr': the signal-to-noise ratio, see SNR.snr().
+     * 'sosd': the sum of the squared differences of the class means.
+     * 'corr': the absolute correlation of the traces with the leakage of
+       the known key.
+
+    The selected POIs (and a window of points around them for each subkey)
+    can be saved to the project, where they are read by the template attack
+    (ProfilingTemplate.loadPOIs()) and by load_pois().
+
+    Args:
+        leak_models: A leakage model or partition method, or a list of them.
+        bnums (list, optional): Subkeys to select POIs for. Defaults to all
+            subkeys.
+    """
+    metrics = ('snr', 'sosd', 'corr')
+
+    def _class_means(self, model):
+        """Count (subkeys, classes, 1) and mean (subkeys, classes, points) of each class"""
+        if self._count[model] is None:
+            raise ValueError("No traces added")
+        count = self._count[model][:, :, None]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mean = np.where(count > 0, self._sum[model] / count, 0)
+        return count, mean
+
+    def sosd(self, bnum=None, model=0):
+        """Return the sum of squared differences of the class means of each point.
+
+        Only classes with traces are used, every pair of them once.
+        """
+        count, mean = self._class_means(model)
+        used = count > 0
+        numclasses = np.sum(used, axis=1)
+        sums = np.sum(np.where(used, mean, 0), axis=1)
+        sumsq = np.sum(np.where(used, np.square(mean), 0), axis=1)
+        sosd = numclasses * sumsq - np.square(sums)
+
+        if bnum is None:
+            return sosd
+        return sosd[self.bnums.index(bnum)]
+
+    def correlation(self, bnum=None, model=0):
+        """Return the absolute correlation of each point with the leakage of the known key.
+
+        The leakage of a trace is its class, e.g. the Hamming weight for the
+        leakage models or the partition number for a partition method.
+        """
+        if self._count[model] is None:
+            raise ValueError("No traces added")
+        count = self._count[model]
+        leakage = np.arange(count.shape[1], dtype=np.float64)
+        total = np.sum(count, axis=1)[:, None]
+
+        sumh = np.dot(count, leakage)[:, None]
+        sumhq = np.dot(count, np.square(leakage))[:, None]
+        sumt = np.sum(self._sum[model], axis=1)
+        sumtq = np.sum(self._sumsq[model], axis=1)
+        sumht = np.einsum('c,bcp->bp', leakage, self._sum[model])
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            corr = np.abs(total * sumht - sumh * sumt) / np.sqrt((total * sumhq - np.square(sumh)) * (total * sumtq - np.square(sumt)))
+
+        if bnum is None:
+            return corr
+        return corr[self.bnums.index(bnum)]
+
+    def metric(self, metric='snr', bnum=None, model=0):
+        """Return the SNR, SOSD or correlation ('snr', 'sosd' or 'corr') of each point"""
+        if metric == 'snr':
+            return self.snr(bnum, model)
+        elif metric == 'sosd':
+            return self.sosd(bnum, model)
+        elif metric == 'corr':
+            return self.correlation(bnum, model)
+        raise ValueError("Metric must be one of %s, got %s" % (", ".join(self.metrics), metric))
+
+    def select(self, num_pois=10, min_spacing=5, metric='snr', model=0):
+        """Select the best points of each subkey.
+
+        Points are taken from the best down, skipping points closer than
+        min_spacing to a point already selected, so a single peak of the
+        metric doesn't use up all POIs.
+
+        Args:
+            num_pois (int): Maximum number of POIs per subkey.
+            min_spacing (int): Minimum distance between two POIs of a subkey.
+            metric (str): 'snr', 'sosd' or 'corr'.
+            model (int): Index of the leakage model.
+
+        Returns:
+            List with the POIs of each subkey in bnums, ranked best first.
+        """
+        values = self.metric(metric, None, model)
+        values = np.where(np.isnan(values), -np.inf, values)
+        spacing = max(int(min_spacing), 1)
+        pois = []
+        for row in values:
+            blocked = np.zeros(len(row), dtype=bool)
+            selected = []
+            for point in np.argsort(-row, kind='stable'):
+                if len(selected) >= num_pois or not np.isfinite(row[point]):
+                    break
+                if blocked[point]:
+                    continue
+                selected.append(int(point))
+                blocked[max(point - spacing + 1, 0):point + spacing] = True
+            pois.append(selected)
+        return pois
+
+    def windows(self, pois, margin=0):
+        """Point range (start, end) of each subkey covering its POIs, plus margin points on each side"""
+        numpoints = self._sum[0].shape[2]
+        ranges = []
+        for selected in pois:
+            if len(selected) == 0:
+                ranges.append((0, numpoints))
+            else:
+                ranges.append((max(min(selected) - margin, 0), min(max(selected) + margin + 1, numpoints)))
+        return ranges
+
+    def save(self, project, num_pois=10, min_spacing=5, metric='snr', margin=0, model=0):
+        """Select POIs and save them with their windows to the project.
+
+        The POIs are stored as a "Points of Interest" section of the template
+        data in the project configuration, so they can be read back with
+        load_pois() or by the template attack. The project needs to be saved
+        to write them to disk.
+
+        Returns:
+            The POIs, as returned by select()
+        """
+        pois = self.select(num_pois, min_spacing, metric, model)
+        windows = self.windows(pois, margin)
+        leak_model = self.leak_models[model]
+        cfgsec = project.addDataConfig(sectionName="Template Data", subsectionName="Points of Interest")
+        cfgsec["metric"] = metric
+        cfgsec["model"] = leak_model.__class__.__name__
+        cfgsec["numtraces"] = self.num_traces
+        cfgsec["bnums"] = [int(bnum) for bnum in self.bnums]
+        cfgsec["poi"] = pois
+        cfgsec["windows"] = [list(window) for window in windows]
+        return pois
+
+
+def load_pois(project):
+    """Return the POIs last saved to the project by PointsOfInterest.save(), or None.
+
+    Returns:
+        Dictionary with the (per subkey) "poi" and "windows" lists, and the
+        "bnums" they belong to.
+    """
+    sections = project.getDataConfig("Template Data", "Points of Interest")
+    if len(sections) == 0:
+        return None
+    section = sections[-1]
+    pois = section.copy()
+    pois["poi"] = util.strListToList(str(section["poi"]))
+    if "windows" in section:
+        pois["windows"] = [tuple(window) for window in util.strListToList(str(section["windows"]))]
+    if "bnums" in section:
+        pois["bnums"] = [int(bnum) for bnum in section["bnums"]]
+    else:
+        pois["bnums"] = list(range(len(pois["poi"])))
+    return pois
@@ -26,79 +26,126 @@
 #=================================================
 import logging
 import numpy as np
-import scipy
+import scipy.linalg
 import sys
 
 from chipwhisperer.common.utils import util
-from chipwhisperer.analyzer.ui.CWAnalyzerGUI import CWAnalyzerGUI
-from ..algorithmsbase import AlgorithmsBase
+from chipwhisperer.common.utils.parameter import setupSetParam
+from ..algorithmsbase import AlgorithmsBase, shift_block
+from ..models.AES128_8bit import AES128_8bit, SBox_output, LastroundStateDiff
+from chipwhisperer.analyzer.utils.Partition import partition_table
 
 
 class TemplateUsingMVS(object):
     """
     Template using Multivariate Stats (mean + covariance matrix)
+
+    Templates are built from streaming statistics of each (subkey, partition): the number of
+    traces, and the sum and sum of outer products of the POI vectors (see shift_block() for
+    the offset they are taken around). These are kept in the template with
+    the mean and covariance, so more profiling traces can be added with update() without
+    going over the old ones again.
     """
 
+    #Traces read at a time
+    block_size = 1000
+
     @staticmethod
     def generate(traceSource, trange, poiList, partMethod, progressBar=None):
         """Generate templates for all partitions over entire trace range"""
+        numPartitions = partMethod.getNumPartitions()
+        template = {
+         "count":[np.zeros(numPartitions) for poi in poiList],
+         "sum":[np.zeros((numPartitions, len(poi))) for poi in poiList],
+         "outer":[np.zeros((numPartitions, len(poi), len(poi))) for poi in poiList],
+         "offset":None,
+         "trange":(trange[0], trange[0]),
+         "poi":poiList,
+         "partitiontype":partMethod.__class__.__name__
+        }
+        return TemplateUsingMVS.update(template, traceSource, trange, partMethod, progressBar)
 
-        # Number of subkeys
+    @staticmethod
+    def update(template, traceSource, trange, partMethod, progressBar=None):
+        """Add the traces in trange to a template from generate() (or loaded from a project)
+
+        Returns:
+            New template dictionary, the template passed is not changed. Its
+            "trange" covers the old and new traces.
+        """
+        template = dict((k, template[k]) for k in template.keys())
+        if "count" not in template:
+            raise ValueError("Template has no trace statistics to update, generate it again")
+        if str(template["partitiontype"]) != partMethod.__class__.__name__:
+            raise ValueError("Template was generated with %s, can't add traces partitioned with %s" %
+                             (template["partitiontype"], partMethod.__class__.__name__))
+
+        poiList = [np.asarray(poi, dtype=int) for poi in template["poi"]]
         subkeys = len(poiList)
-
-        numPartitions = partMethod.getNumPartitions()
+        count = [np.array(c, dtype=np.float64) for c in template["count"]]
+        sums = [np.array(s, dtype=np.float64) for s in template["sum"]]
+        outer = [np.array(o, dtype=np.float64) for o in template["outer"]]
+        offset = template["offset"]
+        if offset is None:
+            offset = [None] * subkeys
+        else:
+            offset = [np.asarray(o, dtype=np.float64) for o in offset]
 
         tstart = trange[0]
         tend = trange[1]
 
-        templateTraces = [ [ [] for j in range(0, numPartitions) ] for i in range(0, subkeys) ]
-
-        templateMeans = [ np.zeros((numPartitions, len(poiList[i]))) for i in range (0, subkeys) ]
-        templateCovs = [ np.zeros((numPartitions, len(poiList[i]), len(poiList[i]))) for i in range (0, subkeys) ]
-
-        if progressBar:
-            progressBar.setText('Generating Trace Matrix:')
-            progressBar.setMaximum(tend - tstart + subkeys)
-
-        for tnum in range(tstart, tend):
-            # partData = traceSource.getAuxData(tnum, self.partObject.attrDictPartition)["filedata"]
-            pnum = partMethod.getPartitionNum(traceSource, tnum)
-            t = traceSource.getTrace(tnum)
-            for bnum in range(0, subkeys):
-                templateTraces[bnum][pnum[bnum]].append(t[poiList[bnum]])
-
-            if progressBar:
-                progressBar.updateStatus(tnum - tstart)
-                if progressBar.wasAborted():
-                    return None
+        #Only read the points covering all POIs
+        allpoi = np.concatenate(poiList)
+        prange = (int(allpoi.min()), int(allpoi.max()) + 1)
 
         if progressBar:
             progressBar.setText('Generating Trace Covariance and Mean Matrices:')
+            progressBar.setMaximum(tend - tstart)
 
-        for bnum in range(0, subkeys):
-            for i in range(0, numPartitions):
-                templateMeans[bnum][i] = np.mean(templateTraces[bnum][i], axis=0)
-                cov = np.cov(templateTraces[bnum][i], rowvar=0)
-                if __debug__: logging.debug('templateTraces[%d][%d] = %d' % (bnum, i, len(templateTraces[bnum][i])))
+        #Partition tables stored with project traces are reused
+        labels = partition_table(traceSource, partMethod, tstart, tend)
+
+        for bstart in range(tstart, tend, TemplateUsingMVS.block_size):
+            bend = min(bstart + TemplateUsingMVS.block_size, tend)
+            waves = np.asarray(traceSource.get_traces(bstart, bend, prange).wave, dtype=np.float64)
+            pnum = labels[bstart - tstart:bend - tstart]
 
-                if len(templateTraces[bnum][i]) > 0:
-                    templateCovs[bnum][i] = cov
-                else:
-                    logging.warning('Insufficient template data to generate covariance matrix for bnum=%d, partition=%d' % (bnum, i))
-                    templateCovs[bnum][i] = np.zeros((len(poiList[bnum]), len(poiList[bnum])))
+            for bnum in range(0, subkeys):
+                (data, offset[bnum]) = shift_block(waves[:, poiList[bnum] - prange[0]], offset[bnum])
+                for i in np.unique(pnum[:, bnum]):
+                    part = data[pnum[:, bnum] == i]
+                    count[bnum][i] += len(part)
+                    sums[bnum][i] += np.sum(part, axis=0)
+                    outer[bnum][i] += np.dot(part.T, part)
 
             if progressBar:
-                progressBar.updateStatus(tend + bnum)
+                progressBar.updateStatus(bend - tstart)
                 if progressBar.wasAborted():
                     return None
 
-        template = {
+        templateMeans = []
+        templateCovs = []
+        for bnum in range(0, subkeys):
+            n = count[bnum]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                mean = sums[bnum] / n[:, None]
+                cov = (outer[bnum] - n[:, None, None] * mean[:, :, None] * mean[:, None, :]) / (n - 1)[:, None, None]
+            for i in np.where(n == 0)[0]:
+                logging.warning('Insufficient template data to generate covariance matrix for bnum=%d, partition=%d' % (bnum, i))
+                cov[i] = 0
+            if __debug__: logging.debug('template traces for bnum %d = %s' % (bnum, n))
+            templateMeans.append(mean + offset[bnum])
+            templateCovs.append(cov)
+
+        template.update({
          "mean":templateMeans,
          "cov":templateCovs,
-         "trange":(tstart, tend),
-         "poi":poiList,
-         "partitiontype":partMethod.__class__.__name__
-        }
+         "count":count,
+         "sum":sums,
+         "outer":outer,
+         "offset":offset,
+         "trange":(min(template["trange"][0], tstart), max(template["trange"][1], tend)),
+        })
 
         if progressBar:
             progressBar.close()
@@ -106,6 +153,116 @@ class TemplateUsingMVS(object):
         return template
 
 
+class TemplateMatcher(object):
+    """
+    Scores attack traces against the templates of TemplateUsingMVS.
+
+    The Cholesky factor L of each partition's covariance (and its log-determinant) is computed
+    once per subkey and cached. Log-likelihoods of a whole block of traces against all
+    partitions then come from one batched product with the inverse factors (the triangular
+    solve L z = x - mean for every trace and partition), and are summed per key guess by
+    indexing with the partition each guess puts each trace in.
+
+    Args:
+        template (dict): Template from TemplateUsingMVS.generate(), or loaded from a project.
+        covariance (str): 'full' uses the covariance of each partition. 'diagonal' uses only
+            their variances. 'pooled' uses one covariance for all partitions (the average
+            weighted by the number of profiling traces), so only one factorization is needed.
+    """
+
+    #Leakage models giving the partition of each guess, by template partition type.
+    #Other partition types partition by the key value itself.
+    partitionModels = {
+        "PartitionHWIntermediate":SBox_output,
+        "PartitionHDLastRound":LastroundStateDiff,
+    }
+
+    def __init__(self, template, covariance='full'):
+        if covariance not in ('full', 'diagonal', 'pooled'):
+            raise ValueError("Covariance must be 'full', 'diagonal' or 'pooled', got %s" % covariance)
+        self.template = template
+        self.covariance = covariance
+        self.pois = [np.asarray(poi, dtype=int) for poi in template["poi"]]
+        self._factors = {}
+
+        ptype = str(template["partitiontype"])
+        self._model = AES128_8bit(self.partitionModels[ptype]) if ptype in self.partitionModels else None
+
+    def factors(self, bnum):
+        """Return (means, inverse Cholesky factors, log-determinants, valid) of the partitions of a subkey"""
+        if bnum in self._factors:
+            return self._factors[bnum]
+
+        means = np.asarray(self.template["mean"][bnum], dtype=np.float64)
+        covs = np.array(self.template["cov"][bnum], dtype=np.float64)
+        nparts, npoi = means.shape
+        valid = np.all(np.isfinite(means), axis=1) & np.all(np.isfinite(covs), axis=(1, 2))
+
+        if self.covariance == 'diagonal':
+            covs = covs * np.eye(npoi)
+        elif self.covariance == 'pooled':
+            if "count" in self.template:
+                weights = np.maximum(np.asarray(self.template["count"][bnum], dtype=np.float64) - 1, 0)
+            else:
+                weights = np.ones(nparts)
+            weights = np.where(valid, weights, 0)
+            pooled = np.tensordot(weights, np.where(valid[:, None, None], covs, 0), axes=1) / np.sum(weights)
+            covs = np.repeat(pooled[None], nparts, axis=0)
+
+        invchol = np.zeros_like(covs)
+        logdet = np.zeros(nparts)
+        #The pooled covariance is the same for all partitions, so only factor it once
+        factored = {}
+        for i in np.where(valid)[0]:
+            key = 0 if self.covariance == 'pooled' else i
+            if key not in factored:
+                try:
+                    chol = np.linalg.cholesky(covs[i])
+                    factored[key] = (scipy.linalg.solve_triangular(chol, np.eye(npoi), lower=True), 2 * np.sum(np.log(np.diag(chol))))
+                except np.linalg.LinAlgError:
+                    logging.warning('Covariance matrix of bnum=%d, partition=%d is not positive definite, partition skipped' % (bnum, i))
+                    factored[key] = None
+            if factored[key] is None:
+                valid[i] = False
+                continue
+            invchol[i], logdet[i] = factored[key]
+
+        if not np.all(valid):
+            logging.info('bnum=%d: %d of %d partitions have no usable template, they get the lowest log-likelihood of each trace' %
+                         (bnum, nparts - np.sum(valid), nparts))
+        self._factors[bnum] = (means, invchol, logdet, valid)
+        return self._factors[bnum]
+
+    def log_likelihoods(self, traces, bnum):
+        """Log-likelihood of each trace (full traces, or at least up to the last POI) for each partition
+
+        Returns:
+            (traces, partitions) array. Partitions without a usable template
+            get the lowest log-likelihood of the usable ones for that trace,
+            so they never rank a guess above one with a real template.
+        """
+        means, invchol, logdet, valid = self.factors(bnum)
+        data = np.asarray(traces, dtype=np.float64)[:, self.pois[bnum]]
+        z = np.einsum('pij,npj->npi', invchol, data[:, None, :] - means[None])
+        logpdf = -0.5 * (np.sum(np.square(z), axis=2) + logdet + data.shape[1] * np.log(2 * np.pi))
+        if not np.any(valid):
+            return np.zeros_like(logpdf)
+        logpdf[:, ~valid] = np.min(logpdf[:, valid], axis=1)[:, None]
+        return logpdf
+
+    def partitions(self, textins, textouts, bnum, numguesses=256):
+        """(traces, guesses) array of the partition each key guess puts each trace in"""
+        if self._model is not None:
+            return np.asarray(self._model.leakage_matrix(textins, textouts, bnum), dtype=int)
+        return np.tile(np.arange(numguesses), (max(len(textins), len(textouts)), 1))
+
+    def guess_scores(self, traces, textins, textouts, bnum, numguesses=256):
+        """Sum over a block of traces of the log-likelihood of each key guess"""
+        logpdf = self.log_likelihoods(traces, bnum)
+        parts = self.partitions(textins, textouts, bnum, numguesses)
+        return np.sum(logpdf[np.arange(len(logpdf))[:, None], parts], axis=0)
+
+
 class ProfilingTemplate(AlgorithmsBase):
     """
     Template Attack done as a loop, but using an algorithm which can progressively add traces & give output stats
@@ -115,6 +272,7 @@ class ProfilingTemplate(AlgorithmsBase):
     def __init__(self):
         AlgorithmsBase.__init__(self)
         self.profiling = None
+        self._covariance = 'diagonal'
 
         self.getParams().addChildren([
             {'name':'Load Template', 'type':'group', 'children':[]},
@@ -125,6 +283,7 @@ class ProfilingTemplate(AlgorithmsBase):
                 {'name':'Read POI', 'type':'action', 'action':self.updateScript},
                 {'name':'Generate Templates', 'type':'action', 'action':util.Command(self.runScriptFunction.emit, "generateTemplates")}
             ]},
+            {'name':'Covariance', 'key':'covariance', 'type':'list', 'values':{'Diagonal':'diagonal', 'Full':'full', 'Pooled':'pooled'}, 'get':self.get_covariance, 'set':self.set_covariance, 'action':self.updateScript},
         ])
         self.setProfileAlgorithm(TemplateUsingMVS)
         self.updateScript()
@@ -141,14 +300,32 @@ class ProfilingTemplate(AlgorithmsBase):
 
         self.updateScript()
 
+    def get_covariance(self):
+        return self._covariance
+
+    @setupSetParam("Covariance")
+    def set_covariance(self, covariance):
+        """Set the covariance used to match traces against the templates.
+
+        Args:
+            covariance (str): 'diagonal' (the default) uses the variance of
+                each POI only, 'full' the covariance matrix of each partition,
+                and 'pooled' one covariance matrix for all partitions. See
+                TemplateMatcher.
+        """
+        if covariance not in ('full', 'diagonal', 'pooled'):
+            raise ValueError("Covariance must be 'full', 'diagonal' or 'pooled', got %s" % covariance)
+        self._covariance = covariance
+
     def setProfileAlgorithm(self, algo):
         self.profiling = algo
         self.updateScript()
 
     def updateScript(self, _=None):
         try:
+            from chipwhisperer.analyzer.ui.CWAnalyzerGUI import CWAnalyzerGUI
             ted = CWAnalyzerGUI.getInstance().traceExplorerDialog.exampleScripts[0]
-        except AttributeError:
+        except (ImportError, AttributeError):
             logging.debug('Delaying script for template attack until TraceExplorer exists...')
             return
 
@@ -214,82 +391,36 @@ class ProfilingTemplate(AlgorithmsBase):
         return poiList
 
     def addTraces(self, traceSource, tracerange, progressBar=None, pointRange=None):
-        data = []
-        textins = []
-        textouts = []
-
-        for i in range(tracerange[0], tracerange[1]+1):
-            d = traceSource.getTrace(i)
-
-            if d is None:
-                continue
-
-            startingPoint, endingPoint = pointRange  # TODO:support start/end point different per byte
-            d = d[startingPoint:endingPoint]
-
-            data.append(d)
-            textins.append(traceSource.getTextin(i))
-            textouts.append(traceSource.getTextout(i))
-
-        try:
-            from scipy.stats import multivariate_normal
-        except ImportError:
-            raise Warning("Version of SciPy too old, require >= 0.14, have %s. "
-                          "Update to support this attack" % (scipy.version.version))
-
+        self._check_single_range(pointRange)
+        # TODO:support start/end point different per byte
         # Hack for now - just use last template found
         template = self.loadTemplatesFromProject()[-1]
-        pois = template["poi"]
-        numparts = len(template['mean'][0])
+        matcher = TemplateMatcher(template, self._covariance)
         results = np.zeros((self.model.getNumSubKeys(), self.model.getPermPerSubkey()))
+        numtraces = tracerange[1] - tracerange[0] + 1
 
         if progressBar:
             progressBar.setStatusMask("Current Trace = %d Current Subkey = %d", (0, 0))
-            progressBar.setMaximum(self.model.getNumSubKeys() * len(data))
+            progressBar.setMaximum(self.model.getNumSubKeys() * numtraces)
         pcnt = 0
 
-        for tnum in range(0, len(data)):
+        for tstart in range(0, numtraces, self._reportingInterval):
+            tend = min(tstart + self._reportingInterval, numtraces)
+            block = traceSource.get_traces(tracerange[0] + tstart, tracerange[0] + tend, pointRange)
+            data = np.asarray(block.wave)
+            textins = np.array(block.textin)
+            textouts = np.array(block.textout)
+
             for bnum in self.brange:
-                try:
-                    newresultsint = [multivariate_normal.logpdf(data[tnum][pois[bnum]], mean=template['mean'][bnum][i], cov=np.diag(template['cov'][bnum][i])) for i in range(0, numparts)]
-                except np.linalg.LinAlgError as e:
-                    logging.warning('Error in applying template, probably template is poorly formed or POI incorrect. Byte %d for tnum %d skipped.' % (bnum, tnum))
-                    logging.debug(e)
-                    newresultsint = [0] * self.model.getPermPerSubkey()
-
-                ptype = template["partitiontype"]
-
-                newresults = []
-                # Map to key guess format
-                for i in range(0, self.model.getPermPerSubkey()):
-                    if ptype == "PartitionHWIntermediate":
-                        self.model.setHwModel(self.model.hwModels['HW: AES SBox Output, First Round (Enc)'])
-                        hypint = self.model.leakage(textins[tnum], textouts[tnum], i, bnum, None)
-                    elif ptype == "PartitionHDLastRound":
-                        self.model.setHwModel(self.model.hwModels['HD: AES Last-Round State'])
-                        hypint = self.model.leakage(textins[tnum], textouts[tnum], i, bnum, None)
-                    # TODO Temp
-                    elif ptype == "PartitionHDRounds":
-                        if bnum == 0:
-                            hypint = self.model.getHW(textins[tnum][bnum] ^ i)
-                        else:
-                            knownkey = [0x2b, 0x7e, 0x15, 0x16, 0x28, 0xae, 0xd2, 0xa6, 0xab, 0xf7, 0x15, 0x88, 0x09, 0xcf, 0x4f, 0x3c]
-                            s1 = textins[tnum][bnum - 1] ^ knownkey[bnum - 1]
-                            s2 = textins[tnum][bnum] ^ i
-                            hypint = self.model.getHW(s1 ^ s2)
-                    else:
-                        hypint = i
-                    newresults.append(newresultsint[hypint])
-
-                results[bnum] += newresults
-                self.stats.updateSubkey(bnum, results[bnum], tnum=(tnum + 1))
-
-                pcnt += 1
+                results[bnum] += matcher.guess_scores(data, textins, textouts, bnum, self.model.getPermPerSubkey())
+                self.stats.update_subkey(bnum, results[bnum], tnum=tend)
+
+                pcnt += tend - tstart
                 if progressBar:
-                    progressBar.updateStatus(pcnt, (tnum, bnum))
+                    progressBar.updateStatus(pcnt, (tend - 1, bnum))
                     if progressBar.wasAborted():
                         return
 
             # Do plotting if required
-            if (tnum % self._reportingInterval) == 0 and self.sr:
+            if self.sr:
                 self.sr()
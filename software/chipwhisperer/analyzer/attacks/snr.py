@@ -25,15 +25,189 @@
 #    along with chipwhisperer.  If not, see <http://www.gnu.org/licenses/>.
 #=================================================
 
+import itertools
+
 import numpy as np
-from chipwhisperer.common.api.ProjectFormat import Project
+from chipwhisperer.common.api.ProjectFormat import Project, Traces
 from chipwhisperer.common.traces import Trace
+from chipwhisperer.analyzer.attacks.algorithmsbase import shift_block
+from chipwhisperer.analyzer.utils.Partition import partition_table
+
+
+class SNR(object):
+    """Streaming signal-to-noise ratio of leakage models, for all subkeys at once.
+
+    For every leakage model and subkey, traces are put in classes by their leakage
+    value (calculated with the known key) and only the count, sum and sum of squares
+    of each class are kept. Traces are read in blocks, in one pass for all models and
+    subkeys, and more traces can be added at any time, e.g. with update() after
+    appending traces to a project.
+
+    The SNR is Var(E[trace | leakage]) / E[Var(trace | leakage)]: the variance of the
+    class means, weighted by the number of traces in each class, over the noise
+    variance pooled from all classes.
+
+    Partition methods (e.g. PartitionHWIntermediate() from
+    chipwhisperer.analyzer.utils.Partition) can be used in place of leakage models,
+    in which case the classes are the partitions. For project traces, partition tables
+    stored with the traces are reused (see partition_table()).
+
+    Args:
+        leak_models: A leakage model, or a list of them, selected from
+            :data:`leakage_models <chipwhisperer.analyzer.leakage_models>`.
+        bnums (list, optional): Subkeys to calculate the SNR of. Defaults to all
+            subkeys of the (first) model, or 16 for a partition method.
+    """
+    block_size = 1000
+
+    def __init__(self, leak_models, bnums=None):
+        if not isinstance(leak_models, (list, tuple)):
+            leak_models = [leak_models]
+        self.leak_models = list(leak_models)
+        if bnums is None:
+            if hasattr(self.leak_models[0], 'getNumSubKeys'):
+                bnums = range(self.leak_models[0].getNumSubKeys())
+            else:
+                bnums = range(16)
+        self.bnums = list(bnums)
+        self.num_traces = 0
+        self._offset = None
+        self._count = [None] * len(self.leak_models)
+        self._sum = [None] * len(self.leak_models)
+        self._sumsq = [None] * len(self.leak_models)
+
+    def add_traces(self, input):
+        """Add traces to the statistics.
+
+        Args:
+            input: Project traces (project.traces), or an iterable of
+                :class:`Traces <chipwhisperer.common.traces.Trace>`.
+        """
+        if isinstance(input, Project):
+            raise TypeError("Pass the traces of the project (project.traces), not the project")
+
+        if isinstance(input, Traces):
+            self._add_project_traces(input, 0)
+            return
+
+        input = iter(input)
+        while True:
+            traces = list(itertools.islice(input, self.block_size))
+            if len(traces) == 0:
+                break
+            self._add_block([trace.wave for trace in traces], [trace.textin for trace in traces],
+                            [trace.textout for trace in traces], [trace.key for trace in traces])
+
+    def update(self, traces):
+        """Add the traces of traces (e.g. project.traces) past the ones already added"""
+        if isinstance(traces, Traces):
+            self._add_project_traces(traces, self.num_traces)
+        else:
+            self.add_traces(traces[self.num_traces:])
+
+    def _add_project_traces(self, traces, start):
+        """Add project traces from start on, reading them in blocks"""
+        for bstart in range(start, len(traces), self.block_size):
+            bend = min(bstart + self.block_size, len(traces))
+            block = traces.tm.get_traces(bstart, bend)
+            self._add_block(block.wave, block.textin, block.textout, block.key, (traces.tm, bstart, bend))
+
+    def _leakages(self, model, textins, textouts, keys, guesses, bnum):
+        """Leakage value of each trace for the known key, guesses being the known subkey of each trace"""
+        rows = np.arange(len(guesses))
+        if hasattr(model, 'intermediate_matrix'):
+            #Take the known-key column of the (masked) intermediate values, then only look up its hamming weights
+            ivs = model.intermediate_matrix(textins, textouts, bnum, keys)[rows, guesses]
+            return np.asarray(model.HW, dtype=int)[ivs]
+        leakage = np.asarray(model.leakage_matrix(textins, textouts, bnum, keys))
+        return leakage[rows, guesses].astype(int)
+
+    def _partitions(self, method, textins, textouts, keys, source):
+        """(traces, subkeys) partitions of a block, from the stored tables for project traces"""
+        if source is not None:
+            return partition_table(source[0], method, source[1], source[2])
+        return np.asarray(method.get_partition_nums(textins, textouts, keys))
+
+    def _add_block(self, waves, textins, textouts, keys, source=None):
+        waves, self._offset = shift_block(waves, self._offset)
+        wavesq = np.square(waves)
+
+        #Known keys are the same for most traces, so only process each one once
+        ukeys, keyidx = np.unique(np.array(keys, dtype=int), axis=0, return_inverse=True)
+        keyidx = keyidx.ravel()
+        keys = ukeys[keyidx]
+        textins = np.array(textins)
+        textouts = np.array(textouts)
+
+        for m, model in enumerate(self.leak_models):
+            partitions = None
+            if hasattr(model, 'getNumPartitions'):
+                partitions = self._partitions(model, textins, textouts, keys, source).astype(int)
+            else:
+                #Known subkeys of each trace (e.g. last round keys), one key schedule per unique key
+                known = np.array([model.process_known_key(list(key)) for key in ukeys], dtype=int)[keyidx]
+            for i, bnum in enumerate(self.bnums):
+                if partitions is not None:
+                    leakage = partitions[:, bnum]
+                else:
+                    leakage = self._leakages(model, textins, textouts, keys, known[:, bnum], bnum)
+                numclasses = leakage.max() + 1
+                self._grow(m, numclasses, waves.shape[1])
+                onehot = np.zeros((len(waves), numclasses))
+                onehot[np.arange(len(waves)), leakage] = 1
+                self._count[m][i, :numclasses] += np.sum(onehot, axis=0)
+                self._sum[m][i, :numclasses] += np.dot(onehot.T, waves)
+                self._sumsq[m][i, :numclasses] += np.dot(onehot.T, wavesq)
+
+        self.num_traces += len(waves)
+
+    def _grow(self, m, numclasses, numpoints):
+        """Make sure the accumulators of model m have at least numclasses classes"""
+        if self._count[m] is None:
+            self._count[m] = np.zeros((len(self.bnums), numclasses))
+            self._sum[m] = np.zeros((len(self.bnums), numclasses, numpoints))
+            self._sumsq[m] = np.zeros((len(self.bnums), numclasses, numpoints))
+        elif self._count[m].shape[1] < numclasses:
+            extra = numclasses - self._count[m].shape[1]
+            self._count[m] = np.pad(self._count[m], ((0, 0), (0, extra)), 'constant')
+            self._sum[m] = np.pad(self._sum[m], ((0, 0), (0, extra), (0, 0)), 'constant')
+            self._sumsq[m] = np.pad(self._sumsq[m], ((0, 0), (0, extra), (0, 0)), 'constant')
+
+    def snr(self, bnum=None, model=0):
+        """Return the SNR of each point.
+
+        Args:
+            bnum (int, optional): Subkey to return the SNR of. If None, the SNR
+                of all subkeys in bnums is returned.
+            model (int): Index of the leakage model.
+
+        Returns:
+            (points,) array for one subkey, or (subkeys, points) array.
+        """
+        if self._count[model] is None:
+            raise ValueError("No traces added")
+        count = self._count[model][:, :, None]
+        sums = self._sum[model]
+        total = np.sum(count, axis=1)
+        mean = np.sum(sums, axis=1) / total
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            classmean = np.where(count > 0, sums / count, 0)
+            signal = np.sum(count * np.square(classmean - mean[:, None]), axis=1) / total
+            numclasses = np.sum(count > 0, axis=1)
+            noise = np.sum(self._sumsq[model] - count * np.square(classmean), axis=1) / (total - numclasses)
+            snr = signal / noise
+
+        if bnum is None:
+            return snr
+        return snr[self.bnums.index(bnum)]
 
 
 def calculate_snr(input, leak_model, bnum=0, db=True):
     """Calculate the SNR based on the leakage model.
 
-    Uses same leakage model as the CPA attack.
+    Uses same leakage model as the CPA attack. To calculate the SNR of several
+    subkeys or models at once, or to add traces later, use :class:`SNR`.
 
     Args:
         input (Iterable of :class:`Traces <chipwhisperer.common.traces.Trace>`): An iterable of traces.
@@ -42,58 +216,9 @@ def calculate_snr(input, leak_model, bnum=0, db=True):
         bnum (int): Byte number used for leakage model.
         bd (bool): Return signal-to-noise ratio in decibals.
     """
-
-    textin = None
-    textout = None
-    key = None
-    trace = None
-
-    hwarray = []
-
-    tm = None
-
-    ntrace = len(input)
-    npoints = len(input[0].wave)
-
-    for tnum in range(0, ntrace):
-        trace = input[tnum].wave
-        textin = input[tnum].textin
-        textout = input[tnum].textout
-        key = input[tnum].key
-
-        state = {'knownkey':key}
-
-        leakage = leak_model.leakage(textin, textout, None, bnum, state)
-
-        while leakage >= len(hwarray):
-            hwarray.append([])
-
-        hwarray[leakage].append(trace)
-
-    hwmean = np.zeros((len(hwarray), npoints))
-
-    for i in range(0, len(hwarray)):
-        hwmean[i] = np.mean(hwarray[i], axis=0)
-
-    inc_list = []
-    best_choice = -1
-    best_choice_len = 0
-    for i in range(0, len(hwarray)):
-        num_elements = len(hwarray[i])
-        if num_elements > 0:
-            inc_list.append(i)
-            #Figure out if this is largest list as well
-            if num_elements > best_choice_len:
-                best_choice = i
-                best_choice_len = num_elements
-
-
-    hwmean_valid = hwmean[inc_list]
-
-    signal_var = np.var(hwmean_valid, axis=0)
-    noise_var_onehw = np.var(hwarray[best_choice], axis=0)
-
-    snr = signal_var / noise_var_onehw
+    stats = SNR(leak_model, [bnum])
+    stats.add_traces(input)
+    snr = stats.snr(bnum)
 
     if db:
         return 20*np.log(snr)
@@ -0,0 +1,270 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2020, NewAE Technology Inc
+# All rights reserved.
+#
+# Find this and more at newae.com - this file is part of the chipwhisperer
+# project, http://www.github.com/newaetech/chipwhisperer
+#
+#    This file is part of chipwhisperer.
+#
+#    chipwhisperer is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    chipwhisperer is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with chipwhisperer.  If not, see <http://www.gnu.org/licenses/>.
+#=================================================
+import multiprocessing
+import os
+
+import numpy as np
+from scipy.special import comb
+from chipwhisperer.common.api.ProjectFormat import Project, Traces
+from chipwhisperer.analyzer.utils.Partition import PartitionRandvsFixed, partition_table
+
+
+#Fixed plaintexts of the TVLA fixed vs random test, by key length (see AcqKeyTextPattern_TVLATTest)
+TVLA_FIXED_TEXT = PartitionRandvsFixed.fixedText
+
+
+class CentralMoments(object):
+    """Streaming central moments of each point of a set of traces.
+
+    Keeps the number of traces, the mean, and the central sums M_p = sum((x - mean)^p)
+    for p = 2..order. Blocks of traces are reduced on their own and merged in with the
+    pairwise update of Pebay (Sandia report SAND2008-6212), which is exact and
+    numerically stable, so partial results from separate blocks or processes can be
+    merged in any order.
+
+    Args:
+        order (int): Highest central moment kept.
+    """
+    def __init__(self, order=6):
+        self.order = order
+        self.n = 0
+        self.mean = 0
+        self.m = [0] * (order + 1)
+
+    @classmethod
+    def from_samples(cls, samples, order=6):
+        """Moments of a (traces x points) block"""
+        moments = cls(order)
+        samples = np.asarray(samples, dtype=np.float64)
+        moments.n = len(samples)
+        if moments.n == 0:
+            return moments
+        moments.mean = np.mean(samples, axis=0)
+        d = samples - moments.mean
+        dp = d
+        for p in range(2, order + 1):
+            dp = dp * d
+            moments.m[p] = np.sum(dp, axis=0)
+        return moments
+
+    def merge(self, other):
+        """Add the traces of other to these moments"""
+        if other.order != self.order:
+            raise ValueError("Can't merge moments of order %d into order %d" % (other.order, self.order))
+        if other.n == 0:
+            return self
+        if self.n == 0:
+            self.n, self.mean, self.m = other.n, other.mean, list(other.m)
+            return self
+
+        na, nb = float(self.n), float(other.n)
+        n = na + nb
+        delta = other.mean - self.mean
+        m = list(self.m)
+        #Higher moments use the old lower ones, so go from the top down
+        for p in range(self.order, 1, -1):
+            total = self.m[p] + other.m[p]
+            for k in range(1, p - 1):
+                total = total + comb(p, k, exact=True) * delta**k * ((-nb / n)**k * self.m[p - k] + (na / n)**k * other.m[p - k])
+            total = total + (na * nb / n * delta)**p * (1 / nb**(p - 1) - (-1 / na)**(p - 1))
+            m[p] = total
+        self.m = m
+        self.mean = self.mean + delta * (nb / n)
+        self.n = self.n + other.n
+        return self
+
+    def central(self, p):
+        """p-th central moment, M_p / n"""
+        return self.m[p] / float(self.n)
+
+
+class TTest(object):
+    """Streaming TVLA fixed vs random Welch t-test, up to third order.
+
+    Traces are put in the fixed group if their text in is the fixed TVLA plaintext
+    for their key length (as captured by AcqKeyTextPattern_TVLATTest), otherwise in the
+    random group. Each group only keeps CentralMoments up to order 2*order, so any
+    number of traces can be tested in one pass, blocks can be processed in parallel,
+    and partial tests can be merged or saved to a project and continued later.
+
+    The t statistic of order d compares the means of (x - mean)^d, standardized for
+    d = 3, as in Schneider & Moradi, "Leakage Assessment Methodology", CHES 2015.
+
+    Args:
+        order (int): Highest order of t statistic (1 to 3).
+        fixed_text (bytearray, optional): Fixed text in. Defaults to the TVLA
+            plaintext for the key length of the traces.
+    """
+    block_size = 10000
+
+    def __init__(self, order=3, fixed_text=None):
+        if order not in (1, 2, 3):
+            raise ValueError("Order must be 1, 2 or 3, got %d" % order)
+        self.order = order
+        self.fixed_text = fixed_text
+        self.num_traces = 0
+        self.random = CentralMoments(2 * order)
+        self.fixed = CentralMoments(2 * order)
+
+    def _is_fixed(self, textins, keys):
+        if self.fixed_text is None:
+            return PartitionRandvsFixed().get_partition_nums(textins, None, keys)[:, 0] == 1
+        textins = np.array([np.frombuffer(bytes(bytearray(t)), dtype=np.uint8) for t in textins])
+        return np.all(textins == np.frombuffer(bytes(bytearray(self.fixed_text)), dtype=np.uint8), axis=1)
+
+    def _block_moments(self, waves, textins, keys, fixed=None):
+        """(random, fixed) moments of a block, fixed being which traces are in the fixed group if known"""
+        waves = np.asarray(waves, dtype=np.float64)
+        if fixed is None:
+            fixed = self._is_fixed(textins, keys)
+        return (CentralMoments.from_samples(waves[~fixed], 2 * self.order),
+                CentralMoments.from_samples(waves[fixed], 2 * self.order))
+
+    def add_block(self, waves, textins, keys):
+        """Add a (traces x points) block of waves with their text ins and keys"""
+        self._merge_moments(self._block_moments(waves, textins, keys))
+
+    def _merge_moments(self, moments):
+        self.random.merge(moments[0])
+        self.fixed.merge(moments[1])
+        self.num_traces += moments[0].n + moments[1].n
+
+    def merge(self, other):
+        """Add the traces of another TTest (e.g. run on other traces) to this one"""
+        self._merge_moments((other.random, other.fixed))
+        return self
+
+    def add_traces(self, input, processes=1):
+        """Add traces to the test.
+
+        Args:
+            input: Project traces (project.traces), or an iterable of
+                :class:`Traces <chipwhisperer.common.traces.Trace>`.
+            processes (int): Number of processes reducing project trace
+                blocks in parallel.
+        """
+        if isinstance(input, Project):
+            raise TypeError("Pass the traces of the project (project.traces), not the project")
+        if isinstance(input, Traces):
+            self._add_project_traces(input, 0, processes)
+            return
+
+        traces = list(input)
+        for start in range(0, len(traces), self.block_size):
+            block = traces[start:start + self.block_size]
+            self.add_block([t.wave for t in block], [t.textin for t in block], [t.key for t in block])
+
+    def update(self, traces, processes=1):
+        """Add the traces of project traces past the ones already added"""
+        self._add_project_traces(traces, self.num_traces, processes)
+
+    def _add_project_traces(self, traces, start, processes):
+        ranges = [(s, min(s + self.block_size, len(traces))) for s in range(start, len(traces), self.block_size)]
+        if len(ranges) == 0:
+            return
+
+        #The groups of project traces come from their partition tables (reusing stored ones)
+        fixed = None
+        if self.fixed_text is None:
+            fixed = partition_table(traces.tm, PartitionRandvsFixed(), start, len(traces))[:, 0] == 1
+
+        if processes > 1 and len(ranges) > 1 and 'fork' in multiprocessing.get_all_start_methods():
+            #Workers inherit the trace source through fork and only send back the moments
+            global _worker_test
+            _worker_test = (self, traces.tm, fixed, start)
+            try:
+                with multiprocessing.get_context('fork').Pool(processes) as pool:
+                    for moments in pool.imap(_reduce_block, ranges):
+                        self._merge_moments(moments)
+            finally:
+                _worker_test = None
+        else:
+            for r in ranges:
+                block = traces.tm.get_traces(r[0], r[1])
+                self._merge_moments(self._block_moments(block.wave, block.textin, block.key,
+                                                        None if fixed is None else fixed[r[0] - start:r[1] - start]))
+
+    def t_statistic(self, order=1):
+        """Welch t statistic of each point for the given order (up to the test's order)"""
+        if not 1 <= order <= self.order:
+            raise ValueError("Order must be between 1 and %d, got %d" % (self.order, order))
+        stats = []
+        for g in (self.fixed, self.random):
+            if g.n < 2:
+                raise ValueError("Both groups need at least two traces")
+            if order == 1:
+                mean, var = g.mean, g.central(2)
+            elif order == 2:
+                mean, var = g.central(2), g.central(4) - np.square(g.central(2))
+            else:
+                mean = g.central(3) / g.central(2)**1.5
+                var = (g.central(6) - np.square(g.central(3))) / g.central(2)**3
+            stats.append((mean, var, g.n))
+        (m0, v0, n0), (m1, v1, n1) = stats
+        with np.errstate(divide='ignore', invalid='ignore'):
+            return (m0 - m1) / np.sqrt(v0 / n0 + v1 / n1)
+
+    def save(self, project, filename='tvla_ttest.npz'):
+        """Save the state of the test to the analysis data of a project"""
+        project.createDataDirectory()
+        fname = project.getDataFilepath(filename, 'analysis')["abs"]
+        data = {'order':self.order, 'num_traces':self.num_traces,
+                'fixed_text':np.array([] if self.fixed_text is None else bytearray(self.fixed_text), dtype=np.uint8)}
+        for name, g in (('random', self.random), ('fixed', self.fixed)):
+            data[name + '_n'] = g.n
+            data[name + '_mean'] = g.mean
+            for p in range(2, g.order + 1):
+                data['%s_m%d' % (name, p)] = g.m[p]
+        np.savez(fname, **data)
+        return fname
+
+    @classmethod
+    def load(cls, project, filename='tvla_ttest.npz'):
+        """Load a test saved with save(), or return None if the project has none"""
+        fname = project.getDataFilepath(filename, 'analysis')["abs"]
+        if not os.path.isfile(fname):
+            return None
+        data = np.load(fname)
+        fixed_text = bytearray(data['fixed_text']) if len(data['fixed_text']) else None
+        test = cls(int(data['order']), fixed_text)
+        test.num_traces = int(data['num_traces'])
+        for name, g in (('random', test.random), ('fixed', test.fixed)):
+            g.n = int(data[name + '_n'])
+            g.mean = data[name + '_mean']
+            for p in range(2, g.order + 1):
+                g.m[p] = data['%s_m%d' % (name, p)]
+        return test
+
+
+_worker_test = None
+
+
+def _reduce_block(trange):
+    """Pool worker: moments of one block of project traces"""
+    test, tm, fixed, start = _worker_test
+    block = tm.get_traces(trange[0], trange[1])
+    if fixed is not None:
+        fixed = fixed[trange[0] - start:trange[1] - start]
+    return test._block_moments(block.wave, block.textin, block.key, fixed)
@@ -104,6 +104,19 @@ class PreprocessingBase(TraceSource, PassiveTraceObserver):
             return self._traceSource.get_trace(n)
 
     getTrace = camel_case_deprecated(get_trace)
+
+    def get_traces(self, start, stop, point_range=None):
+        """Get traces start to stop-1 as a single block.
+
+        If the module is disabled the block comes straight from the previous source.
+        Otherwise the traces are processed one at a time; modules which can process a
+        whole block at once should override this.
+        """
+        if self.enabled:
+            return TraceSource.get_traces(self, start, stop, point_range)
+        else:
+            return self._traceSource.get_traces(start, stop, point_range)
+
     def get_textin(self, n):
         """Get text-in number n"""
         return self._traceSource.get_textin(n)
@@ -40,3 +40,6 @@ class PassThrough(PreprocessingBase):
 
     def getTrace(self, n):
         return self._traceSource.getTrace(n)
+
+    def get_traces(self, start, stop, point_range=None):
+        return self._traceSource.get_traces(start, stop, point_range)
@@ -25,17 +25,31 @@
 #    along with chipwhisperer.  If not, see <http://www.gnu.org/licenses/>.
 #=================================================
 
-import copy
+import hashlib
 import logging
+import os
 import random
 
 import numpy as np
 from chipwhisperer.analyzer.attacks.models.aes.funcs import sbox, inv_sbox
-from chipwhisperer.analyzer.attacks.models.AES128_8bit import AES128_8bit
-from chipwhisperer.analyzer.attacks.models.aes.key_schedule import keyScheduleRounds
+from chipwhisperer.analyzer.attacks.models.AES128_8bit import AESLeakageHelper
+from chipwhisperer.analyzer.attacks.models.aes.key_schedule import key_schedule_rounds
+from chipwhisperer.analyzer.attacks.models.base import getHW
 from chipwhisperer.common.utils.parameter import Parameterized
 from chipwhisperer.common.utils import util
 
+_SBOX = np.array([sbox(i) for i in range(256)], dtype=np.uint8)
+_INV_SBOX = np.array([inv_sbox(i) for i in range(256)], dtype=np.uint8)
+_HW = np.array([getHW(i) for i in range(256)], dtype=np.uint8)
+
+
+def _byte_rows(data):
+    """Convert a list of texts/keys to an (N, length) uint8 array"""
+    arr = np.asarray(data)
+    if arr.ndim != 2 or arr.dtype.kind not in 'iub':
+        arr = np.array([np.frombuffer(bytes(bytearray(d)), dtype=np.uint8) for d in data])
+    return arr.astype(np.uint8, copy=False)
+
 
 class PartitionHDLastRound(object):
 
@@ -45,24 +59,24 @@ class PartitionHDLastRound(object):
     def getNumPartitions(self):
         return 9
 
-    def getPartitionNum(self, trace, tnum):
-        key = trace.getKnownKey(tnum)
-        ct = trace.getTextout(tnum)
+    def get_partition_nums(self, textins, textouts, keys):
+        """(traces, 16) partition of each byte of a block of traces"""
+        ct = _byte_rows(textouts)
+        keys = _byte_rows(keys)
 
         #Convert from initial key to final-round key, currently
         #this assumes AES
-        if len(key) == 16:
-            rounds = 10
-        else:
+        if keys.shape[1] != 16:
             raise ValueError("Need to implement for selected AES")
-        key = keyScheduleRounds(key, 0, rounds)
+        ukeys, idx = np.unique(keys, axis=0, return_inverse=True)
+        rkeys = np.array([key_schedule_rounds(list(k), 0, 10) for k in ukeys], dtype=np.uint8)[idx.ravel()]
+
+        st10 = ct[:, AESLeakageHelper.INVSHIFT_undo]
+        st9 = _INV_SBOX[ct ^ rkeys]
+        return _HW[st9 ^ st10]
 
-        guess = [0] * 16
-        for i in range(0, 16):
-            st10 = ct[AES128_8bit.INVSHIFT[i]]
-            st9 = inv_sbox(ct[i] ^ key[i])
-            guess[i] = AES128_8bit.getHW(st9 ^ st10)
-        return guess
+    def getPartitionNum(self, trace, tnum):
+        return list(self.get_partition_nums([trace.get_textin(tnum)], [trace.get_textout(tnum)], [trace.get_known_key(tnum)])[0])
 
 
 class PartitionHWIntermediate(object):
@@ -73,15 +87,12 @@ class PartitionHWIntermediate(object):
     def getNumPartitions(self):
         return 9
 
-    def getPartitionNum(self, trace, tnum):
-        key = trace.getKnownKey(tnum)
-        text = trace.getTextin(tnum)
-
-        guess = [0] * 16
-        for i in range(0, 16):
-            guess[i] = AES128_8bit.getHW(sbox(text[i] ^ key[i]))
+    def get_partition_nums(self, textins, textouts, keys):
+        """(traces, 16) partition of each byte of a block of traces"""
+        return _HW[_SBOX[_byte_rows(textins) ^ _byte_rows(keys)]]
 
-        return guess
+    def getPartitionNum(self, trace, tnum):
+        return list(self.get_partition_nums([trace.get_textin(tnum)], [trace.get_textout(tnum)], [trace.get_known_key(tnum)])[0])
 
 
 class PartitionEncKey(object):
@@ -92,8 +103,12 @@ class PartitionEncKey(object):
     def getNumPartitions(self):
         return 256
 
+    def get_partition_nums(self, textins, textouts, keys):
+        """(traces, key length) partition of each byte of a block of traces"""
+        return _byte_rows(keys)
+
     def getPartitionNum(self, trace, tnum):
-        key = trace.getKnownKey(tnum)
+        key = trace.get_known_key(tnum)
         return key
 
 
@@ -109,24 +124,33 @@ class PartitionRandvsFixed(object):
     sectionName = "Partition Based on Rand vs Fixed "
     partitionType = "Rand vs Fixed"
 
+    #Fixed plaintext by key length
+    fixedText = {
+        16: util.hexStrToByteArray("da 39 a3 ee 5e 6b 4b 0d 32 55 bf ef 95 60 18 90"),
+        24: util.hexStrToByteArray("da 39 a3 ee 5e 6b 4b 0d 32 55 bf ef 95 60 18 88"),
+        32: util.hexStrToByteArray("da 39 a3 ee 5e 6b 4b 0d 32 55 bf ef 95 60 18 95"),
+    }
+
     def getNumPartitions(self):
         return 2
 
+    def get_partition_nums(self, textins, textouts, keys):
+        """(traces, 1) partition of a block of traces, 1 if fixed and 0 if random"""
+        textins = _byte_rows(textins)
+        klens = np.array([len(k) for k in keys])
+        parts = np.zeros((len(textins), 1), dtype=np.uint8)
+        for klen, fixed in self.fixedText.items():
+            sel = klens == klen
+            if np.any(sel) and textins.shape[1] == len(fixed):
+                parts[sel, 0] = np.all(textins[sel] == np.frombuffer(bytes(fixed), dtype=np.uint8), axis=1)
+        return parts
+
     def getPartitionNum(self, trace, tnum):
         """Checks if plaintext is the fixed TVLA plaintext for this key length or a random value.
 
         Returns [1] if fixed and [0] if random.
         """
-        klen = len(trace.getKnownKey(tnum))
-
-        pt = trace.getTextin(tnum)
-        if klen == 16 and (pt == util.hexStrToByteArray("da 39 a3 ee 5e 6b 4b 0d 32 55 bf ef 95 60 18 90")).all():
-            return [1]
-        elif klen == 24 and (pt == util.hexStrToByteArray("da 39 a3 ee 5e 6b 4b 0d 32 55 bf ef 95 60 18 88")).all():
-            return [1]
-        elif klen == 32 and (pt == util.hexStrToByteArray("da 39 a3 ee 5e 6b 4b 0d 32 55 bf ef 95 60 18 95")).all():
-            return [1]
-        return [0]
+        return list(self.get_partition_nums([trace.get_textin(tnum)], [trace.get_textout(tnum)], [trace.get_known_key(tnum)])[0])
 
 
 class PartitionRandDebug(object):
@@ -139,10 +163,116 @@ class PartitionRandDebug(object):
     def getNumPartitions(self):
         return self.numRand
 
+    def get_partition_nums(self, textins, textouts, keys):
+        """(traces, 1) random partitions"""
+        return np.array([[random.randint(0, self.numRand - 1)] for _ in range(len(textins))])
+
     def getPartitionNum(self, trace, tnum):
         return [random.randint(0, self.numRand - 1)]
 
 
+def _table_filename(segment, partMethod):
+    """File the partition table of a trace segment is kept in, next to its traces (None if not saved)"""
+    try:
+        cfgfile = segment.config.configFilename()
+        prefix = segment.config.attr("prefix")
+    except AttributeError:
+        return None
+    if not cfgfile:
+        return None
+    return os.path.join(os.path.dirname(cfgfile), "%spartition_%s.npz" % (prefix, partMethod.__class__.__name__))
+
+
+def _segment_texts(segment, start, stop):
+    """Textins, textouts and keys of traces start to stop-1 of a trace segment"""
+    return segment.textins[start:stop], segment.textouts[start:stop], segment._block_keys(start, stop)
+
+
+def _texts_checksum(textins, textouts, keys):
+    """Checksum of the textin, textout and key rows a partition table was worked out from"""
+    digest = hashlib.sha1()
+    for rows in (textins, textouts, keys):
+        try:
+            data = np.asarray(rows, dtype=np.uint8).tobytes()
+        except (TypeError, ValueError):
+            data = repr([list(row) if row is not None else None for row in rows]).encode()
+        digest.update(data)
+    return digest.hexdigest()
+
+
+def _segment_table(segment, partMethod, load, save):
+    """Partition table of all traces in a segment, reusing (and extending) the stored one.
+
+    A stored table is only used if the checksum of the texts and keys it was worked out
+    from still matches those of the segment, otherwise it is worked out again.
+    """
+    fname = _table_filename(segment, partMethod)
+    ntraces = segment.numTraces()
+    table = None
+    if load and fname is not None and os.path.isfile(fname):
+        with np.load(fname) as stored:
+            count = int(stored["count"])
+            if count <= ntraces and str(stored["checksum"]) == _texts_checksum(*_segment_texts(segment, 0, count)):
+                table = stored["table"][:count]
+            else:
+                logging.warning('Partition table %s does not match the traces of its segment, working it out again' % fname)
+        if table is not None and len(table) == ntraces:
+            return table
+
+    #Only work out the traces added since the table was stored
+    done = 0 if table is None else len(table)
+    new = np.asarray(partMethod.get_partition_nums(*_segment_texts(segment, done, ntraces)))
+    table = new if table is None else np.concatenate([table, new.astype(table.dtype)])
+
+    if save and fname is not None:
+        if not os.path.isdir(os.path.dirname(fname)):
+            os.makedirs(os.path.dirname(fname))
+        np.savez(fname, table=table, count=np.array(ntraces), checksum=np.array(_texts_checksum(*_segment_texts(segment, 0, ntraces))))
+    return table
+
+
+def partition_table(traceSource, partMethod, start=0, end=None, load=True, save=False):
+    """Partition of every subkey for traces start to end-1 of a trace source.
+
+    Partition methods with get_partition_nums() work out whole blocks of traces at
+    once. For a project's trace manager, tables stored next to the traces of each
+    segment (see Partition.generatePartitions()) are reused, only working out the
+    traces appended since. Stored tables are checked against the textins, textouts
+    and keys of their segment, and ignored if those changed.
+
+    Args:
+        traceSource: TraceManager (project.trace_manager()) or other trace source.
+        partMethod: Partition method object, e.g. PartitionHWIntermediate().
+        start (int): First trace.
+        end (int, optional): One past the last trace. Defaults to all traces.
+        load (bool): Use stored tables.
+        save (bool): Store the tables of the segments that were worked out in
+            the project.
+
+    Returns:
+        (traces, subkeys) integer array
+    """
+    if end is None:
+        end = traceSource.num_traces()
+
+    if not hasattr(partMethod, 'get_partition_nums'):
+        return np.array([partMethod.getPartitionNum(traceSource, tnum) for tnum in range(start, end)])
+
+    if not hasattr(traceSource, 'get_segment'):
+        block = traceSource.get_traces(start, end)
+        return np.asarray(partMethod.get_partition_nums(block.textin, block.textout, block.key))
+
+    tables = []
+    tnum = start
+    while tnum < end:
+        segment = traceSource.get_segment(tnum)
+        segstart, segend = segment.mappedRange
+        table = _segment_table(segment, partMethod, load, save)
+        tables.append(table[tnum - segstart:min(end, segend + 1) - segstart])
+        tnum = segend + 1
+    return np.concatenate(tables)
+
+
 class Partition(Parameterized):
     """
     Base Class for all partioning modules
@@ -189,41 +319,8 @@ class Partition(Parameterized):
         return partitionTable
 
     def loadPartitions(self, tRange=(0, -1)):
-        """Load partitions from trace files, convert to mapped range"""
-        start = tRange[0]
-        end = tRange[1]
-
-        if end == -1:
-            end = self._traces.numTraces()
-
-        # Generate blank partition table
-        partitionTable = self.createBlankTable(self._traces.getSegment(start))
-        logging.info(np.shape(partitionTable))
-
-        tnum = start
-        while tnum < end:
-            t = self._traces.getSegment(tnum)
-            # Discover where this trace starts & ends
-            tmapstart = t.mappedRange[0]
-            tmapend = t.mappedRange[1]
-            tmapend = min(tmapend, end)
-
-            partcfg = t.getAuxDataConfig(self.attrDictPartition)
-            # print partcfg
-            # print partcfg["filename"]
-            partdata = t.loadAuxData(partcfg["filename"])
-
-            # Merge tables now - better way to do this?
-            for j in range(0, len(self.partMethod.getPartitionNum(t, 0))):
-                for i in range(0, self.partMethod.getNumPartitions()):
-                    partitionTable[j][i] = partitionTable[j][i] + partdata[j][i]
-
-            # print tmapstart
-
-            # Next trace round
-            tnum = tmapend + 1
-
-        return partitionTable
+        """Load partitions stored with the trace segments, working out any that are missing"""
+        return self.generatePartitions(saveFile=True, loadFile=True, tRange=tRange)
 
     def getPartitionData(self):
         return self.partDataCache
@@ -232,59 +329,28 @@ class Partition(Parameterized):
         """
         Generate partitions, using previously setup setTraceManager & partition class, or if they are passed as
         arguments will update the class data
+
+        Returns:
+            partitionTable[subkey][partition] = list of the trace numbers in that partition
         """
         if partitionClass:
             self.setPartMethod(partitionClass)
 
-        partitionTable = None
-
-        if loadFile:
-            partitionTable = self.loadPartitions(tRange)
-            raise AttributeError("WARNING: loadPartitions broken for split files, disabled for now")
-
         start = tRange[0]
         end = tRange[1]
-
-        num_keys=len(self.partMethod.getPartitionNum(self._traces.getSegment(start), 0))
-        num_parts=self.partMethod.getNumPartitions()
-
-        if partitionTable is None:
-            partitionTable = self.createBlankTable(num_keys, num_parts)
-
-            if end == -1:
-                end = self._traces.numTraces()
-
-            tnum = start
-            while tnum < end:
-                t = self._traces.getSegment(tnum)
-                # Discover where this trace starts & ends
-                tmapstart = t.mappedRange[0]
-                tmapend = t.mappedRange[1]
-                
-                partitionTableTemp = self.createBlankTable(num_keys, num_parts)
-
-                for tnum in range(tmapstart, tmapend + 1):
-                    # Check each trace, write partition number
-                    partNum = self.partMethod.getPartitionNum(t, tnum - tmapstart)
-                    for i, pn in enumerate(partNum):
-                        partitionTable[i][pn].append(tnum)
-                        partitionTableTemp[i][pn].append(tnum - tmapstart)
-
-                    # self.traceDone.emit(tnum)
-
-                if saveFile:
-                    # Save partition table, reference it in config file
-                    newCfgDict = copy.deepcopy(self.attrDictPartition)
-                    updatedDict = t.addAuxDataConfig(newCfgDict)
-                    t.saveAuxData(partitionTableTemp, updatedDict)
-
-                # Debug - Dump Table
-                # for t in range(0, self.partMethod.getNumPartitions()):
-                #    print "Traces in %d:" % t
-                #    print "  ",
-                #    print partitionTable[0][t]
-
-                tnum = tmapend + 1
+        if end == -1:
+            end = self._traces.num_traces()
+
+        labels = partition_table(self._traces, self.partMethod, start, end, load=loadFile, save=saveFile)
+        num_parts = self.partMethod.getNumPartitions()
+
+        partitionTable = self.createBlankTable(labels.shape[1], num_parts)
+        for j in range(labels.shape[1]):
+            #Stable sort keeps the traces of each partition in order
+            order = np.argsort(labels[:, j], kind='stable')
+            bounds = np.searchsorted(labels[order, j], np.arange(num_parts + 1))
+            for i in range(num_parts):
+                partitionTable[j][i] = list(order[bounds[i]:bounds[i + 1]] + start)
 
         self.partDataCache = partitionTable
         return partitionTable
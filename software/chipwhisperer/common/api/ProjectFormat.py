@@ -25,6 +25,7 @@ import logging
 import os
 import re
 import sys
+import itertools
 from datetime import datetime
 import zipfile
 import numpy as np
@@ -218,8 +219,27 @@ class Project(Parameterized):
 
     @setupSetParam("Trace Format")
     def set_trace_format(self, trace_format):
+        """Set the TraceContainer used to store new trace segments
+
+        Args:
+            trace_format (TraceContainer): Container to copy for each new segment,
+                e.g. TraceContainerNative(project=project) or
+                TraceContainerChunked(project=project)
+        """
         self._trace_format = trace_format
 
+        # If nothing was captured yet, the segment waiting for traces switches format too
+        traces = getattr(self, '_traces', None)
+        if traces is not None and traces.cur_trace_num == 0:
+            segments = self._traceManager.traceSegments
+            for i, seg in enumerate(segments):
+                if seg is traces.cur_seg:
+                    traces.cur_seg = self._segments.new()
+                    traces.cur_seg.enabled = seg.enabled
+                    traces.cur_seg._isloaded = True
+                    segments[i] = traces.cur_seg
+                    self._traceManager._setRangesDirty()
+
     setTraceFormat = util.camel_case_deprecated(set_trace_format)
 
     def __dirtyCallback(self):
@@ -693,11 +713,41 @@ class Traces:
         Args:
             iterable: Any iterable of :class:`Trace <chipwhisperer.common.trace.Trace>` objects.
 
+        Traces are added to the segments in batches, copying each batch into
+        the segment at once.
+
         Raises:
             TypeError: If any of the object in the iterable are not a trace.
         """
-        for item in iterable:
-            self.append(item)
+        iterator = iter(iterable)
+        while True:
+            # Fill up the current segment, or a whole new one if it is full
+            room = self.seg_ind_max + 1 - self.cur_trace_num
+            if room <= 0:
+                room = self.seg_ind_max + 1
+            batch = list(itertools.islice(iterator, room))
+            if not batch:
+                break
+
+            if self.cur_trace_num > self.seg_ind_max:
+                self.cur_seg = self.project.segments.new()
+                self.project.segments.append(self.cur_seg)
+                self.cur_trace_num = 0
+
+            for item in batch:
+                if not isinstance(item, Trace):
+                    raise TypeError("Expected Trace object, got {}.".format(item))
+
+            if len(set(len(item.wave) for item in batch)) == 1:
+                self.cur_seg.add_traces([item.wave for item in batch],
+                                        [item.textin for item in batch],
+                                        [item.textout for item in batch],
+                                        [item.key for item in batch])
+                self.cur_trace_num += len(batch)
+            else:
+                # Waves of different lengths, let add_trace pad them one by one
+                for item in batch:
+                    self.append(item)
 
     def __len__(self):
         return self.tm.num_traces()
@@ -738,17 +788,17 @@ class Traces:
             return result
 
         elif isinstance(item, slice):
-            indices = item.indices(self.tm.num_traces())
+            indices = range(*item.indices(self.tm.num_traces()))
+            if len(indices) == 0:
+                return []
+
+            # Read the covered range as one block, then pick out the wanted traces
+            first = min(indices)
+            block = self.tm.get_traces(first, max(indices) + 1)
             result = []
-            for i in range(*indices):
-                result.append(
-                    Trace(
-                        self.tm.get_trace(i),
-                        self.tm.get_textin(i),
-                        self.tm.get_textout(i),
-                        self.tm.get_known_key(i)
-                    )
-                )
+            for i in indices:
+                i -= first
+                result.append(Trace(block.wave[i], block.textin[i], block.textout[i], block.key[i]))
             return result
         else:
             raise TypeError('Indexing by integer or slice only')
@@ -789,7 +839,6 @@ class Segments:
     def __init__(self, project):
         self.project = project
         self.tm = project._traceManager
-        self.trace_container = project._trace_format
         self.data_directory = project.datadirectory
 
     def __len__(self):
@@ -801,7 +850,7 @@ class Segments:
         Returns:
             (TraceContainer) A new empty instance of a trace container.
         """
-        seg = copy.copy(self.trace_container)
+        seg = copy.copy(self.project.get_trace_format())
         seg.clear()
         return seg
 
@@ -22,18 +22,35 @@
 #    You should have received a copy of the GNU General Public License
 #    along with chipwhisperer.  If not, see <http://www.gnu.org/licenses/>.
 
+import bisect
 import configparser
 import logging
 import os.path
 import re
 
+from chipwhisperer.common.traces import Trace
 from chipwhisperer.common.traces.TraceContainerNative import TraceContainerNative
+from chipwhisperer.common.traces.TraceContainerTypes import TraceContainerFormatList
 from chipwhisperer.common.utils import util
 from chipwhisperer.common.utils.tracesource import TraceSource
 
+from collections import OrderedDict
 from datetime import datetime
 from pathlib import Path
 import copy
+import numpy as np
+
+
+def _join(parts):
+    """Join per-segment text/key blocks, keeping them as one array when the segments allow it"""
+    if all(isinstance(p, np.ndarray) and p.ndim == 2 for p in parts) and \
+            len(set((p.shape[1], p.dtype) for p in parts)) == 1:
+        return np.concatenate(parts)
+    joined = []
+    for p in parts:
+        joined.extend(p)
+    return joined
+
 
 class TraceManager(TraceSource):
     """
@@ -52,14 +69,22 @@ class TraceManager(TraceSource):
         self._numTraces = 0
         self._numPoints = 0
         self._sampleRate = 0
-        self.lastUsedSegment = None
         self.traceSegments = []
         self.saved = False
+        # Start index of each enabled segment (sorted) and the matching segments, for bisect lookups
+        self._segmentStarts = []
+        self._mappedSegments = []
+        # Most recently used segments last
+        self._loadedSegments = OrderedDict()
+        self._cachedSegments = 1
+        self._rangesDirty = False
         if __debug__: logging.debug('Created: ' + str(self))
 
     def new_project(self):
         """Create a new empty set of traces."""
         self.traceSegments = []
+        self._loadedSegments.clear()
+        self._updateRanges()
         self.dirty.setValue(False)
         self.sigTracesChanged.emit()
 
@@ -100,6 +125,10 @@ class TraceManager(TraceSource):
                 ti = TraceContainerNative()
                 try:
                     ti.config.loadTrace(fname)
+                    fmt = ti.config.attr("format")
+                    if fmt != "native" and fmt in TraceContainerFormatList:
+                        ti = TraceContainerFormatList[fmt]()
+                        ti.config.loadTrace(fname)
                     ti.loadAllTraces()
                 except Exception as e:
                     logging.error(str(e))
@@ -129,7 +158,7 @@ class TraceManager(TraceSource):
         """Return a list of segments."""
         tnum = start
         if end == -1:
-            end = self._numTraces
+            end = self.num_traces()
 
         dataDict = {'offsetList':[], 'lengthList':[]}
 
@@ -141,27 +170,58 @@ class TraceManager(TraceSource):
 
         return dataDict
 
+    @property
+    def cached_segments(self):
+        """Number of segments kept loaded in memory at once (default 1).
+
+        Segments are dropped least recently used first. Increase it when reading
+        traces from several segments in turn (e.g. shuffled or interleaved access).
+        Only saved segments are ever unloaded.
+
+        Setter raises ValueError if the number is smaller than 1.
+        """
+        return self._cachedSegments
+
+    @cached_segments.setter
+    def cached_segments(self, num):
+        if num < 1:
+            raise ValueError("Need to keep at least one segment loaded, got %d" % num)
+        self._cachedSegments = int(num)
+        self._trimLoadedSegments()
+
+    def _trimLoadedSegments(self):
+        while len(self._loadedSegments) > self._cachedSegments:
+            _, oldest = self._loadedSegments.popitem(last=False)
+            # Only unload segments if the traces are actually saved :)
+            if self.saved:
+                oldest.unloadAllTraces()
+
+    @property
+    def lastUsedSegment(self):
+        """The segment used by the last trace lookup (None if there was none)"""
+        if self._loadedSegments:
+            return next(reversed(self._loadedSegments.values()))
+        return None
+
     def get_segment(self, traceIndex):
         """Return the trace segment with the specified trace in the list with all enabled segments."""
-        if self.lastUsedSegment is not None:
-            if self.lastUsedSegment.mappedRange is not None and self.lastUsedSegment.mappedRange[0] <= traceIndex <= \
-                    self.lastUsedSegment.mappedRange[1]:
-                return self.lastUsedSegment
-            else:
-                # Only load one segment at a time for memory reasons
-                # If the traces are actually saved :)
-                if self.saved:
-                    self.lastUsedSegment.unloadAllTraces()
-                    self.lastUsedSegment = None
-
-        for traceSegment in self.traceSegments:
-            if traceSegment.mappedRange and traceSegment.mappedRange[0] <= traceIndex <= traceSegment.mappedRange[1]:
-                if not traceSegment.isLoaded():
-                    traceSegment.loadAllTraces(None, None)
-                self.lastUsedSegment = traceSegment
-                return traceSegment
+        if self._rangesDirty:
+            self._updateRanges()
+        i = bisect.bisect_right(self._segmentStarts, traceIndex) - 1
+        if i < 0 or traceIndex > self._mappedSegments[i].mappedRange[1]:
+            raise ValueError("Error: Trace %d is not in mapped range." % traceIndex)
+        traceSegment = self._mappedSegments[i]
+
+        key = id(traceSegment)
+        if key in self._loadedSegments:
+            self._loadedSegments.move_to_end(key)
+        else:
+            self._loadedSegments[key] = traceSegment
+            self._trimLoadedSegments()
 
-        raise ValueError("Error: Trace %d is not in mapped range." % traceIndex)
+        if not traceSegment.isLoaded():
+            traceSegment.loadAllTraces(None, None)
+        return traceSegment
 
     getSegment = util.camel_case_deprecated(get_segment)
 
@@ -183,6 +243,44 @@ class TraceManager(TraceSource):
 
     getTrace = util.camel_case_deprecated(get_trace)
 
+    def get_traces(self, start, stop, point_range=None):
+        """Return traces start to stop-1 of the enabled segments as a single block.
+
+        Each segment is sliced once. If the whole range falls in one segment, its
+        slice is returned without copying, otherwise the pieces are stitched together.
+
+        Args:
+            start (int): Index of the first trace
+            stop (int): Index one past the last trace
+            point_range (tuple, optional): (start, end) of the points to return
+
+        Returns:
+            :class:`Trace <chipwhisperer.common.traces.Trace>` where wave is a
+            (traces x points) array and textin, textout and key hold one entry per trace
+
+        Raises:
+            ValueError: If a trace in the range is not in the enabled segments
+        """
+        pieces = []
+        n = start
+        while n < stop:
+            t = self.get_segment(n)
+            end = min(stop, t.mappedRange[1] + 1)
+            pieces.append(t.get_traces(n - t.mappedRange[0], end - t.mappedRange[0], point_range))
+            n = end
+
+        if len(pieces) == 1:
+            return pieces[0]
+        if len(pieces) == 0:
+            return Trace(np.zeros((0, 0)), [], [], [])
+
+        # Segments with different lengths are cut down to the shortest, as in num_points()
+        npoints = min(p.wave.shape[1] for p in pieces)
+        return Trace(np.concatenate([p.wave[:, :npoints] for p in pieces]),
+                     _join([p.textin for p in pieces]),
+                     _join([p.textout for p in pieces]),
+                     _join([p.key for p in pieces]))
+
     def get_textin(self, n):
         """Return the input text of trace with index n in the list of enabled segments"""
         t = self.get_segment(n)
@@ -209,13 +307,19 @@ class TraceManager(TraceSource):
 
     def _updateRanges(self):
         """Update the trace range for each segments."""
+        self._rangesDirty = False
         startTrace = 0
         self._sampleRate = 0
         self._numPoints = 0
+        self._segmentStarts = []
+        self._mappedSegments = []
         for t in self.traceSegments:
             if t.enabled:
                 tlen = t.numTraces()
                 t.mappedRange = [startTrace, startTrace+tlen-1]
+                if tlen > 0:
+                    self._segmentStarts.append(startTrace)
+                    self._mappedSegments.append(t)
                 startTrace = startTrace + tlen
                 np = int(t.config.attr("numPoints"))
                 if self._numPoints != np and np != 0:
@@ -237,12 +341,16 @@ class TraceManager(TraceSource):
 
     def num_points(self):
         """Return the number of points in traces of the selected segments."""
+        if self._rangesDirty:
+            self._updateRanges()
         return self._numPoints
 
     numPoints = util.camel_case_deprecated(num_points)
 
     def num_traces(self):
         """Return the number of traces in the current list of enabled segments."""
+        if self._rangesDirty:
+            self._updateRanges()
         return self._numTraces
 
     numTraces = util.camel_case_deprecated(num_traces)
@@ -260,7 +368,16 @@ class TraceManager(TraceSource):
         self._updateRanges()
         self.sigTracesChanged.emit()
 
+    def _setRangesDirty(self):
+        """Traces were added to a segment: update the ranges the next time they are needed.
+
+        Avoids walking all segments after every single trace while capturing.
+        """
+        self._rangesDirty = True
+
     def getSampleRate(self, ):
+        if self._rangesDirty:
+            self._updateRanges()
         return self._sampleRate
 
     def changeSegmentAttribute(self, segmentNum, attribute, value):
@@ -24,7 +24,6 @@
 #    along with chipwhisperer.  If not, see <http://www.gnu.org/licenses/>.
 #=================================================
 
-from chipwhisperer.common.utils.util import DictType
 import numpy as np
 
 class NoGUIPlots(object):
@@ -54,18 +53,10 @@ class NoGUIPlots(object):
                     ]
                 ]
         """
-        attack_results = self._results
-        data = attack_results.maxes_list
-        maxdata = data[bnum]
-        tlist = []
-        for m in maxdata:
-            tlist.append(m['trace'])
-        maxlist = np.zeros((len(attack_results.diffs[bnum]), len(tlist)))
-        for i, m in enumerate(maxdata):
-            for j in range(0, len(attack_results.diffs[bnum])):
-                maxlist[m['maxes'][j][0], i] = m['maxes'][j][2]
-
-        return [tlist, maxlist]
+        history = self._results.history
+        #Entries recorded without a trace count can't be placed on the x axis
+        known = history.traces(bnum) >= 0
+        return [list(history.traces(bnum)[known]), history.correlations(bnum)[:, known]]
 
     corrVsTrace = corr_vs_trace
 
@@ -83,34 +74,9 @@ class NoGUIPlots(object):
                     pge
                 ]
         """
-        attack_results = self._results
-        pge = attack_results.pge_total
-        allpge = DictType()
-
-        for i in pge:
-            tnum = i['trace']
-            if not tnum in allpge:
-                allpge[tnum] = [{'pgesum':0, 'trials':0} for z in range(0,attack_results.numSubkeys)]
-
-            allpge[tnum][i['subkey']]['pgesum'] += i['pge']
-            allpge[tnum][i['subkey']]['trials'] += 1
-
-        for (tnum, plist) in allpge.items():
-            for j in plist:
-                if j['trials'] > 0:
-                    j['pge'] = float(j['pgesum']) / float(j['trials'])
-                    # print "%d "%j['trials'],
-                else:
-                    j['pge'] = None
-
-        trace = []
-        pge = []
-        for (tnum, plist) in allpge.items():
-            if plist[bnum]['pge'] is not None:
-                trace.append(tnum)
-                pge.append(plist[bnum]['pge'])
-
-        return [trace, pge]
+        history = self._results.history
+        known = history.traces(bnum) >= 0
+        return [list(history.traces(bnum)[known]), list(history.pge(bnum)[known])]
 
     pgeVsTrace = pge_vs_trace
 
@@ -0,0 +1,304 @@
+#!/usr/bin/python
+# -*- coding: utf-8 -*-
+#
+# Copyright (c) 2020, NewAE Technology Inc
+# All rights reserved.
+#
+# Find this and more at newae.com - this file is part of the chipwhisperer
+# project, http://www.github.com/newaetech/chipwhisperer
+#
+#    This file is part of chipwhisperer.
+#
+#    chipwhisperer is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    chipwhisperer is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#    GNU Lesser General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with chipwhisperer.  If not, see <http://www.gnu.org/licenses/>.
+#=================================================
+import os
+from collections import OrderedDict
+
+import numpy as np
+
+from . import Trace
+from .TraceContainerNative import TraceContainerNative, _load
+from chipwhisperer.common.utils.parameter import setupSetParam
+
+
+def _chunk_filename(directory, prefix, ti, pi, compressed):
+    return os.path.join(directory, "%schunk_%d_%d.%s" % (prefix, ti, pi, "npz" if compressed else "npy"))
+
+
+class ChunkedTraceArray(object):
+    """Read-only (traces x points) array of waves stored as a grid of chunk files.
+
+    Chunks are only read (and decompressed) when a wave in them is accessed, and the
+    most recently used ones are kept in memory. Reading a narrow point range only touches
+    the chunks covering those points.
+
+    Supports the indexing used on trace arrays: wave[n], waves[start:stop] and
+    waves[start:stop, pstart:pend].
+    """
+
+    def __init__(self, directory, prefix, cached_chunks=16):
+        self.directory = directory
+        self.prefix = prefix
+        index = np.load(os.path.join(directory, "%schunkindex.npz" % prefix))
+        self.shape = tuple(int(x) for x in index["shape"])
+        self.chunks = tuple(int(x) for x in index["chunks"])
+        self.dtype = np.dtype(str(index["dtype"]))
+        self.compressed = bool(index["compressed"])
+        #Per-chunk metadata
+        self.minimum = index["minimum"]
+        self.maximum = index["maximum"]
+        self.nbytes_stored = index["nbytes"]
+        self.ndim = 2
+        self._cache = OrderedDict()
+        self._cachedChunks = cached_chunks
+
+    def __len__(self):
+        return self.shape[0]
+
+    def _chunk(self, ti, pi):
+        key = (ti, pi)
+        if key in self._cache:
+            self._cache.move_to_end(key)
+            return self._cache[key]
+
+        fname = _chunk_filename(self.directory, self.prefix, ti, pi, self.compressed)
+        if self.compressed:
+            with np.load(fname) as f:
+                data = f["wave"]
+        else:
+            data = np.load(fname, mmap_mode='r')
+
+        self._cache[key] = data
+        while len(self._cache) > self._cachedChunks:
+            self._cache.popitem(last=False)
+        return data
+
+    def _read(self, tstart, tstop, pstart, pstop):
+        out = np.empty((max(tstop - tstart, 0), max(pstop - pstart, 0)), dtype=self.dtype)
+        if out.size == 0:
+            return out
+        ct, cp = self.chunks
+        for ti in range(tstart // ct, (tstop - 1) // ct + 1):
+            t0 = max(tstart, ti * ct)
+            t1 = min(tstop, (ti + 1) * ct)
+            for pi in range(pstart // cp, (pstop - 1) // cp + 1):
+                p0 = max(pstart, pi * cp)
+                p1 = min(pstop, (pi + 1) * cp)
+                chunk = self._chunk(ti, pi)
+                out[t0 - tstart:t1 - tstart, p0 - pstart:p1 - pstart] = chunk[t0 - ti * ct:t1 - ti * ct, p0 - pi * cp:p1 - pi * cp]
+        return out
+
+    def __getitem__(self, item):
+        if not isinstance(item, tuple):
+            item = (item,)
+        if len(item) == 1:
+            item = item + (slice(None),)
+        if len(item) != 2:
+            raise IndexError("Too many indices for a 2D trace array")
+
+        keys = []
+        for key, size in zip(item, self.shape):
+            if isinstance(key, (int, np.integer)):
+                n = int(key) + size if key < 0 else int(key)
+                if not 0 <= n < size:
+                    raise IndexError("Index %d out of range for %d entries" % (key, size))
+                keys.append((n, n + 1, 1, True))
+            elif isinstance(key, slice):
+                start, stop, step = key.indices(size)
+                if step > 0:
+                    keys.append((start, max(stop, start), step, False))
+                else:
+                    # Read the covered range forwards, the step is applied afterwards
+                    keys.append((stop + 1, start + 1, step, False))
+            else:
+                return np.asarray(self)[item]
+
+        (t0, t1, tstep, tint), (p0, p1, pstep, pint) = keys
+        data = self._read(t0, t1, p0, p1)
+        if tstep < 0:
+            data = data[::-1][::-tstep]
+        elif tstep > 1:
+            data = data[::tstep]
+        if pstep < 0:
+            data = data[:, ::-1][:, ::-pstep]
+        elif pstep > 1:
+            data = data[:, ::pstep]
+        if tint and pint:
+            return data[0, 0]
+        if tint:
+            return data[0]
+        if pint:
+            return data[:, 0]
+        return data
+
+    def __array__(self, dtype=None):
+        data = self._read(0, self.shape[0], 0, self.shape[1])
+        if dtype is not None:
+            data = data.astype(dtype)
+        return data
+
+
+class TraceContainerChunked(TraceContainerNative):
+    """TraceContainer storing the waves of each segment as a grid of chunks.
+
+    Every chunk holds chunk_traces x chunk_points samples and can be zlib compressed.
+    Waves are read back one chunk at a time when needed, so attacks on a narrow range
+    of points only read (and decompress) the chunks covering those points. Each segment
+    also stores the min/max of every chunk and its size on disk.
+
+    Textins, textouts and keys are stored as in TraceContainerNative. To use it for a
+    project::
+
+        project.set_trace_format(TraceContainerChunked(project=project))
+    """
+    _name = "ChipWhisperer/Chunked"
+
+    def __init__(self, configfile=None, project=None, default_setup=False, chunk_traces=1000, chunk_points=5000, compress=True):
+        self._chunkTraces = chunk_traces
+        self._chunkPoints = chunk_points
+        self._compress = compress
+        TraceContainerNative.__init__(self, configfile, project, default_setup)
+        self.getParams().addChildren([
+            {'name':'Chunk Traces', 'key':'chunktraces', 'type':'int', 'limits':(1, 10000000), 'get':self.get_chunk_traces, 'set':self.set_chunk_traces},
+            {'name':'Chunk Points', 'key':'chunkpoints', 'type':'int', 'limits':(1, 100000000), 'get':self.get_chunk_points, 'set':self.set_chunk_points},
+            {'name':'Compress', 'key':'compress', 'type':'bool', 'get':self.get_compress, 'set':self.set_compress},
+        ])
+
+    def clear(self):
+        TraceContainerNative.clear(self)
+        self.config.setAttr("format", "chunked")
+
+    def get_chunk_traces(self):
+        return self._chunkTraces
+
+    @setupSetParam("Chunk Traces")
+    def set_chunk_traces(self, num):
+        """Set the number of traces in each chunk written to disk"""
+        self._chunkTraces = num
+
+    def get_chunk_points(self):
+        return self._chunkPoints
+
+    @setupSetParam("Chunk Points")
+    def set_chunk_points(self, num):
+        """Set the number of points in each chunk written to disk"""
+        self._chunkPoints = num
+
+    def get_compress(self):
+        return self._compress
+
+    @setupSetParam("Compress")
+    def set_compress(self, compress):
+        """Set whether chunks are zlib compressed when saved"""
+        self._compress = compress
+
+    def get_traces(self, start, stop, point_range=None):
+        stop = min(stop, self.numTraces())
+        if point_range is None:
+            waves = self.traces[start:stop]
+        else:
+            # Single indexing operation, so only the chunks holding these points are read
+            waves = self.traces[start:stop, point_range[0]:point_range[1]]
+
+        return Trace(self._dequantize(waves), self.textins[start:stop], self.textouts[start:stop],
+                     self._block_keys(start, stop))
+
+    def loadAllTraces(self, directory=None, prefix=""):
+        """Load the chunk index and texts. Waves are read from the chunks when used."""
+
+        if self.config.configFilename():
+            if directory is None:
+                directory = os.path.split(self.config.configFilename())[0]
+            if prefix is None or prefix == '':
+                prefix = self.config.attr("prefix")
+
+        self._textbufs = {}
+        self.traces = ChunkedTraceArray(directory, prefix)
+        #Saving again keeps the geometry the segment was stored with
+        self._chunkTraces, self._chunkPoints = self.traces.chunks
+        self._compress = self.traces.compressed
+        self.textins = _load(os.path.join(directory, "%stextin.npy" % prefix))
+        self.textouts = _load(os.path.join(directory, "%stextout.npy" % prefix))
+
+        try:
+            self.knownkey = _load(os.path.join(directory, "%sknownkey.npy" % prefix))
+        except IOError:
+            self.knownkey = None
+
+        try:
+            self.keylist = _load(os.path.join(directory, "%skeylist.npy" % prefix))
+        except IOError:
+            self.keylist = None
+
+        self.setDirty(False)
+        self._isloaded = True
+
+    def saveAllTraces(self, directory, prefix=""):
+        self.config.setAttr("format", "chunked")
+        self.config.saveTrace()
+
+        numtraces = self.numTraces()
+        npoints = self.numPoints()
+        ct = max(1, min(self._chunkTraces, numtraces))
+        cp = max(1, min(self._chunkPoints, npoints))
+        tchunks = -(-numtraces // ct)
+        pchunks = -(-npoints // cp)
+        dtype = self.traces.dtype if self.traces is not None else np.dtype(np.double)
+
+        #Chunks of the stored geometry, which may be different from the new one
+        oldfiles = set()
+        indexname = os.path.join(directory, "%schunkindex.npz" % prefix)
+        if os.path.isfile(indexname):
+            old = ChunkedTraceArray(directory, prefix)
+            oldfiles = set(_chunk_filename(directory, prefix, ti, pi, old.compressed)
+                           for ti in range(old.minimum.shape[0]) for pi in range(old.minimum.shape[1]))
+
+        #Waves may still be read lazily from the stored chunks, so write the new chunks
+        #to temporary files and only replace the stored ones once all are written
+        minimum = np.zeros((tchunks, pchunks))
+        maximum = np.zeros((tchunks, pchunks))
+        nbytes = np.zeros((tchunks, pchunks), dtype=np.int64)
+        written = []
+        for ti in range(tchunks):
+            for pi in range(pchunks):
+                chunk = np.ascontiguousarray(self.traces[ti * ct:(ti + 1) * ct, pi * cp:(pi + 1) * cp])
+                fname = _chunk_filename(directory, prefix, ti, pi, self._compress)
+                with open(fname + ".tmp", "wb") as f:
+                    if self._compress:
+                        np.savez_compressed(f, wave=chunk)
+                    else:
+                        np.save(f, chunk)
+                minimum[ti, pi] = chunk.min()
+                maximum[ti, pi] = chunk.max()
+                nbytes[ti, pi] = os.path.getsize(fname + ".tmp")
+                written.append(fname)
+
+        for fname in written:
+            os.replace(fname + ".tmp", fname)
+        for fname in oldfiles.difference(written):
+            if os.path.isfile(fname):
+                os.remove(fname)
+
+        np.savez(os.path.join(directory, "%schunkindex.npz" % prefix), shape=np.array([numtraces, npoints]),
+                 chunks=np.array([ct, cp]), dtype=np.array(np.dtype(dtype).str), compressed=np.array(self._compress),
+                 minimum=minimum, maximum=maximum, nbytes=nbytes)
+
+        np.save(os.path.join(directory, "%stextin.npy" % prefix), self.textins)
+        np.save(os.path.join(directory, "%stextout.npy" % prefix), self.textouts)
+        np.save(os.path.join(directory, "%skeylist.npy" % prefix), self.keylist)
+        np.save(os.path.join(directory, "%sknownkey.npy" % prefix), self.knownkey)
+        if isinstance(self.traces, ChunkedTraceArray):
+            #Read back from the chunks just written
+            self.traces = ChunkedTraceArray(directory, prefix)
+        self.setDirty(False)
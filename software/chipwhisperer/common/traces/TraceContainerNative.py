@@ -27,13 +27,89 @@ import numpy as np
 from datetime import datetime
 from ._base import TraceContainer
 
+
+def _byte_rows(rows):
+    """Return rows as a (N, width) uint8 array, or None if they aren't all bytes of the same width"""
+    try:
+        arr = np.array([np.frombuffer(r, dtype=np.uint8) if isinstance(r, (bytes, bytearray)) else r for r in rows])
+    except (ValueError, TypeError):
+        return None
+    if arr.ndim != 2 or arr.dtype.kind not in 'ui':
+        return None
+    if arr.size and (arr.min() < 0 or arr.max() > 255):
+        return None
+    return arr.astype(np.uint8, copy=False)
+
+
+def _load(fname):
+    """Load a .npy file, memory mapped unless it holds pickled objects (projects from older versions)"""
+    try:
+        data = np.load(fname, mmap_mode='r')
+    except ValueError:
+        data = np.load(fname, allow_pickle=True)
+    if data.dtype == object and data.ndim == 0:
+        # np.save(None)
+        data = data.item()
+    return data
+
+
 class TraceContainerNative(TraceContainer):
     """ Most common TraceContainer for CW Projects
 
     Stick to add_trace().
+
+    Textins, textouts and keys made of bytes (bytearrays, lists of ints in 0-255, ...) of a
+    fixed length are stored as (traces x length) uint8 arrays, both in memory and on disk.
+    Anything else is kept in a list, as before.
     """
     _name = "ChipWhisperer/Native"
-    
+
+    def clear(self):
+        TraceContainer.clear(self)
+        # Preallocated uint8 buffers behind textins/textouts/keylist
+        self._textbufs = {}
+
+    def _appendBytes(self, attr, rows):
+        """Append rows to the uint8 array attr, falling back to a list if they don't fit in one"""
+        current = getattr(self, attr)
+        if current is None:
+            current = []
+        n = len(current)
+        arr = None
+        if (isinstance(current, list) and n == 0) or \
+                (isinstance(current, np.ndarray) and current.dtype == np.uint8 and current.ndim == 2):
+            arr = _byte_rows(rows)
+        if arr is not None and (n == 0 or arr.shape[1] == current.shape[1]):
+            buf = self._textbufs.get(attr)
+            if buf is None or buf.shape[0] < n + len(arr) or buf.shape[1] != arr.shape[1] or n == 0:
+                # Grow geometrically, as the trace buffer
+                newbuf = np.zeros((max(2 * n, n + len(arr), self.tracehint), arr.shape[1]), dtype=np.uint8)
+                if n:
+                    newbuf[:n] = current
+                buf = newbuf
+                self._textbufs[attr] = buf
+            buf[n:n + len(arr)] = arr
+            setattr(self, attr, buf[:n + len(arr)])
+        else:
+            current = list(current)
+            current.extend(rows)
+            self._textbufs.pop(attr, None)
+            setattr(self, attr, current)
+
+    def addTextin(self, data):
+        self._appendBytes('textins', [data])
+
+    def addTextout(self, data):
+        self._appendBytes('textouts', [data])
+
+    def addKey(self, key):
+        self._appendBytes('keylist', [key])
+
+    def _extendTexts(self, textins, textouts, keys):
+        self._appendBytes('textins', textins)
+        self._appendBytes('textouts', textouts)
+        self._appendBytes('keylist', keys)
+
     def default_config_setup(self, project):
         starttime = datetime.now()
         prefix = starttime.strftime('%Y.%m.%d-%H.%M.%S') + "_"
@@ -75,18 +151,19 @@ class TraceContainerNative(TraceContainer):
             if prefix is None or prefix == '':
                 prefix = self.config.attr("prefix")
 
-        self.traces = np.load(os.path.join(directory, "%straces.npy" % prefix), mmap_mode='r', allow_pickle=True)
-        self.textins = np.load(os.path.join(directory, "%stextin.npy" % prefix), allow_pickle=True)
-        self.textouts = np.load(os.path.join(directory, "%stextout.npy" % prefix), allow_pickle=True)
+        self._textbufs = {}
+        self.traces = _load(os.path.join(directory, "%straces.npy" % prefix))
+        self.textins = _load(os.path.join(directory, "%stextin.npy" % prefix))
+        self.textouts = _load(os.path.join(directory, "%stextout.npy" % prefix))
 
         try:
-            self.knownkey = np.load(os.path.join(directory, "%sknownkey.npy" % prefix), allow_pickle=True)
+            self.knownkey = _load(os.path.join(directory, "%sknownkey.npy" % prefix))
         except IOError:
             self.knownkey = None
 
         # OK if this fails
         try:
-            self.keylist = np.load(os.path.join(directory, "%skeylist.npy" % prefix), allow_pickle=True)
+            self.keylist = _load(os.path.join(directory, "%skeylist.npy" % prefix))
         except IOError:
             self.keylist = None
 
@@ -101,6 +178,7 @@ class TraceContainerNative(TraceContainer):
         self.textouts = None
         self.knownkey = None
         self.keylist = None
+        self._textbufs = {}
         self._isloaded = False
 
     def saveAuxData(self, data, configDict, filenameKey="filename"):
@@ -126,7 +204,11 @@ class TraceContainerNative(TraceContainer):
 
     def saveAllTraces(self, directory, prefix=""):
         self.config.saveTrace()
-        np.save(os.path.join(directory, "%straces.npy" % prefix), self.traces)
+        traces = self.traces
+        if traces is not None:
+            # Don't store the unused rows preallocated for new traces
+            traces = traces[:self.numTraces()]
+        np.save(os.path.join(directory, "%straces.npy" % prefix), traces)
         np.save(os.path.join(directory, "%stextin.npy" % prefix), self.textins)
         np.save(os.path.join(directory, "%stextout.npy" % prefix), self.textouts)
         np.save(os.path.join(directory, "%skeylist.npy" % prefix), self.keylist)
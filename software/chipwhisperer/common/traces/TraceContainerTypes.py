@@ -24,13 +24,20 @@
 __author__ = "Colin O'Flynn"
 
 from . import TraceContainerNative
+from . import TraceContainerChunked
 try:
     from . import TraceContainerMySQL
 except ImportError:
     TraceContainerMySQL = None
 
-from . import TraceContainerDPAv3
+try:
+    from . import TraceContainerDPAv3
+except ImportError:
+    # Importer needs the Qt GUI
+    TraceContainerDPAv3 = None
 
-TraceContainerFormatList = {"native":TraceContainerNative.TraceContainerNative, "dpav3":TraceContainerDPAv3.TraceContainerDPAv3 }
+TraceContainerFormatList = {"native":TraceContainerNative.TraceContainerNative, "chunked":TraceContainerChunked.TraceContainerChunked}
+if TraceContainerDPAv3 is not None:
+    TraceContainerFormatList["dpav3"] = TraceContainerDPAv3.TraceContainerDPAv3
 if TraceContainerMySQL is not None:
     TraceContainerFormatList["mysql"] = TraceContainerMySQL.TraceContainerMySQL
@@ -27,6 +27,7 @@ import logging
 import re
 import numpy as np
 from . import _cfgfile
+from . import Trace
 from chipwhisperer.common.utils.parameter import Parameterized
 
 
@@ -43,6 +44,7 @@ class TraceContainer(Parameterized):
     def __init__(self, configfile=None, project=None, default_setup=False):
         self.configfile = configfile
         self.fmt = None
+        self._adcFormat = None
         self.getParams().register()
         self.getParams().addChildren([
                 {'name':'Config File', 'key':'cfgfile', 'type':'str', 'readonly':True, 'value':''},
@@ -68,6 +70,70 @@ class TraceContainer(Parameterized):
         self.pointhint = 0
         self._numTraces = 0
         self._isloaded = False
+        if self._adcFormat is not None:
+            self.tracedtype = self._adcFormat[0]
+            self.config.setAttr("adcScale", self._adcFormat[1])
+            self.config.setAttr("adcOffset", self._adcFormat[2])
+
+    def set_adc_format(self, dtype, scale, offset=0.0):
+        """Store waves as raw integer ADC codes instead of floating point.
+
+        Each sample is kept as the integer code (value - offset) / scale, with scale and
+        offset saved in the segment config. Waves are converted back to floating point
+        (code * scale + offset) when they are read, one trace or block at a time. Applies
+        to traces added after this call (and to segments copied from this container).
+
+        For the ChipWhisperer scopes, which return code / 1024 - 0.5 (OpenADC, 10-bit) and
+        code / 256 - 0.5 (CW-Nano, 8-bit)::
+
+            fmt.set_adc_format(np.uint16, 1/1024.0, -0.5)
+            fmt.set_adc_format(np.uint8, 1/256.0, -0.5)
+
+        Args:
+            dtype: Integer type of the stored codes, or None to store waves as given again
+            scale (float): Size of one ADC code
+            offset (float): Value of code 0
+        """
+        if dtype is None:
+            self._adcFormat = None
+            self.tracedtype = np.double
+            scale = 0
+            offset = 0
+        else:
+            if np.dtype(dtype).kind not in 'ui':
+                raise TypeError("ADC codes must be stored in an integer type, got %s" % np.dtype(dtype))
+            if scale <= 0:
+                raise ValueError("Scale must be positive, got %s" % scale)
+            self._adcFormat = (np.dtype(dtype), float(scale), float(offset))
+            self.tracedtype = self._adcFormat[0]
+        self.config.setAttr("adcScale", scale)
+        self.config.setAttr("adcOffset", offset)
+
+    def _quantize(self, waves):
+        """Turn waves into the ADC codes stored in the trace buffer, if set_adc_format() was used"""
+        if self._adcFormat is None:
+            return waves
+        dtype, scale, offset = self._adcFormat
+        waves = np.asarray(waves)
+        if waves.dtype.kind in 'ui':
+            # Already raw codes
+            return waves
+        info = np.iinfo(dtype)
+        codes = (waves - offset) / scale
+        rounded = np.rint(codes)
+        if np.any(np.abs(codes - rounded) > 1e-3):
+            logging.warning('Waves are not multiples of the ADC scale (%g), rounding them to the nearest code' % scale)
+        clipped = (rounded < info.min) | (rounded > info.max)
+        if np.any(clipped):
+            logging.warning('%d samples are outside the range of %s ADC codes and were clipped' % (np.count_nonzero(clipped), dtype))
+        return np.clip(rounded, info.min, info.max).astype(dtype)
+
+    def _dequantize(self, waves):
+        """Convert stored ADC codes back to floating point (no-op for waves stored as is)"""
+        scale = float(self.config.attr("adcScale"))
+        if scale == 0:
+            return waves
+        return waves * scale + float(self.config.attr("adcOffset"))
 
     def setDirty(self, dirty):
         self.dirty = dirty
@@ -104,15 +170,77 @@ class TraceContainer(Parameterized):
         self.addTextin(textin)
         self.addTextout(textout)
         self.addKey(key)
-        self.project.trace_manager()._updateRanges()
+        self.project.trace_manager()._setRangesDirty()
 
     addTrace = add_trace
 
+    def add_traces(self, waves, textins, textouts, keys, dtype=np.double):
+        """Add a batch of traces with a single copy into the trace buffer.
+
+        Args:
+            waves (array): (traces x points) array, or a list of equal length waves
+            textins (list): One textin per trace
+            textouts (list): One textout per trace
+            keys (list): One key per trace
+            dtype: Data type of the trace buffer, if this is the first data added
+        """
+        waves = self._quantize(np.asarray(waves))
+        if self._adcFormat is not None:
+            dtype = self._adcFormat[0]
+        if waves.ndim != 2:
+            raise ValueError("Expected a 2D (traces x points) array of waves, got shape %s" % str(waves.shape))
+        num = waves.shape[0]
+        if not (len(textins) == len(textouts) == len(keys) == num):
+            raise ValueError("Need one textin, textout and key per trace")
+
+        if self.traces is None:
+            if dtype is None:
+                dtype = np.double
+            self.tracedtype = dtype
+            self.traces = np.zeros((max(self.tracehint, num), waves.shape[1]), dtype=dtype)
+        else:
+            self._reserve(self._numTraces + num)
+
+            pad = self.traces.shape[1] - waves.shape[1]
+            if pad > 0:
+                logging.warning('Traces too short (length=%d)' % waves.shape[1] + " *This MAY SUGGEST DATA CORRUPTION*")
+                logging.warning('Padding with %d zero points' % pad)
+                waves = np.concatenate((waves, np.zeros((num, pad))), axis=1)
+
+        self.traces[self._numTraces:self._numTraces + num] = waves
+        self._numTraces += num
+        self._extendTexts(textins, textouts, keys)
+
+        self.setDirty(True)
+        self.writeDataToConfig()
+        self.project.trace_manager()._setRangesDirty()
+
+    def _reserve(self, numtraces):
+        """Make sure the trace buffer has room for numtraces traces.
+
+        The buffer grows geometrically (at least doubling), so filling a segment one trace
+        at a time only copies each trace a constant number of times on average.
+        """
+        if self.traces.shape[0] >= numtraces:
+            return
+
+        self.tracehint = max(numtraces, 2 * self.traces.shape[0], self.tracehint + 25)
+        try:
+            # Copy rather than resize in place, there may be views of the old buffer around
+            newtraces = np.zeros((self.tracehint, self.traces.shape[1]), dtype=self.traces.dtype)
+        except MemoryError:
+            raise Warning("Failed to allocate/resize array for %d x %d, if you have sufficient memory it may be fragmented. Use smaller segments and retry." % (self.tracehint, self.traces.shape[1]))
+        newtraces[:self._numTraces] = self.traces[:self._numTraces]
+        self.traces = newtraces
+
     def writeDataToConfig(self):
         self.config.setAttr("numTraces", self._numTraces)
         self.config.setAttr("numPoints", self.numPoints())      
 
     def addWave(self, trace, dtype=None):
+        trace = self._quantize(trace)
+        if self._adcFormat is not None:
+            dtype = self._adcFormat[0]
         try:
             if self.traces is None:
                 if dtype is None:
@@ -122,13 +250,7 @@ class TraceContainer(Parameterized):
                 self.traces[self._numTraces][:] = trace
             else:
                 # Check can fit this
-                if self.traces.shape[0] <= self._numTraces:
-                    if self._numTraces >= self.tracehint:
-                        # Tracehint wrong - increase by 25
-                        self.tracehint += 25
-
-                    # Do a resize now to allocate more memory
-                    self.traces.resize((self.tracehint, self.traces.shape[1]))
+                self._reserve(self._numTraces + 1)
 
                 #Validate traces fit - if too short warn & pad (prevents aborting long captures)
                 pad = self.traces.shape[1] - len(trace)
@@ -145,6 +267,12 @@ class TraceContainer(Parameterized):
         self.setDirty(True)
         self.writeDataToConfig()
 
+    def _extendTexts(self, textins, textouts, keys):
+        """Append the textins, textouts and keys of a batch of traces"""
+        self.textins.extend(textins)
+        self.textouts.extend(textouts)
+        self.keylist.extend(keys)
+
     def setKnownKey(self, key):
         self.knownkey = key
 
@@ -158,13 +286,43 @@ class TraceContainer(Parameterized):
         self.textouts.append(data)
         
     def getTrace(self, n):
-        data = self.traces[n]
+        data = self._dequantize(self.traces[n])
 
         #Following line will normalize all traces relative to each
         #other by mean & standard deviation
         #data = (data - np.mean(data)) / np.std(data)
         return data
 
+    def get_traces(self, start, stop, point_range=None):
+        """Return traces start to stop-1 of this container as a single block.
+
+        The waves are a slice of the trace array, so no data is copied (traces loaded
+        with mmap_mode stay on disk until they are used).
+
+        Args:
+            start (int): Index of the first trace
+            stop (int): Index one past the last trace
+            point_range (tuple, optional): (start, end) of the points to return
+
+        Returns:
+            :class:`Trace <chipwhisperer.common.traces.Trace>` of (traces x points)
+            waves and the textins/textouts/keys of those traces
+        """
+        stop = min(stop, self.numTraces())
+        waves = self.traces[start:stop]
+        if point_range is not None:
+            waves = waves[:, point_range[0]:point_range[1]]
+
+        return Trace(self._dequantize(waves), self.textins[start:stop], self.textouts[start:stop],
+                     self._block_keys(start, stop))
+
+    def _block_keys(self, start, stop):
+        """Keys of traces start to stop-1, the known key repeated if there is no per-trace key list"""
+        keylist = getattr(self, 'keylist', None)
+        if keylist is None or (isinstance(keylist, np.ndarray) and keylist.ndim == 0) or len(keylist) == 0:
+            return [self.knownkey] * (stop - start)
+        return keylist[start:stop]
+
     def getTextin(self, n):
         return self.textins[n]
 
@@ -108,7 +108,9 @@ class TraceContainerConfig(object):
                     "scopeSampleRate":{"order":8, "value":0, "desc":"Sample Rate (s/sec)", "changed":False, "headerLabel":"Sample Rate", "editable":True},
                     "scopeYUnits":{"order":9, "value":0, "desc":"Units of Y Points", "changed":False, "editable":True},
                     "scopeXUnits":{"order":10, "value":0, "desc":"Units of X Points", "changed":False, "editable":True},
-                    "notes":{"order":11, "value":"", "desc":"Additional Notes about Capture Setup", "changed":False, "headerLabel":"Notes", "editable":True}                
+                    "notes":{"order":11, "value":"", "desc":"Additional Notes about Capture Setup", "changed":False, "headerLabel":"Notes", "editable":True},
+                    "adcScale":{"order":12, "value":0, "desc":"Scale of stored integer ADC codes (0 if samples are stored as is)", "changed":False, "editable":False},
+                    "adcOffset":{"order":13, "value":0, "desc":"Offset added to scaled integer ADC codes", "changed":False, "editable":False}
                     },
                 }
     
@@ -26,6 +26,8 @@
 #=================================================
 import logging
 import uuid
+import numpy as np
+from chipwhisperer.common.traces import Trace
 from chipwhisperer.common.utils import util
 from chipwhisperer.common.utils.parameter import Parameterized, setupSetParam
 
@@ -47,6 +49,37 @@ class TraceSource(object):
         """Return the trace with number n in the current TraceSource object"""
         return None
 
+    def get_traces(self, start, stop, point_range=None):
+        """Return traces start to stop-1 as a single block.
+
+        Generic version which fetches the traces one at a time. Sources which can
+        hand out blocks directly (e.g. slices of the stored trace arrays) should
+        override this.
+
+        Args:
+            start (int): Index of the first trace
+            stop (int): Index one past the last trace
+            point_range (tuple, optional): (start, end) of the points to return from
+                each trace. All points are returned if None.
+
+        Returns:
+            :class:`Trace <chipwhisperer.common.traces.Trace>` where wave is a
+            (traces x points) array and textin, textout and key hold one entry per trace
+        """
+        waves = []
+        textins = []
+        textouts = []
+        keys = []
+        for n in range(start, stop):
+            wave = self.get_trace(n)
+            if point_range is not None:
+                wave = wave[point_range[0]:point_range[1]]
+            waves.append(wave)
+            textins.append(self.get_textin(n))
+            textouts.append(self.get_textout(n))
+            keys.append(self.get_known_key(n))
+        return Trace(np.array(waves), textins, textouts, keys)
+
     def numPoints(self):
         return 0
 
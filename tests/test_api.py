@@ -62,6 +62,37 @@ class TestTraces(unittest.TestCase):
         # do allow slice without step
         self.assertEqual('hello', traces[-2:][-1][3])
 
+    def test_get_traces_block(self):
+        tm = self.project.trace_manager()
+
+        # block spanning all three segments
+        block = tm.get_traces(3, 13, (2, 10))
+        self.assertEqual((10, 8), block.wave.shape)
+        for i in range(3, 13):
+            np.testing.assert_array_equal(tm.get_trace(i)[2:10], block.wave[i-3])
+            self.assertEqual(tm.get_textin(i), block.textin[i-3])
+            self.assertEqual(tm.get_known_key(i), block.key[i-3])
+
+    def test_segment_lookup(self):
+        tm = self.project.trace_manager()
+        tm.cached_segments = 2
+        for i in [12, 0, 7, 4, 5, 10, 9]:
+            seg = tm.get_segment(i)
+            self.assertTrue(seg.mappedRange[0] <= i <= seg.mappedRange[1])
+        self.assertRaises(ValueError, tm.get_segment, 13)
+        self.assertRaises(ValueError, tm.get_segment, -1)
+        self.assertRaises(ValueError, setattr, tm, 'cached_segments', 0)
+
+    def test_extend_batches(self):
+        traces = create_random_traces(12, 35)
+        self.project.traces.extend(traces)
+        self.assertEqual(self.trace_num + 12, len(self.project.traces))
+        # 13 + 12 traces in segments of 5
+        self.assertEqual(5, len(self.project.segments))
+        for i, trace in enumerate(traces):
+            np.testing.assert_array_equal(trace.wave, self.project.traces[self.trace_num + i].wave)
+            np.testing.assert_array_equal(trace.textin, self.project.textins[self.trace_num + i])
+
     def test_textin_individually(self):
         textins = self.project.textins
 
@@ -170,9 +201,10 @@ class TestProject(unittest.TestCase):
 
         index = 0
         for wave, textin, textout, key in zip(self.project.waves, self.project.textins, self.project.textouts, self.project.keys):
-            self.assertEqual(traces[index].textin, textin)
-            self.assertEqual(traces[index].textout, textout)
-            self.assertEqual(traces[index].key, key)
+            # texts of bytes are stored as uint8 arrays
+            self.assertEqual(traces[index].textin, list(textin))
+            self.assertEqual(traces[index].textout, list(textout))
+            self.assertEqual(traces[index].key, list(key))
             self.assertEqual(traces[index].wave, wave)
             index += 1
 
@@ -186,6 +218,53 @@ class TestProject(unittest.TestCase):
         # make sure you can open the project with open_project
         self.project = cw.open_project(self.project_name)
 
+    def test_chunked_format(self):
+        from chipwhisperer.common.traces.TraceContainerChunked import TraceContainerChunked
+        self.project = cw.create_project(self.project_name)
+        self.project.set_trace_format(TraceContainerChunked(project=self.project, chunk_traces=16, chunk_points=300))
+        traces = create_random_traces(100, 1000)
+        self.project.traces.extend(traces)
+        self.project.save()
+
+        self.project = cw.open_project(self.project_name)
+        self.assertEqual('chunked', self.project.segments[0].config.attr('format'))
+        self.assertEqual(100, len(self.project.traces))
+        block = self.project.trace_manager().get_traces(10, 60, (250, 700))
+        np.testing.assert_array_equal(np.array([t.wave[250:700] for t in traces[10:60]]), block.wave)
+        np.testing.assert_array_equal(traces[42].textin, self.project.textins[42])
+
+        # Loaded segments keep their geometry, and can be saved with a new one
+        segment = self.project.segments[0]
+        self.assertEqual((16, 300), (segment.get_chunk_traces(), segment.get_chunk_points()))
+        segment.set_chunk_traces(7)
+        segment.set_compress(False)
+        segment.saveAllTraces(os.path.split(segment.config.configFilename())[0], segment.config.attr("prefix"))
+        self.project = cw.open_project(self.project_name)
+        self.assertEqual((7, 300), self.project.segments[0].traces.chunks)
+        np.testing.assert_array_equal(np.array([t.wave for t in traces]), self.project.trace_manager().get_traces(0, 100).wave)
+
+    def test_adc_format(self):
+        from chipwhisperer.common.traces.TraceContainerNative import TraceContainerNative
+        self.project = cw.create_project(self.project_name)
+        fmt = TraceContainerNative(project=self.project)
+        fmt.set_adc_format(np.uint8, 1/256.0, -0.5)
+        self.project.set_trace_format(fmt)
+        waves = np.random.randint(0, 256, (50, 200)) / 256.0 - 0.5
+        for wave in waves:
+            self.project.traces.append(cw.Trace(wave, bytearray(16), bytearray(16), bytearray(16)))
+        self.project.save()
+
+        self.project = cw.open_project(self.project_name)
+        self.assertEqual(np.uint8, self.project.segments[0].traces.dtype)
+        np.testing.assert_array_equal(waves[3], self.project.waves[3])
+        np.testing.assert_array_equal(waves[:, 20:40], self.project.trace_manager().get_traces(0, 50, (20, 40)).wave)
+
+        # Samples out of the range of the codes are clipped, with a warning
+        with self.assertLogs(level='WARNING') as logs:
+            codes = fmt._quantize(np.array([[-1.0, 0.0, 0.75]]))
+        np.testing.assert_array_equal([[0, 128, 255]], codes)
+        self.assertIn('2 samples', logs.output[0])
+
 
 class TestProjectExportImport(unittest.TestCase):
 
@@ -273,6 +352,167 @@ class TestSNR(unittest.TestCase):
         snr = cwa.calculate_snr(self.traces, cwa.leakage_models.sbox_output)
         self.assertEqual(len(snr), 5000)
 
+    def test_streaming_snr(self):
+        model = cwa.leakage_models.sbox_output
+        stats = cwa.SNR([model, cwa.leakage_models.last_round_state])
+        stats.add_traces(self.traces[:300])
+        stats.update(self.project.traces)
+        self.assertEqual(1000, stats.num_traces)
+        self.assertEqual((16, 5000), stats.snr().shape)
+
+        # Signal weighted by class size, over the noise pooled from all classes
+        waves = np.array([trace.wave for trace in self.traces])
+        leakage = np.array([model.leakage(t.textin, t.textout, None, 5, {'knownkey':t.key}) for t in self.traces])
+        classes = [waves[leakage == c] for c in np.unique(leakage)]
+        signal = sum(len(c) * np.square(np.mean(c, axis=0) - np.mean(waves, axis=0)) for c in classes) / len(waves)
+        noise = sum(np.sum(np.square(c - np.mean(c, axis=0)), axis=0) for c in classes) / (len(waves) - len(classes))
+        np.testing.assert_allclose(signal / noise, stats.snr(5))
+
+
+class TestPointsOfInterest(unittest.TestCase):
+
+    def setUp(self):
+        # Leakage of subkey b at point 10 + 20*b (and a weaker copy 3 points later)
+        rng = np.random.RandomState(3)
+        self.model = cwa.leakage_models.sbox_output
+        self.traces = []
+        for i in range(500):
+            textin = list(rng.randint(0, 256, 16))
+            key = list(rng.randint(0, 256, 16))
+            wave = rng.normal(0, 0.5, 400)
+            for b in range(16):
+                hw = self.model.leakage(textin, None, None, b, {'knownkey':key})
+                wave[10 + 20*b] += hw
+                wave[13 + 20*b] += hw / 2
+            self.traces.append(cw.Trace(wave, textin, [0]*16, key))
+
+        self.project = cw.create_project('projects/test_poi', overwrite=True)
+        for trace in self.traces:
+            self.project.traces.append(trace)
+
+    def tearDown(self):
+        self.project.remove(i_am_sure=True)
+
+    def test_select_and_save(self):
+        model = self.model
+        traces = self.traces
+        pois = cwa.PointsOfInterest(model)
+        pois.add_traces(traces[:200])
+        pois.update(self.project.traces)
+        self.assertEqual(500, pois.num_traces)
+
+        waves = np.array([t.wave for t in traces])
+        leakage = np.array([model.leakage(t.textin, None, None, 4, {'knownkey':t.key}) for t in traces])
+        corr = [abs(np.corrcoef(leakage, waves[:, p])[0, 1]) for p in range(400)]
+        np.testing.assert_allclose(corr, pois.correlation(4))
+        means = [np.mean(waves[leakage == c], axis=0) for c in np.unique(leakage)]
+        sosd = sum(np.square(a - b) for i, a in enumerate(means) for b in means[i + 1:])
+        np.testing.assert_allclose(sosd, pois.sosd(4))
+
+        for metric in ('snr', 'corr'):
+            self.assertEqual([[10 + 20*b, 13 + 20*b] for b in range(16)], pois.select(2, 2, metric))
+        # SOSD is not normalized by the noise, so only the strongest point is reliable
+        self.assertEqual([10 + 20*b for b in range(16)], [p[0] for p in pois.select(1, 2, 'sosd')])
+        # Points closer than min_spacing are skipped
+        self.assertEqual(10 + 20*4, pois.select(2, 5)[4][0])
+        self.assertNotIn(13 + 20*4, pois.select(2, 5)[4])
+
+        pois.save(self.project, num_pois=2, min_spacing=2, margin=5)
+        self.project.save()
+        self.project.close()
+        project = cw.open_project('projects/test_poi')
+        saved = cwa.load_pois(project)
+        self.assertEqual([[10 + 20*b, 13 + 20*b] for b in range(16)], saved["poi"])
+        self.assertEqual((5 + 20*15, 19 + 20*15), saved["windows"][15])
+        self.assertEqual(list(range(16)), saved["bnums"])
+        project.close(save=False)
+
+
+class TestTTest(unittest.TestCase):
+
+    def setUp(self):
+        from chipwhisperer.analyzer.attacks.tvla import TVLA_FIXED_TEXT
+        # Fixed traces differ in mean at point 3, variance at point 7 and skew at point 11
+        rng = np.random.RandomState(5)
+        self.num = 3000
+        self.fixed = rng.rand(self.num) < 0.5
+        key = bytearray(range(16))
+        textins = [TVLA_FIXED_TEXT[16] if f else bytearray(rng.randint(0, 256, 16).astype(np.uint8)) for f in self.fixed]
+        self.waves = rng.randn(self.num, 20)
+        self.waves[self.fixed, 3] += 0.3
+        self.waves[self.fixed, 7] *= 1.5
+        self.waves[self.fixed, 11] = rng.gamma(2, 1, self.fixed.sum()) - 2
+
+        self.project = cw.create_project('ttest_test', overwrite=True)
+        for wave, textin in zip(self.waves, textins):
+            self.project.traces.append(cw.Trace(wave, textin, textin, key))
+
+    def tearDown(self):
+        self.project.remove(i_am_sure=True)
+
+    def test_ttest(self):
+        ttest = cwa.TTest(order=3)
+        ttest.block_size = 700
+        ttest.add_traces(self.project.traces, processes=2)
+
+        resumed = cwa.TTest(order=3)
+        resumed.add_traces(list(self.project.traces)[:1000])
+        resumed.save(self.project)
+        resumed = cwa.TTest.load(self.project)
+        resumed.update(self.project.traces)
+        self.assertEqual(self.num, resumed.num_traces)
+
+        for order, point in ((1, 3), (2, 7), (3, 11)):
+            tstat = ttest.t_statistic(order)
+            self.assertEqual(point, np.argmax(np.abs(tstat)))
+            np.testing.assert_allclose(tstat, resumed.t_statistic(order), atol=1e-9)
+
+    def test_first_order_is_welch(self):
+        ttest = cwa.TTest(order=1)
+        ttest.add_traces(self.project.traces)
+        a, b = self.waves[self.fixed], self.waves[~self.fixed]
+        expected = (a.mean(axis=0) - b.mean(axis=0)) / np.sqrt(a.var(axis=0) / len(a) + b.var(axis=0) / len(b))
+        np.testing.assert_allclose(expected, ttest.t_statistic(1), atol=1e-9)
+
+
+class TestPartition(unittest.TestCase):
+
+    def test_partition_table(self):
+        from chipwhisperer.analyzer.utils.Partition import PartitionHWIntermediate, PartitionHDLastRound, partition_table
+        source = cw.open_project('projects/Tutorial_B5')
+        traces = list(source.traces)
+        project = cw.create_project('partition_test', overwrite=True)
+        project.traces.extend(traces[:30])
+        tm = project.trace_manager()
+
+        methods = (PartitionHWIntermediate(), PartitionHDLastRound())
+        first = [partition_table(tm, method) for method in methods]
+        self.assertEqual((30, 16), first[0].shape)
+        # Only stored when asked to
+        self.assertFalse(any('partition_' in f for f in os.listdir(os.path.join(project.datadirectory, 'traces'))))
+        for method in methods:
+            partition_table(tm, method, save=True)
+
+        # Stored tables are extended with the traces appended since
+        project.traces.extend(traces[30:])
+        for method, stored in zip(methods, first):
+            table = partition_table(tm, method, 5, 50, save=True)
+            np.testing.assert_array_equal(stored[5:], table[:25])
+            for tnum in (5, 29, 30, 49):
+                self.assertEqual(method.getPartitionNum(tm, tnum), list(table[tnum - 5]))
+
+        hw = [[bin(cwa.aes_funcs.sbox(p ^ k)).count('1') for p, k in zip(t.textin, t.key)] for t in traces]
+        np.testing.assert_array_equal(hw, partition_table(tm, PartitionHWIntermediate()))
+
+        # Tables that don't match the texts of their segment are worked out again
+        segment = tm.get_segment(0)
+        segment.textins[3] ^= 0xff
+        hw[3] = [bin(cwa.aes_funcs.sbox(p ^ k)).count('1') for p, k in zip(segment.textins[3], traces[3].key)]
+        np.testing.assert_array_equal(hw, partition_table(tm, PartitionHWIntermediate()))
+
+        project.remove(i_am_sure=True)
+        source.close(save=False)
+
 
 class TestPreprocessing(unittest.TestCase):
 
@@ -325,6 +565,35 @@ class TestSegment(unittest.TestCase):
         for i in range(0, len(arr)):
             self.assertEqual(self.project.textins[10000][i], arr[i])
 
+class TestLeakageModels(unittest.TestCase):
+
+    def test_leakage_matrix_matches_leakage(self):
+        pts = np.random.randint(0, 256, (20, 16), dtype=np.uint8)
+        cts = np.random.randint(0, 256, (20, 16), dtype=np.uint8)
+        keys = np.random.randint(0, 256, (20, 16), dtype=np.uint8)
+        for name in ['sbox_output', 'last_round_state_diff', 'sbox_in_out_diff', 'sbox_output_successive']:
+            leak_model = getattr(cwa.leakage_models, name)
+            hyp = leak_model.leakage_matrix(pts, cts, 3, keys)
+            for tnum in range(len(pts)):
+                state = {'knownkey': keys[tnum]}
+                expected = [leak_model.leakage(pts[tnum], cts[tnum], guess, 3, state) for guess in range(256)]
+                self.assertEqual(list(hyp[tnum]), expected)
+
+    def test_leakage_matrix_of_subclass(self):
+        #Overriding only leakage() must not inherit the SBox table lookup
+        from chipwhisperer.analyzer.attacks.models.AES128_8bit import SBox_output
+        class SBoxOutputBit0(SBox_output):
+            def leakage(self, pt, ct, key, bnum):
+                return self.sbox(pt[bnum] ^ key[bnum]) & 0x01
+
+        leak_model = cwa.leakage_models.new_model(SBoxOutputBit0)
+        pts = np.random.randint(0, 256, (5, 16), dtype=np.uint8)
+        hyp = leak_model.leakage_matrix(pts, pts, 2)
+        for tnum in range(len(pts)):
+            expected = [leak_model.leakage(pts[tnum], pts[tnum], guess, 2, {'knownkey': None}) for guess in range(256)]
+            self.assertEqual(list(hyp[tnum]), expected)
+
+
 class TestCPA(unittest.TestCase):
     def test_CPA(self):
         project = cw.open_project('projects/Tutorial_B5')
@@ -337,6 +606,241 @@ class TestCPA(unittest.TestCase):
 
         project.close(save=False)
 
+    def test_vectorized_matches_progressive(self):
+        project = cw.open_project('projects/Tutorial_B5')
+        leak_model = cwa.leakage_models.sbox_output
+        results = cwa.cpa(project, leak_model).run()
+        vec_results = cwa.cpa(project, leak_model, cwa.cpa_algorithms.ProgressiveVectorized).run()
+        for bnum in range(len(project.keys[0])):
+            np.testing.assert_allclose(np.array(results.diffs[bnum]), vec_results.diffs[bnum])
+        self.assertEqual(results.find_key(), vec_results.find_key())
+
+        project.close(save=False)
+
+    def test_float32_matches_float64(self):
+        project = cw.open_project('projects/Tutorial_B5')
+        leak_model = cwa.leakage_models.sbox_output
+        results = cwa.cpa(project, leak_model, cwa.cpa_algorithms.ProgressiveVectorized).run()
+        attack = cwa.cpa(project, leak_model, cwa.cpa_algorithms.ProgressiveVectorized)
+        attack.algorithm.set_precision('float32')
+        f32_results = attack.run()
+        for bnum in range(len(project.keys[0])):
+            self.assertEqual(np.float32, f32_results.diffs[bnum].dtype)
+            np.testing.assert_allclose(results.diffs[bnum], f32_results.diffs[bnum], atol=1e-4)
+        self.assertEqual(results.find_key(), f32_results.find_key())
+
+        project.close(save=False)
+
+    def test_multiprocess_matches_single(self):
+        project = cw.open_project('projects/Tutorial_B5')
+        leak_model = cwa.leakage_models.sbox_output
+        results = cwa.cpa(project, leak_model, cwa.cpa_algorithms.ProgressiveVectorized).run()
+        attack = cwa.cpa(project, leak_model, cwa.cpa_algorithms.ProgressiveVectorized)
+        attack.algorithm.set_processes(2)
+        callbacks = []
+        mp_results = attack.run(callback=lambda: callbacks.append(1), update_interval=10)
+        self.assertEqual(len(callbacks), 5)
+        for bnum in range(len(project.keys[0])):
+            np.testing.assert_allclose(results.diffs[bnum], mp_results.diffs[bnum])
+
+        project.close(save=False)
+
+    def test_tiled_matches_untiled(self):
+        project = cw.open_project('projects/Tutorial_B5')
+        leak_model = cwa.leakage_models.sbox_output
+        results = cwa.cpa(project, leak_model, cwa.cpa_algorithms.ProgressiveVectorized).run()
+        attack = cwa.cpa(project, leak_model, cwa.cpa_algorithms.ProgressiveVectorized)
+        attack.algorithm.set_tile_points(1000)
+        callbacks = []
+        tiled_results = attack.run(callback=lambda: callbacks.append(1))
+        self.assertEqual(len(callbacks), -(-len(project.waves[0]) // 1000))
+        maxes = results.find_maximums()
+        tiled_maxes = tiled_results.find_maximums()
+        for bnum in range(len(project.keys[0])):
+            self.assertIsNone(tiled_results.diffs[bnum])
+            np.testing.assert_allclose(maxes[bnum]['value'], tiled_maxes[bnum]['value'])
+            peak = tiled_maxes[bnum][0]
+            self.assertAlmostEqual(abs(results.diffs[bnum][peak['hyp']][peak['point']]), peak['value'])
+        self.assertEqual(results.find_key(), tiled_results.find_key())
+
+        # The hypotheses of each trace block are only built in the first tile
+        calls = []
+        leakage_matrix = leak_model.leakage_matrix
+        leak_model.leakage_matrix = lambda *args: calls.append(1) or leakage_matrix(*args)
+        try:
+            blocks_results = attack.run(update_interval=10)
+        finally:
+            del leak_model.leakage_matrix
+        self.assertEqual(16 * 5, len(calls))
+        attack.algorithm.set_processes(2)
+        mp_results = attack.run(update_interval=10)
+        for bnum in range(len(project.keys[0])):
+            np.testing.assert_allclose(blocks_results.find_maximums()[bnum]['value'], mp_results.find_maximums()[bnum]['value'])
+            np.testing.assert_allclose(tiled_maxes[bnum]['value'], mp_results.find_maximums()[bnum]['value'])
+
+        # Stopping subkeys and depth-first mode aren't available with tiles
+        attack.algorithm.set_stop_intervals(2)
+        self.assertRaises(ValueError, attack.run)
+        attack.algorithm.set_stop_intervals(0)
+        attack.algorithm.set_iteration_mode('df')
+        self.assertRaises(ValueError, attack.run)
+
+        project.close(save=False)
+
+    def test_subkey_points(self):
+        project = cw.open_project('projects/Tutorial_B5')
+        leak_model = cwa.leakage_models.sbox_output
+        results = cwa.cpa(project, leak_model, cwa.cpa_algorithms.ProgressiveVectorized).run()
+
+        # Ranges, ranges given as index lists and sparse index lists
+        points = dict((bnum, (100*bnum, 100*bnum + 300)) for bnum in range(8))
+        points.update((bnum, np.arange(50*bnum, 50*bnum + 200)) for bnum in range(8, 12))
+        points.update((bnum, np.array([3*bnum, 1000 + bnum, 20, 2*bnum])) for bnum in range(12, 16))
+        points[7] = [700, 1000]
+        for processes in (1, 2):
+            attack = cwa.cpa(project, leak_model, cwa.cpa_algorithms.ProgressiveVectorized)
+            attack.algorithm.set_processes(processes)
+            attack.point_range = points
+            self.assertEqual((300, 600), attack.get_point_range(3))
+            subkey_results = attack.run()
+            for bnum in range(16):
+                p = points[bnum]
+                expected = results.diffs[bnum][:, p[0]:p[1]] if isinstance(p, (tuple, list)) else results.diffs[bnum][:, p]
+                np.testing.assert_allclose(expected, subkey_results.diffs[bnum])
+
+        # Lists of ranges are ranges, index lists need to be arrays
+        attack.point_range = [[0, 100]] * 16
+        self.assertEqual((0, 100), attack.get_point_range(5))
+        self.assertRaises(ValueError, setattr, attack, 'point_range', {0:[1, 5, 9]})
+        self.assertRaises(ValueError, setattr, attack, 'point_range', {0:(5, 1)})
+
+        # Algorithms attacking all subkeys on one range say so
+        second = cwa.cpa(project, leak_model, cwa.cpa_algorithms.SecondOrder)
+        second.algorithm.set_window1((0, 10))
+        second.algorithm.set_window2((10, 20))
+        second.point_range = points
+        self.assertRaises(ValueError, second.run)
+
+        # Back to one range for all subkeys
+        attack.point_range = [0, 500]
+        self.assertEqual({}, attack.get_subkey_points())
+        self.assertEqual((16, 256, 500), np.shape(attack.run().diffs))
+
+        project.close(save=False)
+
+    def test_stop_when_stable(self):
+        project = cw.open_project('projects/Tutorial_B5')
+        leak_model = cwa.leakage_models.sbox_output
+        attack = cwa.cpa(project, leak_model, cwa.cpa_algorithms.ProgressiveVectorized)
+        attack.algorithm.set_stop_intervals(2)
+        results = attack.run(update_interval=5)
+        self.assertEqual(list(project.keys[0]), results.find_key())
+        for bnum in range(len(project.keys[0])):
+            stop = results.stopped[bnum]
+            self.assertEqual('stable', stop['reason'])
+            self.assertEqual(project.keys[0][bnum], stop['guess'])
+            self.assertEqual(stop['trace'], results.diffs_tnum[bnum])
+        self.assertLess(min(stop['trace'] for stop in results.stopped), len(project.traces))
+
+        # Workers are rebalanced as subkeys stop, with the same results
+        attack.algorithm.set_processes(3)
+        mp_results = attack.run(update_interval=5)
+        self.assertEqual(results.stopped, mp_results.stopped)
+        for bnum in range(len(project.keys[0])):
+            np.testing.assert_allclose(results.diffs[bnum], mp_results.diffs[bnum])
+
+        from chipwhisperer.analyzer.attacks.cpa_algorithms._parallel import SubkeyWorkerPool
+        from chipwhisperer.analyzer.attacks.cpa_algorithms.progressive_vectorized import CPAProgressiveOneSubkeyVectorized
+        block = project.trace_manager().get_traces(0, 20)
+        pool = SubkeyWorkerPool(CPAProgressiveOneSubkeyVectorized, leak_model, range(6), 2)
+        try:
+            pool.add_traces(block.wave[:10], 10, block.textin[:10], block.textout[:10], block.key[:10])
+            diffs = pool.add_traces(block.wave[10:], 10, block.textin[10:], block.textout[10:], block.key[10:], active=[0, 2, 4])
+            self.assertEqual(2, len(set(pool.owner[bnum] for bnum in (0, 2, 4))))
+        finally:
+            pool.close()
+        single = CPAProgressiveOneSubkeyVectorized(leak_model)
+        for start in (0, 10):
+            data = single.oneSubkey(4, None, block.wave[start:start + 10], 10, block.textin[start:start + 10], block.textout[start:start + 10], block.key[start:start + 10], None, single.modelstate, 0)[0]
+        np.testing.assert_allclose(data, diffs[4])
+
+        project.close(save=False)
+
+    def test_key_rank_and_search(self):
+        project = cw.open_project('projects/Tutorial_B5')
+        leak_model = cwa.leakage_models.sbox_output
+        attack = cwa.cpa(project, leak_model, cwa.cpa_algorithms.ProgressiveVectorized)
+        attack.trace_range = [0, 22]
+        results = attack.run()
+        self.assertNotEqual(list(project.keys[0]), results.find_key())
+
+        scores = cwa.key_enumeration.subkey_scores(results)
+        low, rank, high = cwa.key_enumeration.key_rank(scores, project.keys[0])
+        key, tried = cwa.key_enumeration.search_key(scores, project.textins[0], project.textouts[0], max_keys=2**16)
+        self.assertEqual(list(project.keys[0]), key)
+        self.assertTrue(low <= tried <= high)
+
+        project.close(save=False)
+
+    def test_results_history(self):
+        project = cw.open_project('projects/Tutorial_B5')
+        leak_model = cwa.leakage_models.sbox_output
+        attack = cwa.cpa(project, leak_model, cwa.cpa_algorithms.ProgressiveVectorized)
+        Results = cwa.attacks._stats.Results
+        Results.history_length, Results.history_top_k = 4, 8
+        try:
+            results = attack.run(callback=lambda: attack.results.find_maximums(), update_interval=5)
+        finally:
+            Results.history_length, Results.history_top_k = 512, None
+
+        plots = cwa.analyzer_plots(results)
+        traces, pge = plots.pge_vs_trace(0)
+        self.assertLessEqual(len(traces), 4)
+        self.assertEqual([5, 35, 45, 50], traces)
+        self.assertEqual(results.pge[0], pge[-1])
+        self.assertEqual(traces, [m['trace'] for m in results.maxes_list[0]])
+        traces, corr = plots.corr_vs_trace(0)
+        self.assertEqual((256, len(traces)), corr.shape)
+        self.assertEqual(8, np.sum(~np.isnan(corr[:, -1])))
+
+        maxes = results.find_maximums()
+        for bnum in range(len(project.keys[0])):
+            peaks = np.nanmax(np.fabs(results.diffs[bnum]), axis=1)
+            np.testing.assert_allclose(peaks[maxes[bnum]['hyp']], maxes[bnum]['value'])
+        np.testing.assert_allclose(corr[maxes[0]['hyp'][:8], -1], maxes[0]['value'][:8])
+
+        #use_single keeps the signed diffs at the point of the best guess
+        results.maxValid[0] = False
+        maxes = results.find_maximums([0], use_single=True)
+        where = maxes[0]['point'][0]
+        np.testing.assert_allclose(np.asarray(results.diffs[0])[maxes[0]['hyp'], where], maxes[0]['value'])
+        self.assertTrue(np.any(maxes[0]['value'] < 0))
+
+        #Entries without a trace count are left out of the plots
+        untimed = Results(1, 256)
+        untimed.update_subkey(0, np.asarray(results.diffs[0]))
+        untimed.find_maximums()
+        self.assertEqual([None], [m['trace'] for m in untimed.maxes_list[0]])
+        self.assertEqual([[], []], cwa.analyzer_plots(untimed).pge_vs_trace(0))
+
+        project.close(save=False)
+
+    @unittest.skipIf(cwa.cpa_algorithms.progressive_caccel._cpa_accel is None, "C extension not built")
+    def test_caccel_matches_progressive(self):
+        project = cw.open_project('projects/Tutorial_B5')
+        leak_model = cwa.leakage_models.sbox_output
+        attack = cwa.cpa(project, leak_model)
+        attack.point_range = [1000, 2500]
+        results = attack.run()
+        attack = cwa.cpa(project, leak_model, cwa.cpa_algorithms.ProgressiveCAccel)
+        attack.point_range = [1000, 2500]
+        c_results = attack.run()
+        for bnum in range(len(project.keys[0])):
+            np.testing.assert_allclose(np.array(results.diffs[bnum]), c_results.diffs[bnum])
+        self.assertEqual(list(project.keys[0]), c_results.find_key())
+
+        project.close(save=False)
+
     def test_jitter(self):
         project = cw.open_project('projects/jittertime')
         resync_traces = cwa.preprocessing.ResyncSAD(project)
@@ -353,6 +857,234 @@ class TestCPA(unittest.TestCase):
         project.close(save=False)
 
 
+class TestSecondOrder(unittest.TestCase):
+
+    def setUp(self):
+        # Masked sbox output: the mask leaks at point 10, the masked value at point 30
+        rng = np.random.RandomState(1)
+        hw = np.array([bin(i).count('1') for i in range(256)])
+        self.num = 2000
+        self.key = rng.randint(0, 256, 16)
+        self.textins = rng.randint(0, 256, (self.num, 16))
+        self.waves = rng.randn(self.num, 40) * 0.5
+        masks = rng.randint(0, 256, self.num)
+        masked = np.array([cwa.aes_funcs.sbox(pt ^ self.key[0]) for pt in self.textins[:, 0]]) ^ masks
+        self.waves[:, 10] += hw[masks]
+        self.waves[:, 30] += hw[masked]
+
+        self.project = cw.create_project('second_order_test', overwrite=True)
+        for wave, textin in zip(self.waves, self.textins):
+            self.project.traces.append(cw.Trace(wave, textin, textin, self.key))
+
+    def tearDown(self):
+        self.project.remove(i_am_sure=True)
+
+    def test_second_order(self):
+        attack = cwa.cpa(self.project, cwa.leakage_models.sbox_output, cwa.cpa_algorithms.SecondOrder)
+        attack.subkey_list = [0]
+        attack.algorithm.set_window1((5, 15))
+        attack.algorithm.set_window2((25, 35))
+        results = attack.run(update_interval=500)
+
+        best = results.find_maximums()[0][0]
+        self.assertEqual(self.key[0], best[0])
+        self.assertEqual((10, 30), attack.algorithm.point_pair(best[1]))
+
+    def test_centered_on_all_traces(self):
+        # Same as correlating with the products centered on the means of all traces
+        attack = cwa.cpa(self.project, cwa.leakage_models.sbox_output, cwa.cpa_algorithms.SecondOrder)
+        attack.subkey_list = [0]
+        attack.algorithm.set_window1((5, 15))
+        attack.algorithm.set_window2((25, 35))
+        results = attack.run(update_interval=500)
+
+        x = self.waves[:, 5:15] - np.mean(self.waves[:, 5:15], axis=0)
+        y = self.waves[:, 25:35] - np.mean(self.waves[:, 25:35], axis=0)
+        prod = (x[:, :, None] * y[:, None, :]).reshape(self.num, -1)
+        hyp = cwa.leakage_models.sbox_output.leakage_matrix(self.textins, self.textins, 0)
+        prod = prod - np.mean(prod, axis=0)
+        hyp = hyp - np.mean(hyp, axis=0)
+        expected = np.dot(hyp.T, prod) / np.sqrt(np.outer(np.sum(hyp**2, axis=0), np.sum(prod**2, axis=0)))
+        np.testing.assert_allclose(expected, results.diffs[0], atol=1e-12)
+
+
+class TestDPA(unittest.TestCase):
+
+    def setUp(self):
+        # Bit 3 of the sbox output of byte b leaks at point b
+        rng = np.random.RandomState(2)
+        self.key = rng.randint(0, 256, 16)
+        self.textins = rng.randint(0, 256, (1000, 16))
+        self.waves = rng.randn(1000, 20) * 0.5
+        sbox = np.array([[cwa.aes_funcs.sbox(pt ^ k) for pt, k in zip(row, self.key)] for row in self.textins])
+        self.waves[:, :16] += (sbox >> 3) & 1
+
+        self.project = cw.create_project('dpa_test', overwrite=True)
+        for wave, textin in zip(self.waves, self.textins):
+            self.project.traces.append(cw.Trace(wave, textin, textin, self.key))
+
+    def tearDown(self):
+        self.project.remove(i_am_sure=True)
+
+    def test_dpa(self):
+        attack = cwa.cpa(self.project, cwa.leakage_models.sbox_output, cwa.cpa_algorithms.DPA)
+        attack.algorithm.set_bit(3)
+        results = attack.run(update_interval=250)
+        self.assertEqual(list(self.key), results.find_key())
+
+        # Same as splitting all traces on the bit for each guess
+        bits = (cwa.leakage_models.sbox_output.intermediate_matrix(self.textins, self.textins, 2) >> 3) & 1
+        expected = np.array([self.waves[bits[:, g] == 1].mean(axis=0) - self.waves[bits[:, g] == 0].mean(axis=0)
+                             for g in range(256)])
+        np.testing.assert_allclose(expected, results.diffs[2], atol=1e-12)
+
+    def test_bit_out_of_range(self):
+        # Bits past the 8-bit intermediate values would never select any trace
+        attack = cwa.cpa(self.project, cwa.leakage_models.sbox_output, cwa.cpa_algorithms.DPA)
+        attack.algorithm.set_bit(8)
+        self.assertRaises(ValueError, attack.run)
+
+
+class TestLRA(unittest.TestCase):
+
+    def setUp(self):
+        # Each bit of the sbox output leaks at its own point, with its own weight
+        rng = np.random.RandomState(3)
+        self.num = 1000
+        self.key = rng.randint(0, 256, 16)
+        self.textins = rng.randint(0, 256, (self.num, 16))
+        self.waves = rng.randn(self.num, 12) * 0.5
+        sbox = np.array([cwa.aes_funcs.sbox(pt ^ self.key[0]) for pt in self.textins[:, 0]])
+        for b in range(8):
+            self.waves[:, b] += ((sbox >> b) & 1) * (1 + 0.3 * b)
+
+        self.project = cw.create_project('lra_test', overwrite=True)
+        for wave, textin in zip(self.waves, self.textins):
+            self.project.traces.append(cw.Trace(wave, textin, textin, self.key))
+
+    def tearDown(self):
+        self.project.remove(i_am_sure=True)
+
+    def test_lra(self):
+        attack = cwa.cpa(self.project, cwa.leakage_models.sbox_output, cwa.cpa_algorithms.LRA)
+        attack.subkey_list = [0]
+        attack.algorithm.set_basis('bits')
+        results = attack.run(update_interval=250)
+        self.assertEqual(self.key[0], results.find_key()[0])
+
+        # Same R^2 as a least-squares fit of each guess' bits on the points
+        bits = cwa.leakage_models.sbox_output.intermediate_matrix(self.textins, self.textins, 0)[:, :, None] >> np.arange(8) & 1
+        design = np.hstack([self.waves, np.ones((self.num, 1))])
+        expected = []
+        for g in range(256):
+            hyp = bits[:, g].astype(float)
+            residual = np.linalg.lstsq(design, hyp, rcond=None)[1].sum()
+            expected.append(1 - residual / np.sum(np.square(hyp - hyp.mean(axis=0))))
+        np.testing.assert_allclose(expected, results.diffs[0][:, 0], atol=1e-12)
+
+    def test_shared_gram(self):
+        # Subkeys adding the same block share one Gram matrix and its factorization
+        from chipwhisperer.analyzer.attacks.cpa_algorithms.lra import LRAGramCache, LRAOneSubkey
+        grams = LRAGramCache()
+        subkeys = [LRAOneSubkey(cwa.leakage_models.sbox_output, grams=grams) for bnum in range(2)]
+        for bnum, subkey in enumerate(subkeys):
+            subkey.oneSubkey(bnum, None, self.waves[:500], 500, self.textins, self.textins, [self.key]*500, None,
+                             subkey.modelstate, 0)
+        self.assertIs(subkeys[0].gram, subkeys[1].gram)
+
+
+class TestTemplate(unittest.TestCase):
+
+    class PartitionTextinHW(object):
+        def getNumPartitions(self):
+            return 9
+
+        def getPartitionNum(self, trace, tnum):
+            return [bin(b).count('1') for b in trace.get_textin(tnum)]
+
+    def test_generate_and_update(self):
+        from chipwhisperer.analyzer.attacks.profiling_algorithms.template import TemplateUsingMVS
+        project = cw.open_project('projects/Tutorial_B5')
+        traces = project.trace_manager()
+        pois = [[10, 20, 30 + i] for i in range(16)]
+        part = self.PartitionTextinHW()
+
+        full = TemplateUsingMVS.generate(traces, (0, 50), pois, part)
+        updated = TemplateUsingMVS.generate(traces, (0, 20), pois, part)
+        updated = TemplateUsingMVS.update(updated, traces, (20, 50), part)
+        self.assertEqual((0, 50), updated["trange"])
+
+        waves = np.array([traces.get_trace(i) for i in range(50)])
+        hw = np.array([part.getPartitionNum(traces, i) for i in range(50)])
+        for bnum in range(16):
+            for p in range(9):
+                data = waves[hw[:, bnum] == p][:, pois[bnum]]
+                if len(data) < 2:
+                    continue
+                for template in (full, updated):
+                    np.testing.assert_allclose(np.mean(data, axis=0), template["mean"][bnum][p])
+                    np.testing.assert_allclose(np.cov(data, rowvar=0), template["cov"][bnum][p], atol=1e-12)
+
+        project.close(save=False)
+
+
+class TestTemplateMatcher(unittest.TestCase):
+
+    class PartitionSboxHW(object):
+        def getNumPartitions(self):
+            return 9
+
+        def getPartitionNum(self, trace, tnum):
+            return [bin(cwa.aes_funcs.sbox(p ^ k)).count('1') for p, k in zip(trace.get_textin(tnum), trace.get_known_key(tnum))]
+
+    def setUp(self):
+        from chipwhisperer.analyzer.attacks.profiling_algorithms.template import TemplateUsingMVS
+
+        # HW of the sbox output of byte b leaks at points b and 16+b
+        rng = np.random.RandomState(4)
+        self.key = rng.randint(0, 256, 16)
+        self.textins = rng.randint(0, 256, (2600, 16))
+        self.waves = rng.randn(2600, 40) * 0.5
+        hw = np.array([[bin(cwa.aes_funcs.sbox(p ^ k)).count('1') for p, k in zip(row, self.key)] for row in self.textins])
+        self.waves[:, :16] += hw
+        self.waves[:, 16:32] += 0.5 * hw
+
+        self.project = cw.create_project('template_test', overwrite=True)
+        for wave, textin in zip(self.waves, self.textins):
+            self.project.traces.append(cw.Trace(wave, textin, textin, self.key))
+
+        # Profile on the first 2500 traces, match the rest
+        self.pois = [[b, 16 + b, 35] for b in range(16)]
+        self.template = TemplateUsingMVS.generate(self.project.trace_manager(), (0, 2500), self.pois, self.PartitionSboxHW())
+        self.template["partitiontype"] = "PartitionHWIntermediate"
+
+    def tearDown(self):
+        self.project.remove(i_am_sure=True)
+
+    def test_guess_scores(self):
+        from chipwhisperer.analyzer.attacks.profiling_algorithms.template import TemplateMatcher
+        for covariance in ('full', 'diagonal', 'pooled'):
+            matcher = TemplateMatcher(self.template, covariance)
+            scores = matcher.guess_scores(self.waves[2500:], self.textins[2500:], self.textins[2500:], 3)
+            self.assertEqual(self.key[3], np.argmax(scores))
+
+    def test_log_likelihoods(self):
+        from scipy.stats import multivariate_normal
+        from chipwhisperer.analyzer.attacks.profiling_algorithms.template import TemplateMatcher
+        template = self.template
+        waves = self.waves[2500:2510]
+
+        logpdf = TemplateMatcher(template, 'full').log_likelihoods(waves, 3)
+        expected = [[multivariate_normal.logpdf(w[self.pois[3]], template["mean"][3][p], template["cov"][3][p]) for p in range(9)] for w in waves]
+        np.testing.assert_allclose(expected, logpdf, atol=1e-9)
+
+        # A partition without a template gets the lowest log-likelihood of the others
+        template["mean"] = [np.array(m, dtype=float) for m in template["mean"]]
+        template["mean"][3][0] = np.nan
+        logpdf = TemplateMatcher(template, 'full').log_likelihoods(waves, 3)
+        np.testing.assert_allclose(np.min(np.array(expected)[:, 1:], axis=1), logpdf[:, 0])
+        np.testing.assert_allclose(np.array(expected)[:, 1:], logpdf[:, 1:], atol=1e-9)
+
 
 if __name__ == '__main__':
     unittest.main()